@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Re-validates stored request/response pairs without sending any traffic.
+
+Reads binary record logs written by requester.py --record_log and produces the
+same report and log files as a live run. Records are streamed, so memory use
+does not depend on the size of the logs.
+"""
+
+import optparse
+
+import log
+import requester
+
+
+def ReadRecordLogs(filenames):
+  """Reads records from several binary record logs.
+
+  Args:
+    filenames: A list of paths to record logs.
+
+  Yields:
+    A log.Record instance for each record in each log, in order.
+  """
+  for filename in filenames:
+    with open(filename, 'rb') as log_file:
+      for record in log.ReadRecordLog(log_file):
+        yield record
+
+
+def ReadRecordLogsNames(filenames):
+  """Reads the traffic classes and endpoints stored in record logs.
+
+  Args:
+    filenames: A list of paths to record logs.
+
+  Returns:
+    A (traffic class names, endpoint URLs) pair with the names of all the
+    logs, see log.ReadRecordLogNames.
+  """
+  request_classes = []
+  endpoints = []
+  for filename in filenames:
+    with open(filename, 'rb') as log_file:
+      log_classes, log_endpoints = log.ReadRecordLogNames(log_file)
+    request_classes.extend(log_classes)
+    endpoints.extend(log_endpoints)
+  return request_classes, endpoints
+
+
+def SetupCommandLineOptions():
+  """Sets up command line option parsing.
+
+  Returns:
+    An optparse.OptionParser object.
+  """
+  parser = optparse.OptionParser(
+      usage='%prog [options] RECORD_LOG [RECORD_LOG...]')
+  parser.add_option('--processes', type='int', default=1,
+                    help='Number of processes used to validate responses '
+                    '(1 by default).')
+  parser.add_option('--chunk_size', type='int',
+                    default=log.DEFAULT_CHUNK_SIZE,
+                    help='Number of records handed to a process at once '
+                    '(%d by default).' % log.DEFAULT_CHUNK_SIZE)
+  parser.add_option('--sample_encrypted_price', type='string',
+                    help='Use the given string as the encrypted price when'
+                    'rendering snippets.')
+  parser.add_option('--deadline_ms', type='int',
+                    default=log.DEFAULT_DEADLINE_MS,
+                    help='Responses slower than this many milliseconds are '
+                    'reported as deadline misses (%d by default).' %
+                    log.DEFAULT_DEADLINE_MS)
+  parser.add_option('--summary_file', type='string',
+                    help='Path to write a JSON summary of the results to.')
+  parser.add_option('--results_file', type='string',
+                    help='Path to write per-request metrics to, for later '
+                    'analysis with results.py.')
+  return parser
+
+
+def main():
+  parser = SetupCommandLineOptions()
+  opts, args = parser.parse_args()
+  if not args:
+    parser.error('at least one record log is required.')
+  if opts.processes < 1 or opts.chunk_size < 1:
+    parser.error('--processes and --chunk_size must be positive.')
+
+  summarizer = log.LogSummarizer(None, retain_records=False)
+  if opts.sample_encrypted_price:
+    summarizer.SetSampleEncryptedPrice(opts.sample_encrypted_price)
+  summarizer.SetDeadline(opts.deadline_ms)
+  request_classes, endpoints = ReadRecordLogsNames(args)
+  summarizer.SetRequestClasses(request_classes)
+  summarizer.SetEndpoints(endpoints)
+
+  log_files = requester.OpenLogFiles(requester.GetLogTimestamp())
+  summarizer.StreamLogFiles(*[log_file for _, log_file in log_files])
+  summarizer.SummarizeRecords(ReadRecordLogs(args), opts.processes,
+                              opts.chunk_size)
+  summarizer.FinishLogFiles()
+  requester.CloseLogFiles(log_files)
+
+  summarizer.PrintReport()
+  if opts.summary_file:
+    with open(opts.summary_file, 'w') as summary_file:
+      summarizer.WriteJsonSummary(summary_file)
+  if opts.results_file:
+    with open(opts.results_file, 'wb') as results_file:
+      summarizer.GetResults().Dump(results_file)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for analyze.py."""
+
+import os
+import StringIO
+import tempfile
+import unittest
+
+import analyze
+import log
+import realtime_bidding_pb2
+
+
+def CreateRecords():
+  """Returns a list of records covering every bucket.
+
+  Returns:
+    A list of log.Record instances with good, problematic, invalid and error
+    responses.
+  """
+  records = []
+  for i in range(20):
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id%d' % i
+    request_adslot = bid_request.adslot.add()
+    request_adslot.id = 123
+    bid_response = realtime_bidding_pb2.BidResponse()
+    bid_response.processing_time_ms = 10
+    ad = bid_response.ad.add()
+    ad.video_url = 'http://my.video.url.com'
+    ad.click_through_url.append('http://url.com')
+    adslot = ad.adslot.add()
+    adslot.id = 123
+    adslot.max_cpm_micros = 5000000
+    if i % 4 == 0:
+      bid_request.video.videoad_start_delay = 1000
+    status = 500 if i % 5 == 0 else 200
+    payload = 'garbage' if i % 7 == 0 else bid_response.SerializeToString()
+    records.append(log.Record(bid_request, status, payload, 1000.0 + i, 0.01))
+  return records
+
+
+class AnalyzeTest(unittest.TestCase):
+  """Tests the functions in the analyze module."""
+
+  def Analyze(self, processes):
+    """Summarizes CreateRecords() while streaming the log files.
+
+    Args:
+      processes: The number of processes to use.
+
+    Returns:
+      A (summary, log file contents) pair.
+    """
+    summarizer = log.LogSummarizer(None, retain_records=False)
+    log_files = [StringIO.StringIO() for _ in range(5)]
+    summarizer.StreamLogFiles(*log_files)
+    summarizer.SummarizeRecords(CreateRecords(), processes, chunk_size=3)
+    summarizer.FinishLogFiles()
+    return summarizer.GetSummary(), [f.getvalue() for f in log_files]
+
+  def testAnalyzeMatchesLiveRun(self):
+    """Tests that streaming gives the same results as a live run."""
+    summarizer = log.LogSummarizer(CreateRecords())
+    summarizer.Summarize()
+    log_files = [StringIO.StringIO() for _ in range(5)]
+    summarizer.WriteLogFiles(*log_files)
+
+    summary, contents = self.Analyze(1)
+    self.assertEqual(summarizer.GetSummary(), summary)
+    # The good, problematic, invalid and error logs are identical.
+    self.assertEqual([f.getvalue() for f in log_files[:4]], contents[:4])
+    for bucket in log.BUCKETS:
+      self.assertTrue(summary['buckets'][bucket] > 0)
+
+  def testAnalyzeInParallel(self):
+    """Tests that summarizing on several processes gives the same results."""
+    self.assertEqual(self.Analyze(1), self.Analyze(2))
+
+  def testReadRecordLogs(self):
+    """Tests reading several record logs in turn."""
+    records = CreateRecords()
+    filenames = []
+    try:
+      for chunk in [records[:5], records[5:]]:
+        handle, filename = tempfile.mkstemp()
+        filenames.append(filename)
+        with os.fdopen(handle, 'wb') as record_log:
+          log.WriteRecordLog(chunk, record_log)
+      read_records = list(analyze.ReadRecordLogs(filenames))
+    finally:
+      for filename in filenames:
+        os.remove(filename)
+    self.assertEqual([r.bid_request for r in records],
+                     [r.bid_request for r in read_records])
+
+  def testReadRecordLogsNames(self):
+    """Tests collecting the classes and endpoints of several logs."""
+    filenames = []
+    try:
+      for endpoint in ['http://a/', 'http://b/']:
+        handle, filename = tempfile.mkstemp()
+        filenames.append(filename)
+        with os.fdopen(handle, 'wb') as record_log:
+          log.WriteRecordLog([], record_log, ['mobile'], [endpoint])
+      self.assertEqual((['mobile', 'mobile'], ['http://a/', 'http://b/']),
+                       analyze.ReadRecordLogsNames(filenames))
+    finally:
+      for filename in filenames:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
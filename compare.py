@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Compares the results of requester runs to find performance regressions.
+
+Each run is given either as a JSON summary written with --summary_file or as a
+binary record log written with --record_log. The first run is the baseline,
+every other run is compared against it.
+"""
+
+import collections
+import json
+import math
+import optparse
+import sys
+
+import log
+
+
+DEFAULT_ALPHA = 0.01
+DEFAULT_LATENCY_TOLERANCE = 0.1
+DEFAULT_QPS_TOLERANCE = 0.05
+REGRESSION_EXIT_STATUS = 3
+
+# Rates compared between runs, and whether a higher rate is an improvement.
+RATE_METRICS = [
+    ('error_rate', False),
+    ('problem_rate', False),
+    ('deadline_miss_rate', False),
+    ('bid_rate', True),
+]
+
+# The result of comparing one metric between a baseline and a candidate run.
+# p_value is None when no significance test applies to the metric.
+Comparison = collections.namedtuple(
+    'Comparison', ['metric', 'baseline', 'candidate', 'p_value', 'regression'])
+
+
+def LoadSummary(filename):
+  """Loads a run summary from a JSON summary or a binary record log.
+
+  Args:
+    filename: Path to a file written by requester.py.
+
+  Returns:
+    A summary dictionary as returned by log.LogSummarizer.GetSummary.
+  """
+  with open(filename, 'rb') as summary_file:
+    if log.IsRecordLog(summary_file):
+      request_classes, endpoints = log.ReadRecordLogNames(summary_file)
+      summarizer = log.LogSummarizer(log.ReadRecordLog(summary_file))
+      summarizer.SetRequestClasses(request_classes)
+      summarizer.SetEndpoints(endpoints)
+      summarizer.Summarize()
+      return summarizer.GetSummary()
+    return json.load(summary_file)
+
+
+def TwoSidedPValue(z):
+  """Returns the two-sided p-value of a standard normal test statistic."""
+  return math.erfc(abs(z) / math.sqrt(2))
+
+
+def ProportionTest(successes1, trials1, successes2, trials2):
+  """Tests whether two proportions differ using a two-proportion z-test.
+
+  Args:
+    successes1: Number of successes in the first sample.
+    trials1: Size of the first sample.
+    successes2: Number of successes in the second sample.
+    trials2: Size of the second sample.
+
+  Returns:
+    The two-sided p-value, or None if either sample is empty.
+  """
+  if not trials1 or not trials2:
+    return None
+  pooled = float(successes1 + successes2) / (trials1 + trials2)
+  variance = pooled * (1 - pooled) * (1.0 / trials1 + 1.0 / trials2)
+  if not variance:
+    return 1.0
+  difference = float(successes2) / trials2 - float(successes1) / trials1
+  return TwoSidedPValue(difference / math.sqrt(variance))
+
+
+def MeanTest(mean1, stddev1, count1, mean2, stddev2, count2):
+  """Tests whether two means differ using Welch's test.
+
+  The normal approximation is used, which is accurate for the sample sizes of
+  a requester run.
+
+  Args:
+    mean1: Mean of the first sample.
+    stddev1: Sample standard deviation of the first sample.
+    count1: Size of the first sample.
+    mean2: Mean of the second sample.
+    stddev2: Sample standard deviation of the second sample.
+    count2: Size of the second sample.
+
+  Returns:
+    The two-sided p-value, or None if either sample is too small.
+  """
+  if count1 < 2 or count2 < 2:
+    return None
+  variance = stddev1 ** 2 / count1 + stddev2 ** 2 / count2
+  if not variance:
+    return float(mean1 == mean2)
+  return TwoSidedPValue((mean2 - mean1) / math.sqrt(variance))
+
+
+def CompareSummaries(baseline, candidate, alpha=DEFAULT_ALPHA,
+                     latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+                     qps_tolerance=DEFAULT_QPS_TOLERANCE):
+  """Compares two run summaries.
+
+  Rates and mean latency are flagged as regressions when they got worse and
+  the difference is significant at level alpha. Achieved QPS and latency
+  percentiles are single observations per run, so they are flagged when they
+  got worse by more than a relative tolerance.
+
+  Args:
+    baseline: The summary of the baseline run.
+    candidate: The summary of the run to compare against the baseline.
+    alpha: Significance level of the statistical tests.
+    latency_tolerance: Allowed relative increase of a latency percentile.
+    qps_tolerance: Allowed relative decrease of the achieved QPS.
+
+  Returns:
+    A list of Comparison tuples.
+  """
+  comparisons = []
+
+  qps1, qps2 = baseline['achieved_qps'], candidate['achieved_qps']
+  if qps1 and qps2:
+    comparisons.append(Comparison('achieved_qps', qps1, qps2, None,
+                                  qps2 < qps1 * (1 - qps_tolerance)))
+
+  latency1, latency2 = baseline['latency_ms'], candidate['latency_ms']
+  if latency1 and latency2:
+    p_value = MeanTest(latency1['mean'], latency1['stddev'], latency1['count'],
+                       latency2['mean'], latency2['stddev'], latency2['count'])
+    comparisons.append(Comparison(
+        'latency_ms.mean', latency1['mean'], latency2['mean'], p_value,
+        latency2['mean'] > latency1['mean'] and p_value is not None and
+        p_value < alpha))
+    for percentile in log.LATENCY_PERCENTILES:
+      key = log.PercentileKey(percentile)
+      comparisons.append(Comparison(
+          'latency_ms.' + key, latency1[key], latency2[key], None,
+          latency2[key] > latency1[key] * (1 + latency_tolerance)))
+
+  requests1, requests2 = baseline['requests_sent'], candidate['requests_sent']
+  for metric, higher_is_better in RATE_METRICS:
+    rate1, rate2 = baseline[metric], candidate[metric]
+    p_value = ProportionTest(int(round(rate1 * requests1)), requests1,
+                             int(round(rate2 * requests2)), requests2)
+    got_worse = rate2 < rate1 if higher_is_better else rate2 > rate1
+    comparisons.append(Comparison(
+        metric, rate1, rate2, p_value,
+        got_worse and p_value is not None and p_value < alpha))
+
+  problems1 = baseline['problem_counts']
+  problems2 = candidate['problem_counts']
+  for code in sorted(set(problems1) | set(problems2)):
+    count1 = min(problems1.get(code, 0), requests1)
+    count2 = min(problems2.get(code, 0), requests2)
+    p_value = ProportionTest(count1, requests1, count2, requests2)
+    rate1 = float(count1) / requests1 if requests1 else 0.0
+    rate2 = float(count2) / requests2 if requests2 else 0.0
+    comparisons.append(Comparison(
+        'problem_rate.' + code, rate1, rate2, p_value,
+        rate2 > rate1 and p_value is not None and p_value < alpha))
+
+  return comparisons
+
+
+def PrintComparisons(baseline_name, candidate_name, comparisons):
+  """Prints a comparison table.
+
+  Args:
+    baseline_name: A name for the baseline run.
+    candidate_name: A name for the candidate run.
+    comparisons: A list of Comparison tuples.
+  """
+  print '=== %s vs %s ===' % (baseline_name, candidate_name)
+  print '%-36s %14s %14s %9s %9s' % ('Metric', 'Baseline', 'Candidate',
+                                     'Change', 'p-value')
+  for comparison in comparisons:
+    change = '-'
+    if comparison.baseline:
+      change = '%+.1f%%' % (
+          100.0 * (comparison.candidate - comparison.baseline) /
+          comparison.baseline)
+    p_value = '-'
+    if comparison.p_value is not None:
+      p_value = '%.4f' % comparison.p_value
+    line = '%-36s %14.4f %14.4f %9s %9s' % (
+        comparison.metric, comparison.baseline, comparison.candidate, change,
+        p_value)
+    if comparison.regression:
+      line += '  REGRESSION'
+    print line
+
+
+def SetupCommandLineOptions():
+  """Sets up command line option parsing.
+
+  Returns:
+    An optparse.OptionParser object.
+  """
+  parser = optparse.OptionParser(
+      usage='%prog [options] BASELINE CANDIDATE [CANDIDATE...]')
+  parser.add_option('--alpha', type='float', default=DEFAULT_ALPHA,
+                    help='Significance level of the statistical tests '
+                    '(%g by default).' % DEFAULT_ALPHA)
+  parser.add_option('--latency_tolerance', type='float',
+                    default=DEFAULT_LATENCY_TOLERANCE,
+                    help='Relative increase of a latency percentile that is '
+                    'flagged as a regression (%g by default).' %
+                    DEFAULT_LATENCY_TOLERANCE)
+  parser.add_option('--qps_tolerance', type='float',
+                    default=DEFAULT_QPS_TOLERANCE,
+                    help='Relative decrease of the achieved QPS that is '
+                    'flagged as a regression (%g by default).' %
+                    DEFAULT_QPS_TOLERANCE)
+  return parser
+
+
+def main():
+  parser = SetupCommandLineOptions()
+  opts, args = parser.parse_args()
+  if len(args) < 2:
+    parser.error('at least two runs are required.')
+
+  baseline = LoadSummary(args[0])
+  regressions = 0
+  for filename in args[1:]:
+    comparisons = CompareSummaries(baseline, LoadSummary(filename), opts.alpha,
+                                   opts.latency_tolerance, opts.qps_tolerance)
+    PrintComparisons(args[0], filename, comparisons)
+    regressions += len([c for c in comparisons if c.regression])
+
+  if regressions:
+    print 'Found %d regressions.' % regressions
+    sys.exit(REGRESSION_EXIT_STATUS)
+
+
+if __name__ == '__main__':
+  main()
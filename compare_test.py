@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for compare.py."""
+
+import json
+import os
+import tempfile
+import unittest
+
+import compare
+import log
+import realtime_bidding_pb2
+
+
+def CreateSummary(requests_sent=10000, mean=20.0, p99=50.0, error_rate=0.01,
+                  achieved_qps=100.0, problem_counts=None):
+  """Returns a minimal run summary.
+
+  Args:
+    requests_sent: Number of requests in the run.
+    mean: Mean latency in milliseconds.
+    p99: Every latency percentile in milliseconds.
+    error_rate: Fraction of requests with errors.
+    achieved_qps: Achieved queries per second.
+    problem_counts: A map of problem code -> count, or None for no problems.
+
+  Returns:
+    A dictionary with the keys of log.LogSummarizer.GetSummary used by
+    compare.CompareSummaries.
+  """
+  latency_ms = {'mean': mean, 'stddev': 5.0, 'count': requests_sent}
+  for percentile in log.LATENCY_PERCENTILES:
+    latency_ms[log.PercentileKey(percentile)] = p99
+  return {
+      'requests_sent': requests_sent,
+      'achieved_qps': achieved_qps,
+      'latency_ms': latency_ms,
+      'error_rate': error_rate,
+      'problem_rate': 0.0,
+      'deadline_miss_rate': 0.0,
+      'bid_rate': 0.5,
+      'problem_counts': problem_counts or {},
+  }
+
+
+class CompareTest(unittest.TestCase):
+  """Tests the functions in the compare module."""
+
+  def GetRegressions(self, comparisons):
+    """Returns the names of the metrics flagged as regressions."""
+    return [c.metric for c in comparisons if c.regression]
+
+  def testProportionTest(self):
+    """Tests the two-proportion z-test."""
+    self.assertEqual(1.0, compare.ProportionTest(0, 100, 0, 100))
+    self.assertAlmostEqual(1.0, compare.ProportionTest(10, 100, 10, 100))
+    self.assertTrue(compare.ProportionTest(10, 1000, 50, 1000) < 0.001)
+    self.assertTrue(compare.ProportionTest(10, 100, 12, 100) > 0.5)
+    self.assertEqual(None, compare.ProportionTest(0, 0, 1, 10))
+
+  def testMeanTest(self):
+    """Tests Welch's test for means."""
+    self.assertAlmostEqual(1.0, compare.MeanTest(10, 2, 100, 10, 2, 100))
+    self.assertTrue(compare.MeanTest(10, 2, 1000, 11, 2, 1000) < 0.001)
+    self.assertTrue(compare.MeanTest(10, 20, 10, 11, 20, 10) > 0.5)
+    self.assertEqual(None, compare.MeanTest(10, 2, 1, 10, 2, 100))
+    self.assertEqual(0.0, compare.MeanTest(10, 0, 10, 11, 0, 10))
+
+  def testCompareIdenticalSummaries(self):
+    """Tests that identical runs show no regressions."""
+    comparisons = compare.CompareSummaries(CreateSummary(), CreateSummary())
+    self.assertEqual([], self.GetRegressions(comparisons))
+
+  def testCompareFlagsRegressions(self):
+    """Tests that significantly worse metrics are flagged."""
+    comparisons = compare.CompareSummaries(
+        CreateSummary(),
+        CreateSummary(mean=25.0, p99=60.0, error_rate=0.05, achieved_qps=80.0,
+                      problem_counts={'zero-bid': 200}))
+    regressions = self.GetRegressions(comparisons)
+    self.assertTrue('achieved_qps' in regressions)
+    self.assertTrue('latency_ms.mean' in regressions)
+    self.assertTrue('latency_ms.p99' in regressions)
+    self.assertTrue('error_rate' in regressions)
+    self.assertTrue('problem_rate.zero-bid' in regressions)
+
+  def testCompareIgnoresImprovements(self):
+    """Tests that better metrics are not flagged."""
+    comparisons = compare.CompareSummaries(
+        CreateSummary(mean=25.0, p99=60.0, error_rate=0.05,
+                      problem_counts={'zero-bid': 200}),
+        CreateSummary(achieved_qps=150.0))
+    self.assertEqual([], self.GetRegressions(comparisons))
+
+  def testCompareWithinTolerance(self):
+    """Tests that small percentile and QPS changes are not flagged."""
+    comparisons = compare.CompareSummaries(
+        CreateSummary(), CreateSummary(p99=52.0, achieved_qps=98.0))
+    self.assertEqual([], self.GetRegressions(comparisons))
+
+  def testLoadSummary(self):
+    """Tests loading JSON summaries and binary record logs."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id111'
+    records = [log.Record(bid_request, 500, 'error', 1000.0, 0.01)]
+    handle, filename = tempfile.mkstemp()
+    os.close(handle)
+    try:
+      with open(filename, 'wb') as record_log:
+        log.WriteRecordLog(records, record_log)
+      summary = compare.LoadSummary(filename)
+      self.assertEqual(1, summary['requests_sent'])
+      self.assertEqual(1, summary['buckets']['error'])
+
+      with open(filename, 'w') as summary_file:
+        json.dump(summary, summary_file)
+      self.assertEqual(summary, compare.LoadSummary(filename))
+    finally:
+      os.remove(filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
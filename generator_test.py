@@ -2,10 +2,12 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """Unit tests for generator.py."""
 
+import StringIO
 import unittest
 
 import generator
 import realtime_bidding_pb2
+import sampling
 
 
 class RandomBidGeneratorTest(unittest.TestCase):
@@ -219,6 +221,474 @@ class RandomBidGeneratorTest(unittest.TestCase):
     bid_request2 = mobile_generator.GenerateBidRequest()
     self.assertNotEqual(bid_request1, bid_request2)
 
+  def testSeededGeneratorsAreReproducible(self):
+    """Tests that the same seed and stream give the same requests."""
+    generator1 = generator.RandomBidGeneratorWrapper(seed=1234, stream=5)
+    generator2 = generator.RandomBidGeneratorWrapper(seed=1234, stream=5)
+    for _ in range(10):
+      self.assertEqual(generator1.GenerateBidRequest(),
+                       generator2.GenerateBidRequest())
+    self.assertEqual(generator1.GeneratePingRequest(),
+                     generator2.GeneratePingRequest())
+
+  def testRegenerateRequestByIndex(self):
+    """Tests regenerating a request from its index in the stream."""
+    generator_obj = generator.RandomBidGeneratorWrapper(seed=1234)
+    bid_requests = [generator_obj.GenerateBidRequest() for _ in range(5)]
+    self.assertEqual(bid_requests[3], generator_obj.GenerateBidRequest(3))
+    self.assertEqual(bid_requests[4], generator_obj.GenerateBidRequest())
+    other_generator = generator.RandomBidGeneratorWrapper(seed=1234)
+    self.assertEqual(bid_requests[2], other_generator.GenerateBidRequest(2))
+
+  def testStreamsAreIndependent(self):
+    """Tests that streams and seeds give different requests."""
+    bid_request = generator.RandomBidGeneratorWrapper(
+        seed=1234, stream=0).GenerateBidRequest()
+    self.assertNotEqual(bid_request, generator.RandomBidGeneratorWrapper(
+        seed=1234, stream=1).GenerateBidRequest())
+    self.assertNotEqual(bid_request, generator.RandomBidGeneratorWrapper(
+        seed=1235, stream=0).GenerateBidRequest())
+
+  def testGenerateBatches(self):
+    """Tests that batches of every kind of request are well formed."""
+    for video, mobile in [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0)]:
+      generator_obj = generator.RandomBidGeneratorWrapper(
+          instream_video_proportion=video, mobile_proportion=mobile)
+      bid_requests = generator_obj.GenerateBidRequests(20)
+      self.assertEqual(20, len(bid_requests))
+      for bid_request in bid_requests:
+        self.CheckCommonBidRequest(bid_request)
+        self.assertEqual(video == 1.0, bid_request.HasField('video'))
+        self.assertEqual(mobile == 1.0, bid_request.HasField('mobile'))
+      self.assertNotEqual(bid_requests[0], bid_requests[1])
+
+  def testRegenerateBatchRequestByIndex(self):
+    """Tests that batched requests only depend on their index."""
+    generator_obj = generator.RandomBidGeneratorWrapper(seed=1234)
+    bid_requests = generator_obj.GenerateBidRequests(10)
+    self.assertEqual(bid_requests[7],
+                     generator_obj.GenerateBidRequests(1, 7)[0])
+    self.assertEqual(bid_requests[3:], generator.RandomBidGeneratorWrapper(
+        seed=1234).GenerateBidRequests(7, 3))
+
+  def testBatchesWithoutNumpy(self):
+    """Tests that the plain Python fallback draws the same requests."""
+    bid_requests = generator.RandomBidGeneratorWrapper(
+        seed=1234).GenerateBidRequests(10)
+    numpy = generator.numpy
+    generator.numpy = None
+    try:
+      self.assertEqual(bid_requests, generator.RandomBidGeneratorWrapper(
+          seed=1234).GenerateBidRequests(10))
+    finally:
+      generator.numpy = numpy
+
+  def testBatchAdGroupIdsFromList(self):
+    """Tests batches with AdGroup IDs from a list."""
+    adgroup_ids = [5642578842, 5663180187, 5663180325]
+    generator_obj = generator.DefaultBidGenerator(
+        adgroup_ids_list=adgroup_ids)
+    for bid_request in generator_obj.GenerateBidRequests(10):
+      for matching_ad_data in bid_request.adslot[0].matching_ad_data:
+        self.assertTrue(matching_ad_data.adgroup_id in adgroup_ids)
+
+  def testAdGroupIdPool(self):
+    """Tests that generators share one pool of distinct AdGroup IDs."""
+    pool = generator.AdGroupIdPool([5642578842, 5663180187, 5642578842, 7])
+    self.assertEqual([5642578842, 5663180187, 7], list(pool))
+    self.assertTrue(generator.AdGroupIdPool(pool) is pool)
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        adgroup_ids_list=[5642578842, 5663180187, 7],
+        instream_video_proportion=0.3, mobile_proportion=0.3)
+    generators = [generator_instance
+                  for _, generator_instance, _ in generator_obj._classes]
+    self.assertEqual(3, len(generators))
+    for generator_instance in generators:
+      self.assertTrue(generator_instance._adgroup_ids is
+                      generators[0]._adgroup_ids)
+    for bid_request in (generator_obj.GenerateBidRequests(20) +
+                        [generator_obj.GenerateBidRequest()]):
+      adgroup_ids = [ad_data.adgroup_id
+                     for ad_data in bid_request.adslot[0].matching_ad_data]
+      self.assertTrue(set(adgroup_ids) <= set(pool))
+      self.assertEqual(len(set(adgroup_ids)), len(adgroup_ids))
+
+  def testGenerateBidRequestInBatches(self):
+    """Tests that GenerateBidRequest can serve requests from batches."""
+    generator_obj = generator.RandomBidGeneratorWrapper(seed=1234,
+                                                        batch_size=4)
+    bid_requests = [generator_obj.GenerateBidRequest() for _ in range(6)]
+    self.assertEqual(bid_requests, generator.RandomBidGeneratorWrapper(
+        seed=1234).GenerateBidRequests(6))
+    self.assertEqual(bid_requests[5], generator_obj.GenerateBidRequest(5))
+
+  def testSplicedRequestsMatchBatches(self):
+    """Tests that spliced requests are the serialized batched requests."""
+    for google_ids in [None, ['a', 'bb', 'ccc']]:
+      generator_obj = generator.RandomBidGeneratorWrapper(
+          google_ids, instream_video_proportion=0.3, mobile_proportion=0.3,
+          seed=1234)
+      serialized_requests = generator_obj.GenerateSerializedBidRequests(100)
+      bid_requests = generator_obj.GenerateBidRequests(100, 0)
+      self.assertEqual([r.SerializeToString() for r in bid_requests],
+                       serialized_requests)
+    generator_obj = generator.DefaultBidGenerator(
+        adgroup_ids_list=[5642578842, 5663180187, 5663180325])
+    self.assertEqual(
+        [r.SerializeToString() for r in generator_obj.GenerateBidRequests(20)],
+        generator_obj.GenerateSerializedBidRequests(20, 0))
+
+  def testGenerateSplicedBidRequest(self):
+    """Tests that GenerateBidRequest can return spliced requests."""
+    generator_obj = generator.RandomBidGeneratorWrapper(seed=1234,
+                                                        batch_size=4,
+                                                        splice=True)
+    serialized_requests = [generator_obj.GenerateBidRequest()
+                           for _ in range(6)]
+    self.assertEqual(serialized_requests, generator.RandomBidGeneratorWrapper(
+        seed=1234).GenerateSerializedBidRequests(6))
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.ParseFromString(generator_obj.GenerateBidRequest(5))
+    self.CheckCommonBidRequest(bid_request)
+
+  def testLoadDistributions(self):
+    """Tests loading and validating a distribution file."""
+    weights = [1] + [0] * (len(generator.DIMENSIONS) - 2) + [0.5]
+    distributions = generator.LoadDistributions(StringIO.StringIO(
+        '{"dimensions": %s}' % weights))
+    self.assertEqual(['dimensions'], distributions.keys())
+    self.assertEqual(2, distributions['dimensions'].PositiveCount())
+    for contents in ['[]', '{"colors": [1]}', '{"languages": [1, 2]}',
+                     '{"languages": "1"}', '{"languages": [0]}', 'not json']:
+      self.assertRaises(ValueError, generator.LoadDistributions,
+                        StringIO.StringIO(contents))
+
+  def testWeightedDistributions(self):
+    """Tests that elements with a weight of 0 are never generated."""
+    geo_weights = [0] * len(generator.GEO_CRITERIA)
+    geo_weights[3] = 1
+    device_weights = [0] * len(generator.MOBILE_DEVICE_INFO)
+    device_weights[1] = 1
+    vendor_weights = [1] * len(generator.MOBILE_VENDOR_TYPES)
+    vendor_weights[0] = 0
+    distributions = {
+        'geo_criteria': sampling.AliasTable(geo_weights),
+        'mobile_devices': sampling.AliasTable(device_weights),
+        'mobile_vendor_types': sampling.AliasTable(vendor_weights),
+    }
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        instream_video_proportion=0.0, mobile_proportion=1.0, seed=1234,
+        distributions=distributions)
+    bid_requests = generator_obj.GenerateBidRequests(50)
+    bid_requests.extend(generator_obj.GenerateBidRequest(i)
+                        for i in range(50, 60))
+    for bid_request in bid_requests:
+      self.assertEqual(generator.GEO_CRITERIA[3][0],
+                       bid_request.geo_criteria_id)
+      self.assertEqual(generator.MOBILE_DEVICE_INFO[1][0],
+                       bid_request.mobile.platform)
+      for adslot in bid_request.adslot:
+        self.assertFalse(generator.MOBILE_VENDOR_TYPES[0] in
+                         adslot.allowed_vendor_type)
+    self.assertEqual(
+        [r.SerializeToString() for r in bid_requests[:50]],
+        generator_obj.GenerateSerializedBidRequests(50, 0))
+
+  def testWeightedBatchesWithoutNumpy(self):
+    """Tests that weighted batches do not depend on NumPy."""
+    distributions = generator.LoadDistributions(StringIO.StringIO(
+        '{"verticals": [%s], "geo_criteria": [%s]}' % (
+            ', '.join(['1', '2', '3'] * 5 + ['0', '1']),
+            ', '.join(['5'] + ['1'] * (len(generator.GEO_CRITERIA) - 1)))))
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        instream_video_proportion=0.3, mobile_proportion=0.3, seed=1234,
+        distributions=distributions)
+    bid_requests = generator_obj.GenerateBidRequests(30)
+    numpy = generator.numpy, sampling.numpy
+    generator.numpy = sampling.numpy = None
+    try:
+      self.assertEqual(bid_requests, generator_obj.GenerateBidRequests(30, 0))
+    finally:
+      generator.numpy, sampling.numpy = numpy
+
+  def testCountDistributions(self):
+    """Tests generating requests with weighted numbers of elements."""
+    distributions = generator.LoadDistributions(StringIO.StringIO(
+        '{"adslot_counts": [0, 1, 1, 1], "adgroup_counts": [0, 0, 0, 0, 1],'
+        ' "direct_deal_counts": [1, 0, 1], "vertical_counts": [1, 0, 1],'
+        ' "user_list_counts": [0, 0, 0, 1]}'))
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        instream_video_proportion=0.3, mobile_proportion=0.3, seed=1234,
+        distributions=distributions)
+    bid_requests = generator_obj.GenerateBidRequests(50)
+    bid_requests.extend(generator_obj.GenerateBidRequest(i)
+                        for i in range(50, 60))
+    slot_counts = set()
+    for bid_request in bid_requests:
+      slot_counts.add(len(bid_request.adslot))
+      self.assertTrue(len(bid_request.detected_vertical) in (0, 2))
+      self.assertEqual(3, len(bid_request.user_list))
+      first_slot = bid_request.adslot[0]
+      for j, adslot in enumerate(bid_request.adslot):
+        self.assertEqual((first_slot.id + j - 1) % generator.MAX_SLOT_ID + 1,
+                         adslot.id)
+        self.assertEqual(first_slot.width, adslot.width)
+        self.assertEqual(4, len(adslot.matching_ad_data))
+        for ad_data in adslot.matching_ad_data:
+          self.assertTrue(len(ad_data.direct_deal) in (0, 2))
+          if ad_data.direct_deal:
+            self.assertEqual(
+                min(deal.fixed_cpm_micros for deal in ad_data.direct_deal),
+                ad_data.minimum_cpm_micros)
+    self.assertEqual(set([1, 2, 3]), slot_counts)
+    self.assertEqual(
+        [r.SerializeToString() for r in bid_requests[:50]],
+        generator_obj.GenerateSerializedBidRequests(50, 0))
+    numpy = generator.numpy, sampling.numpy
+    generator.numpy = sampling.numpy = None
+    try:
+      self.assertEqual(bid_requests[:50],
+                       generator_obj.GenerateBidRequests(50, 0))
+    finally:
+      generator.numpy, sampling.numpy = numpy
+    for contents in ['{"adslot_counts": [1, 1]}',
+                     '{"vertical_counts": %s}' % ([1] * 19)]:
+      self.assertRaises(ValueError, generator.LoadDistributions,
+                        StringIO.StringIO(contents))
+
+  def testPopularity(self):
+    """Tests that users and adgroups come from populations when popular."""
+    distributions = generator.PopularityDistributions(
+        'zipf:1.5', 50, 'hotset:0.2:1', 'zipf:1', 20)
+    self.assertEqual(
+        set(['google_user_ids', 'branded_publishers', 'anonymous_publishers',
+             'adgroup_ids']), set(distributions))
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        instream_video_proportion=0.3, mobile_proportion=0.3, seed=1234,
+        distributions=distributions)
+    users = set(generator.PopulationUserId(1234, user) for user in range(50))
+    adgroups = set(generator.PopulationAdGroupId(1234, adgroup)
+                   for adgroup in range(20))
+    bid_requests = generator_obj.GenerateBidRequests(100)
+    bid_requests.extend(generator_obj.GenerateBidRequest(i)
+                        for i in range(100, 200))
+    for bid_request in bid_requests:
+      self.assertTrue(bid_request.google_user_id in users)
+      self.assertTrue(bid_request.publisher_settings_list_id in
+                      (generator.BRANDED_PUB_DATA[0][2],
+                       generator.ANONYMOUS_PUB_DATA[0][1]))
+      adgroup_ids = [ad_data.adgroup_id
+                     for ad_data in bid_request.adslot[0].matching_ad_data]
+      self.assertTrue(set(adgroup_ids) <= adgroups)
+      self.assertEqual(len(set(adgroup_ids)), len(adgroup_ids))
+    self.assertTrue(len(set(r.google_user_id for r in bid_requests)) < 50)
+    self.assertEqual(
+        [r.SerializeToString() for r in bid_requests[:100]],
+        generator_obj.GenerateSerializedBidRequests(100, 0))
+    self.assertRaises(ValueError, generator.PopularityDistributions,
+                      'zipf:x')
+
+  def testPopularityOfLists(self):
+    """Tests that the populations of users and adgroups can be lists."""
+    distributions = generator.PopularityDistributions(
+        'hotset:0.5:1', 2, adgroup_popularity='hotset:0.5:1',
+        adgroup_population=2)
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        ['a', 'b'], adgroup_ids_list=[7, 8], distributions=distributions)
+    for bid_request in (generator_obj.GenerateBidRequests(10) +
+                        [generator_obj.GenerateBidRequest()]):
+      self.assertEqual('a', bid_request.google_user_id)
+      self.assertEqual([7], [ad_data.adgroup_id for ad_data in
+                             bid_request.adslot[0].matching_ad_data])
+
+  def testImpliedRepeatRates(self):
+    """Tests the repeat rates of users, publishers and adgroups."""
+    self.assertEqual({}, generator.ImpliedRepeatRates(None, 100))
+    repeat_rates = generator.ImpliedRepeatRates(None, 100, ['a', 'b'])
+    self.assertAlmostEqual(0.98, repeat_rates['google_user_id'])
+    distributions = generator.PopularityDistributions(
+        'zipf:1', 1000, 'uniform', 'hotset:0.001:1', 1000)
+    repeat_rates = generator.ImpliedRepeatRates(distributions, 1000)
+    self.assertEqual(set(['google_user_id', 'publisher', 'adgroup_id']),
+                     set(repeat_rates))
+    self.assertTrue(0 < repeat_rates['google_user_id'] < 0.9)
+    self.assertAlmostEqual(
+        1 - len(generator.DISTRIBUTION_TABLES['branded_publishers'] +
+                generator.DISTRIBUTION_TABLES['anonymous_publishers']) /
+        1000.0, repeat_rates['publisher'])
+    # A single hot adgroup matches once per request.
+    self.assertAlmostEqual(0.999, repeat_rates['adgroup_id'])
+    # Or once per ad slot.
+    distributions['adslot_counts'] = sampling.AliasTable([0, 0, 1])
+    distributions['adgroup_counts'] = sampling.AliasTable([0, 0, 0, 1])
+    repeat_rates = generator.ImpliedRepeatRates(distributions, 1000)
+    self.assertAlmostEqual(0.9995, repeat_rates['adgroup_id'])
+
+  def testSessions(self):
+    """Tests that session users keep their fields across requests."""
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        instream_video_proportion=0.3, mobile_proportion=0.3, seed=1234,
+        session_users=5, session_length='fixed:3', think_time='fixed:1')
+    bid_requests = generator_obj.GenerateBidRequests(60)
+    users = {}
+    for bid_request in bid_requests:
+      users.setdefault(bid_request.google_user_id, []).append(bid_request)
+    # Every session has 3 requests of a new user.
+    self.assertEqual(20, len(users))
+    for user_requests in users.values():
+      self.assertEqual(3, len(user_requests))
+      first = user_requests[0]
+      for bid_request in user_requests:
+        self.assertEqual(first.geo_criteria_id, bid_request.geo_criteria_id)
+        self.assertEqual(first.user_agent, bid_request.user_agent)
+        self.assertEqual(first.HasField('mobile'),
+                         bid_request.HasField('mobile'))
+        self.assertEqual(first.mobile.platform, bid_request.mobile.platform)
+      # Requests of a session are a think time of a second apart.
+      self.assertEqual([first.cookie_age_seconds + i for i in range(3)],
+                       [r.cookie_age_seconds for r in user_requests])
+    self.assertEqual(bid_requests[7], generator_obj.GenerateBidRequest(7))
+    self.assertEqual(bid_requests[:30],
+                     generator_obj.GenerateBidRequests(30, 0))
+    self.assertEqual(
+        [r.SerializeToString() for r in bid_requests[30:]],
+        generator_obj.GenerateSerializedBidRequests(30, 30))
+    self.assertEqual(3, generator.MeanSessionLength('fixed:3'))
+    self.assertRaises(ValueError, generator.RandomBidGeneratorWrapper,
+                      session_users=5, think_time='exponential')
+
+  def testSessionPopulation(self):
+    """Tests that users of a population keep their fields across sessions."""
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        ['a', 'b', 'c'], seed=1234, session_users=2)
+    users = {}
+    for bid_request in generator_obj.GenerateBidRequests(50):
+      first = users.setdefault(bid_request.google_user_id, bid_request)
+      self.assertEqual(first.geo_criteria_id, bid_request.geo_criteria_id)
+      self.assertEqual(first.user_agent, bid_request.user_agent)
+    self.assertEqual(set(['a', 'b', 'c']), set(users))
+    repeat_rates = generator.ImpliedRepeatRates(None, 100,
+                                                mean_session_length=4)
+    self.assertAlmostEqual(0.75, repeat_rates['google_user_id'])
+
+  def testLoadTrafficMix(self):
+    """Tests loading and validating a traffic mix file."""
+    traffic_mix = generator.LoadTrafficMix(StringIO.StringIO(
+        '{"ping_proportion": 0.05, "classes": ['
+        '{"name": "display", "weight": 3},'
+        '{"name": "multislot", "generator": "display", "weight": 1,'
+        ' "distributions": {"adslot_counts": [0, 0, 1]}}]}'))
+    self.assertEqual(0.05, traffic_mix.ping_proportion)
+    self.assertEqual([('display', 'display', 3), ('multislot', 'display', 1)],
+                     [(traffic_class.name, traffic_class.generator,
+                       traffic_class.weight)
+                      for traffic_class in traffic_mix.classes])
+    self.assertEqual(['adslot_counts'],
+                     traffic_mix.classes[1].distributions.keys())
+    self.assertEqual(generator.DEFAULT_PING_PROPORTION,
+                     generator.LoadTrafficMix(StringIO.StringIO(
+                         '{"classes": [{"name": "video", "weight": 1}]}'))
+                     .ping_proportion)
+    for contents in [
+        '[]', '{"classes": {}}', '{"classes": [], "pings": 0.1}',
+        '{"classes": []}', '{"classes": [{"name": "video", "weight": 0}]}',
+        '{"classes": [{"name": "video"}]}',
+        '{"classes": [{"name": "video", "weight": -1}]}',
+        '{"classes": [{"name": "audio", "weight": 1}]}',
+        '{"classes": [{"name": "ping", "generator": "video", "weight": 1}]}',
+        '{"classes": [{"name": "video", "weight": 1},'
+        ' {"name": "video", "weight": 1}]}',
+        '{"classes": [{"name": "video", "weight": 1, "size": 2}]}',
+        '{"classes": [{"name": "video", "weight": 1,'
+        ' "distributions": {"colors": [1]}}]}',
+        '{"classes": [{"name": "video", "weight": 1}],'
+        ' "ping_proportion": 2}',
+        '{"classes": [{"name": "%s", "generator": "video", "weight": 1}]}' %
+        ('v' * (generator.MAX_CLASS_NAME_LENGTH + 1))]:
+      self.assertRaises(ValueError, generator.LoadTrafficMix,
+                        StringIO.StringIO(contents))
+
+  def testTrafficClasses(self):
+    """Tests that requests are generated by the class picked for them."""
+    traffic_mix = generator.LoadTrafficMix(StringIO.StringIO(
+        '{"classes": ['
+        '{"name": "display", "weight": 1},'
+        '{"name": "multislot", "generator": "display", "weight": 1,'
+        ' "distributions": {"adslot_counts": [0, 0, 0, 1]}},'
+        '{"name": "tablet", "generator": "mobile", "weight": 1},'
+        '{"name": "unused", "generator": "video", "weight": 0}]}'))
+    generator_obj = generator.RandomBidGeneratorWrapper(
+        seed=1234, traffic_classes=traffic_mix.classes)
+    request_classes = set()
+    for index in range(60):
+      bid_request = generator_obj.GenerateBidRequest()
+      request_class = generator_obj.GetRequestClass()
+      request_classes.add(request_class)
+      self.assertEqual(request_class == 'multislot',
+                       len(bid_request.adslot) == 3)
+      self.assertEqual(request_class == 'tablet',
+                       bid_request.HasField('mobile'))
+      self.assertFalse(bid_request.HasField('video'))
+      self.assertEqual(bid_request, generator_obj.GenerateBidRequest(index))
+    self.assertEqual(set(['display', 'multislot', 'tablet']), request_classes)
+    generator_obj.GeneratePingRequest()
+    self.assertEqual(generator.PING_CLASS, generator_obj.GetRequestClass())
+
+    # Batches, and session users, which only send mobile requests if they
+    # are mobile users.
+    for options in [{'batch_size': 7}, {'batch_size': 7, 'splice': True},
+                    {'session_users': 5}]:
+      generator_obj = generator.RandomBidGeneratorWrapper(
+          seed=1234, traffic_classes=traffic_mix.classes, **options)
+      for _ in range(30):
+        bid_request = generator_obj.GenerateBidRequest()
+        if isinstance(bid_request, str):
+          bid_request = realtime_bidding_pb2.BidRequest.FromString(
+              bid_request)
+        request_class = generator_obj.GetRequestClass()
+        self.assertEqual(request_class == 'multislot',
+                         len(bid_request.adslot) == 3)
+        self.assertEqual(request_class == 'tablet',
+                         bid_request.HasField('mobile'))
+
+  def testRegisterGenerator(self):
+    """Tests traffic classes of a registered generator with parameters."""
+
+    class FixedSlotGenerator(generator.DefaultBidGenerator):
+      """Generates requests with a fixed slot size."""
+
+      def __init__(self, google_id_list, adgroup_ids_list, random_stream,
+                   distributions, width, height):
+        generator.DefaultBidGenerator.__init__(
+            self, google_id_list, adgroup_ids_list, random_stream,
+            distributions)
+        self._slot_width = width
+        self._slot_height = height
+
+    generator.RegisterGenerator('fixed-slot', FixedSlotGenerator)
+    try:
+      traffic_mix = generator.LoadTrafficMix(StringIO.StringIO(
+          '{"classes": [{"name": "banner", "generator": "fixed-slot",'
+          ' "weight": 1, "parameters": {"width": 728, "height": 90}}]}'))
+      generator_obj = generator.RandomBidGeneratorWrapper(
+          traffic_classes=traffic_mix.classes)
+      for bid_request in generator_obj.GenerateBidRequests(5):
+        self.assertEqual([728], bid_request.adslot[0].width)
+        self.assertEqual([90], bid_request.adslot[0].height)
+    finally:
+      del generator.GENERATORS['fixed-slot']
+
+  def testDeriveSeed(self):
+    """Tests that derived seeds depend on every argument."""
+    seeds = set([generator.DeriveSeed(1, 2, 3, 'a'),
+                 generator.DeriveSeed(2, 2, 3, 'a'),
+                 generator.DeriveSeed(1, 3, 3, 'a'),
+                 generator.DeriveSeed(1, 2, 4, 'a'),
+                 generator.DeriveSeed(1, 2, 3, 'b')])
+    self.assertEqual(5, len(seeds))
+    self.assertEqual(generator.DeriveSeed(1, 2, 3, 'a'),
+                     generator.DeriveSeed(1, 2, 3, 'a'))
+
   def testGeneratedPublisherData(self):
     """Checks if populated publisher data is correct."""
     bid_request = self.generator.GenerateBidRequest()
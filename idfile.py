@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Reads IDs from very large files, one ID per line, without loading them.
+
+An IdFile memory-maps the ID file and an index of the offset of each ID, so
+that opening a file of tens of millions of IDs takes no more memory than the
+pages that are used, shared by all threads and processes reading the same
+file, and any ID is read in constant time. The index is built by scanning the
+file once and saved next to it, so that later runs start immediately.
+"""
+
+import mmap
+import os
+import struct
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Suffix of the path of the index of an ID file.
+INDEX_SUFFIX = '.index'
+
+# Index files start with INDEX_MAGIC, the size and the modification time in
+# microseconds of the ID file they index, followed by the little-endian 64
+# bit offset of each ID.
+INDEX_MAGIC = 'RTBIDX01'
+INDEX_HEADER = struct.Struct('<8sqq')
+_OFFSET = struct.Struct('<q')
+
+# Bytes of the ID file scanned at a time when building an index with NumPy.
+_SCAN_CHUNK_SIZE = 1 << 24
+# Offsets packed at a time when building an index without NumPy.
+_PACK_COUNT = 1 << 16
+
+
+def _FileVersion(filename):
+  """Returns the (size, modification time in microseconds) of a file."""
+  stat = os.stat(filename)
+  return stat.st_size, int(stat.st_mtime * 1000000)
+
+
+def _MapFile(filename):
+  """Returns a read-only memory map of a whole file, or '' if it is empty."""
+  with open(filename, 'rb') as mapped_file:
+    if not os.fstat(mapped_file.fileno()).st_size:
+      return ''
+    return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _ScanOffsets(data):
+  """Returns the offsets of the non-empty lines of data.
+
+  Args:
+    data: A string or memory map.
+
+  Returns:
+    The offsets as little-endian 64 bit integers, in a string.
+  """
+  size = len(data)
+  if numpy is not None:
+    newlines = [numpy.zeros(1, dtype=numpy.int64) - 1]
+    for start in xrange(0, size, _SCAN_CHUNK_SIZE):
+      chunk = numpy.frombuffer(data[start:start + _SCAN_CHUNK_SIZE],
+                               dtype=numpy.uint8)
+      newlines.append(numpy.flatnonzero(chunk == ord('\n')) + start)
+    newlines.append(numpy.array([size], dtype=numpy.int64))
+    newlines = numpy.concatenate(newlines)
+    starts = newlines[:-1] + 1
+    lengths = newlines[1:] - starts
+    # Lines that are empty, or only hold the '\r' of a '\r\n' line ending.
+    blank = lengths == 0
+    for position in numpy.flatnonzero(lengths == 1):
+      blank[position] = data[starts[position]] == '\r'
+    return starts[~blank].astype('<i8').tostring()
+  offsets = []
+  start = 0
+  while start < size:
+    end = data.find('\n', start)
+    if end < 0:
+      end = size
+    if end > start and data[start:end] != '\r':
+      offsets.append(start)
+    start = end + 1
+  return ''.join(
+      struct.pack('<%dq' % len(offsets[i:i + _PACK_COUNT]),
+                  *offsets[i:i + _PACK_COUNT])
+      for i in xrange(0, len(offsets), _PACK_COUNT))
+
+
+def BuildIndex(filename, index_filename=None):
+  """Scans an ID file and writes the index of its IDs.
+
+  Args:
+    filename: The path of the ID file.
+    index_filename: The path to write the index to, by default filename
+        followed by INDEX_SUFFIX.
+
+  Returns:
+    The index, as written.
+
+  Raises:
+    IOError: If the ID file can not be read.
+  """
+  if index_filename is None:
+    index_filename = filename + INDEX_SUFFIX
+  size, mtime = _FileVersion(filename)
+  index = INDEX_HEADER.pack(INDEX_MAGIC, size, mtime) + _ScanOffsets(
+      _MapFile(filename))
+  # Written under a temporary name and renamed, so that concurrent readers
+  # never see a partial index.
+  temporary_filename = '%s.%d' % (index_filename, os.getpid())
+  with open(temporary_filename, 'wb') as index_file:
+    index_file.write(index)
+  os.rename(temporary_filename, index_filename)
+  return index
+
+
+def _IsCurrentIndex(index, filename):
+  """Returns True if index is a complete index of the current ID file."""
+  if len(index) < INDEX_HEADER.size:
+    return False
+  magic, size, mtime = INDEX_HEADER.unpack_from(index)
+  return (magic == INDEX_MAGIC and (size, mtime) == _FileVersion(filename) and
+          (len(index) - INDEX_HEADER.size) % _OFFSET.size == 0)
+
+
+class IdFile(object):
+  """A read-only sequence of the IDs in a file, one ID per line.
+
+  Lines are stripped of surrounding whitespace and empty lines are skipped,
+  like requester.GetIdsFromFile does, so an IdFile can be used wherever a list
+  of IDs is expected, e.g. as the google_id_list of generator classes.
+  IdFiles can be pickled, which reopens the same files.
+  """
+
+  def __init__(self, filename, index_filename=None):
+    """Opens an ID file, building its index unless it is up to date.
+
+    If the index can not be written, e.g. because the directory of the ID
+    file is read-only, it is kept in memory instead.
+
+    Args:
+      filename: The path of the ID file.
+      index_filename: The path of the index, by default filename followed by
+          INDEX_SUFFIX.
+
+    Raises:
+      IOError: If the ID file can not be read.
+    """
+    if index_filename is None:
+      index_filename = filename + INDEX_SUFFIX
+    self._filename = filename
+    self._index_filename = index_filename
+    self._Open()
+
+  def _Open(self):
+    """Maps the ID file and its index."""
+    self._data = _MapFile(self._filename)
+    index = None
+    if os.path.exists(self._index_filename):
+      index = _MapFile(self._index_filename)
+      if not _IsCurrentIndex(index, self._filename):
+        index = None
+    if index is None:
+      try:
+        BuildIndex(self._filename, self._index_filename)
+        index = _MapFile(self._index_filename)
+      except (IOError, OSError):
+        index = INDEX_HEADER.pack(INDEX_MAGIC, 0, 0) + _ScanOffsets(
+            self._data)
+    self._index = index
+    self._count = (len(index) - INDEX_HEADER.size) // _OFFSET.size
+
+  def __getstate__(self):
+    return {'filename': self._filename,
+            'index_filename': self._index_filename}
+
+  def __setstate__(self, state):
+    self._filename = state['filename']
+    self._index_filename = state['index_filename']
+    self._Open()
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, position):
+    """Returns the ID at a position, like a list does.
+
+    Args:
+      position: An integer, negative to count from the end.
+
+    Returns:
+      The ID, a string.
+
+    Raises:
+      IndexError: If the position is out of range.
+    """
+    if position < 0:
+      position += self._count
+    if not 0 <= position < self._count:
+      raise IndexError('ID file index out of range')
+    (start,) = _OFFSET.unpack_from(self._index,
+                                   INDEX_HEADER.size + position * _OFFSET.size)
+    end = self._data.find('\n', start)
+    if end < 0:
+      end = len(self._data)
+    return self._data[start:end].strip()
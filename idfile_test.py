@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for idfile.py."""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import generator
+import idfile
+
+
+class IdFileTest(unittest.TestCase):
+  """Tests the idfile module, with NumPy if it is installed."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'ids.txt')
+    self.WriteIds('first\n\n second \r\n\r\nx\nlast')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def WriteIds(self, contents):
+    """Writes the ID file, with a new modification time."""
+    with open(self.filename, 'wb') as ids_file:
+      ids_file.write(contents)
+    mtime = os.stat(self.filename).st_mtime + 10
+    os.utime(self.filename, (mtime, mtime))
+
+  def testReadIds(self):
+    """Tests that IDs are read like a list, skipping empty lines."""
+    ids = idfile.IdFile(self.filename)
+    self.assertEqual(['first', 'second', 'x', 'last'], list(ids))
+    self.assertEqual(4, len(ids))
+    self.assertEqual('last', ids[-1])
+    self.assertRaises(IndexError, ids.__getitem__, 4)
+    self.assertTrue(os.path.exists(self.filename + idfile.INDEX_SUFFIX))
+
+  def testIndexIsReused(self):
+    """Tests that a saved index is used until the ID file changes."""
+    idfile.IdFile(self.filename)
+    index_filename = self.filename + idfile.INDEX_SUFFIX
+    with open(index_filename, 'r+b') as index_file:
+      # Point the first ID to the second line.
+      index_file.seek(idfile.INDEX_HEADER.size)
+      index_file.write(idfile._OFFSET.pack(7))
+    self.assertEqual('second', idfile.IdFile(self.filename)[0])
+    self.WriteIds('a\nbb\n')
+    self.assertEqual(['a', 'bb'], list(idfile.IdFile(self.filename)))
+
+  def testUnwritableIndex(self):
+    """Tests that the index is kept in memory if it can not be written."""
+    index_filename = os.path.join(self.directory, 'missing', 'ids.index')
+    ids = idfile.IdFile(self.filename, index_filename)
+    self.assertEqual(['first', 'second', 'x', 'last'], list(ids))
+    self.assertFalse(os.path.exists(index_filename))
+
+  def testEmptyFile(self):
+    """Tests a file without IDs."""
+    self.WriteIds('\n\n')
+    self.assertEqual(0, len(idfile.IdFile(self.filename)))
+    self.WriteIds('')
+    self.assertEqual(0, len(idfile.IdFile(self.filename)))
+
+  def testMissingFile(self):
+    """Tests that a missing file raises IOError."""
+    self.assertRaises(IOError, idfile.IdFile,
+                      os.path.join(self.directory, 'missing.txt'))
+
+  def testPickle(self):
+    """Tests that pickled IdFiles reopen the file."""
+    ids = pickle.loads(pickle.dumps(idfile.IdFile(self.filename)))
+    self.assertEqual(['first', 'second', 'x', 'last'], list(ids))
+
+  def testGenerateFromIdFile(self):
+    """Tests that generators pick Google IDs from an IdFile."""
+    ids = idfile.IdFile(self.filename)
+    generator_obj = generator.RandomBidGeneratorWrapper(ids, seed=1234)
+    bid_requests = generator_obj.GenerateBidRequests(20)
+    bid_requests.append(generator_obj.GenerateBidRequest())
+    for bid_request in bid_requests:
+      self.assertTrue(bid_request.google_user_id in list(ids))
+    self.assertEqual(bid_requests[:20], generator.RandomBidGeneratorWrapper(
+        list(ids), seed=1234).GenerateBidRequests(20))
+
+
+class IdFileWithoutNumpyTest(IdFileTest):
+  """Tests the idfile module with the plain Python fallbacks."""
+
+  def setUp(self):
+    self.numpy = idfile.numpy
+    idfile.numpy = None
+    IdFileTest.setUp(self)
+
+  def tearDown(self):
+    idfile.numpy = self.numpy
+    IdFileTest.tearDown(self)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,10 +4,16 @@
 
 import base64
 import cgi
+import collections
 import datetime
 import httplib
+import itertools
+import json
+import math
+import multiprocessing
 import random
 import re
+import struct
 import sys
 import threading
 import urllib
@@ -15,26 +21,224 @@ import urlparse
 
 import google.protobuf.message
 import realtime_bidding_pb2
+import results
 
 TEMPLATE_PARAM_REGEX = re.compile('%%P(.)%%')
 
+# Number of records summarized by a worker process at once.
+DEFAULT_CHUNK_SIZE = 1000
+# Chunks queued per worker process; bounds the records held in memory.
+CHUNKS_PER_PROCESS = 2
+
+# Real-time bidding deadline; responses slower than this are not considered.
+DEFAULT_DEADLINE_MS = 100
+# Latency percentiles included in summaries.
+LATENCY_PERCENTILES = [50, 90, 95, 99, 99.9]
+
+# Buckets of summarized records.
+# Good: the response can be parsed and no errors were detected.
+GOOD = 'good'
+# Problematic: the response can be parsed but has some problems.
+PROBLEMATIC = 'problematic'
+# Invalid: the response can not be parsed.
+INVALID = 'invalid'
+# Error: the HTTP response had a non-200 response code.
+ERROR = 'error'
+BUCKETS = [GOOD, PROBLEMATIC, INVALID, ERROR]
+# Key of the rendered snippets file in the log files of a LogSummarizer.
+SNIPPETS = 'snippets'
+
+# Classes of requests, see ClassifyRequest. Requests logged with the name
+# of their traffic class are counted in that class instead, see
+# LogSummarizer.SetRequestClasses.
+DISPLAY = 'display'
+VIDEO = 'video'
+PING = 'ping'
+REQUEST_CLASSES = [DISPLAY, VIDEO, PING]
+
+# Binary record logs start with RECORD_LOG_MAGIC, the length of a JSON object
+# listing the names of the traffic classes and the URLs of the endpoints of
+# the records, and that object. One entry per record follows: a
+# RECORD_LOG_HEADER (HTTP status, send time, latency, serialized BidRequest
+# length, response payload length, traffic class code, endpoint code)
+# followed by the serialized BidRequest and the response payload. Unknown
+# times are stored as NaN, and unknown classes and endpoints as code 0, the
+# others as their index in the lists plus one.
+RECORD_LOG_MAGIC = 'RTBRECS2'
+RECORD_LOG_NAMES_LENGTH = struct.Struct('<I')
+RECORD_LOG_HEADER = struct.Struct('<iddIIBB')
+# Record logs written before classes and endpoints were stored have neither
+# the names nor the codes.
+RECORD_LOG_MAGIC_V1 = 'RTBRECS1'
+RECORD_LOG_HEADER_V1 = struct.Struct('<iddII')
+# The maximum number of traffic classes or endpoints of a record log.
+MAX_RECORD_LOG_NAMES = 255
+
 
 class Record(object):
-  """A record of each request/response pair."""
-  def __init__(self, bid_request, status_code, payload):
+  """A record of each request/response pair.
+
+  Records are kept for every request sent, so they are stored compactly: the
+  class uses __slots__, the BidRequest is kept as the serialized bytes that
+  were sent and is only parsed when bid_request is first read, and the
+  per-record lists and dictionaries are only allocated once something is added
+  to them. Compact drops parsed messages again once a record has been
+  summarized.
+  """
+  __slots__ = ['_bid_request', '_serialized_bid_request', 'status', 'payload',
+               'start_time', 'latency', '_problems', '_problem_codes',
+               '_bid_response', '_has_bid_response', '_html_snippets',
+               'bucket', 'request_class', 'endpoint']
+
+  def __init__(self, bid_request, status_code, payload, start_time=None,
+               latency=None, request_class=None, endpoint=None):
+    """Initializes a Record.
+
+    Args:
+      bid_request: A realtime_bidding_pb2.BidRequest object or its serialized
+          bytes. Once a record holds serialized bytes they are authoritative,
+          changes to the parsed message are not reflected in them.
+      status_code: The HTTP status code.
+      payload: The HTTP response payload.
+      start_time: The POSIX timestamp at which the request was sent.
+      latency: The round trip time of the request in (fractional) seconds.
+      request_class: The name of the traffic class of the request, or None
+          if unknown.
+      endpoint: The URL the request was sent to, or None if unknown.
+    """
     self.bid_request = bid_request
     self.status = status_code
     self.payload = payload
+    # POSIX timestamp at which the request was sent, or None if unknown.
+    self.start_time = start_time
+    # Seconds between sending the request and receiving the full response, or
+    # None if unknown.
+    self.latency = latency
+    self.request_class = request_class
+    self.endpoint = endpoint
 
     # The following fields get filled in by the LogSummarizer after the
-    # response protocol buffer has been succesfully parsed.
-
-    # A list of strings with problem descriptions.
-    self.problems = []
-    # A realtime_bidding_pb2.BidResponse instance.
-    self.bid_response = None
-    # A map of ad index -> validated HTML snippet (after macro substitutions).
-    self.html_snippets = {}
+    # response protocol buffer has been succesfully parsed. problems,
+    # problem_codes and html_snippets are None until first used.
+    self._problems = None
+    self._problem_codes = None
+    self._bid_response = None
+    # True if payload parsed into a valid BidResponse, so that bid_response
+    # can be parsed again after Compact.
+    self._has_bid_response = False
+    self._html_snippets = None
+    # The bucket the record was summarized into, one of BUCKETS.
+    self.bucket = None
+
+  @property
+  def bid_request(self):
+    """The realtime_bidding_pb2.BidRequest, parsed on first access."""
+    if self._bid_request is None:
+      bid_request = realtime_bidding_pb2.BidRequest()
+      bid_request.ParseFromString(self._serialized_bid_request)
+      self._bid_request = bid_request
+    return self._bid_request
+
+  @bid_request.setter
+  def bid_request(self, bid_request):
+    if isinstance(bid_request, str):
+      self._bid_request = None
+      self._serialized_bid_request = bid_request
+    else:
+      self._bid_request = bid_request
+      self._serialized_bid_request = None
+
+  @property
+  def serialized_bid_request(self):
+    """The BidRequest as serialized bytes, serialized if necessary."""
+    if self._serialized_bid_request is None:
+      return self._bid_request.SerializeToString()
+    return self._serialized_bid_request
+
+  @property
+  def bid_response(self):
+    """A realtime_bidding_pb2.BidResponse instance, or None."""
+    if self._bid_response is None and self._has_bid_response:
+      bid_response = realtime_bidding_pb2.BidResponse()
+      bid_response.ParseFromString(self.payload)
+      self._bid_response = bid_response
+    return self._bid_response
+
+  @bid_response.setter
+  def bid_response(self, bid_response):
+    self._bid_response = bid_response
+    self._has_bid_response = bid_response is not None
+
+  @property
+  def problems(self):
+    """A list of strings with problem descriptions."""
+    if self._problems is None:
+      self._problems = []
+    return self._problems
+
+  @problems.setter
+  def problems(self, problems):
+    self._problems = problems
+
+  @property
+  def problem_codes(self):
+    """A list of problem codes, parallel to problems.
+
+    Each code is a key of one of the LogSummarizer *_ERROR_MESSAGES
+    dictionaries.
+    """
+    if self._problem_codes is None:
+      self._problem_codes = []
+    return self._problem_codes
+
+  @problem_codes.setter
+  def problem_codes(self, problem_codes):
+    self._problem_codes = problem_codes
+
+  @property
+  def html_snippets(self):
+    """A map of ad index -> validated HTML snippet (after substitutions)."""
+    if self._html_snippets is None:
+      self._html_snippets = {}
+    return self._html_snippets
+
+  @html_snippets.setter
+  def html_snippets(self, html_snippets):
+    self._html_snippets = html_snippets
+
+  def Compact(self):
+    """Drops parsed messages and empty containers to save memory.
+
+    The request is serialized if necessary. Parsed messages are recreated
+    when next accessed.
+    """
+    if self._serialized_bid_request is None:
+      self._serialized_bid_request = self._bid_request.SerializeToString()
+    self._bid_request = None
+    self._bid_response = None
+    if not self._problems:
+      self._problems = None
+    if not self._problem_codes:
+      self._problem_codes = None
+    if not self._html_snippets:
+      self._html_snippets = None
+
+  def __getstate__(self):
+    """Returns the compact state of the record for pickling."""
+    return (self.serialized_bid_request, self.status, self.payload,
+            self.start_time, self.latency, self._problems or None,
+            self._problem_codes or None, self._has_bid_response,
+            self._html_snippets or None, self.bucket, self.request_class,
+            self.endpoint)
+
+  def __setstate__(self, state):
+    """Restores a record pickled by __getstate__."""
+    (self._serialized_bid_request, self.status, self.payload,
+     self.start_time, self.latency, self._problems, self._problem_codes,
+     self._has_bid_response, self._html_snippets, self.bucket,
+     self.request_class, self.endpoint) = state
+    self._bid_request = None
+    self._bid_response = None
 
 
 class LoggerException(Exception):
@@ -48,72 +252,136 @@ class Logger(object):
   def __iter__(self):
     if not self._done:
       raise LoggerException('Only locked Loggers are iterable.')
-    return self
+    return iter(self._records)
 
   def __getitem__(self, item):
     if not self._done:
       raise LoggerException('Only locked Loggers are iterable.')
     return self._records[item]
 
-  def next(self):
-    if not self._done:
-      raise LoggerException('Only locked Loggers can are iterable.')
-    if self._current_iteration >= len(self._records):
-      self._current_iteration = 0
-      raise StopIteration
-
-    c = self._current_iteration
-    self._current_iteration += 1
-    return self._records[c]
-
   def __init__(self):
-    # Stores Record objects.
+    # Stores Record objects once Done has been called.
     self._records = []
+    # Each logging thread appends to its own _RecordBuffer, registered in
+    # _buffers the first time the thread logs, so logging threads do not
+    # contend on a lock.
+    self._buffers = []
+    self._local = threading.local()
     self._record_lock = threading.Lock()
-    self._current_iteration = 0
     self._done = False
 
   def Done(self):
-    """Signals that logging is done, locking this object to modifications."""
-    self._record_lock.acquire()
-    try:
+    """Signals that logging is done, locking this object to modifications.
+
+    The records of all threads are merged in order of their send time; records
+    without one keep their order and come first. Threads that log while Done
+    is running either have their records merged or are told they were not
+    logged.
+    """
+    with self._record_lock:
+      if self._done:
+        return
       self._done = True
-    finally:
-      self._record_lock.release()
+      record_buffers = self._buffers
+      self._buffers = []
+    for record_buffer in record_buffers:
+      with record_buffer.lock:
+        record_buffer.closed = True
+        self._records.extend(record_buffer.records)
+        record_buffer.records = None
+    if len(record_buffers) > 1:
+      self._records.sort(key=_SendTimeKey)
 
   def IsDone(self):
     """Returns True if this logger has been locked for updates."""
-    self._record_lock.acquire()
-    try:
-      return self._done
-    finally:
-      self._record_lock.release()
+    return self._done
 
-  def LogSynchronousRequest(self, bid_request, status_code, payload):
+  def _GetBuffer(self):
+    """Returns the _RecordBuffer of the calling thread.
+
+    Returns:
+      The buffer, or None if a new one can not be registered as the logger is
+      locked.
+    """
+    try:
+      return self._local.record_buffer
+    except AttributeError:
+      record_buffer = _RecordBuffer()
+      with self._record_lock:
+        if self._done:
+          return None
+        self._buffers.append(record_buffer)
+      self._local.record_buffer = record_buffer
+      return record_buffer
+
+  def LogSynchronousRequest(self, bid_request, status_code, payload,
+                            start_time=None, latency=None,
+                            request_class=None, endpoint=None):
     """Logs a synchronous request.
 
     Args:
-      bid_request: A realtime_bidding_pb2.BidRequest object.
+      bid_request: A realtime_bidding_pb2.BidRequest object, or preferably
+          the serialized bytes that were sent, see Record.
       status_code: The HTTP status code.
       payload: The HTTP response payload.
+      start_time: The POSIX timestamp at which the request was sent.
+      latency: The round trip time of the request in (fractional) seconds.
+      request_class: The name of the traffic class of the request, or None
+          to classify it with ClassifyRequest.
+      endpoint: The URL the request was sent to, or None if unknown.
 
     Returns:
       True if the request was logged, False otherwise.
     """
-    if self.IsDone():
+    record_buffer = self._GetBuffer()
+    if record_buffer is None:
       return False
+    record = Record(bid_request, status_code, payload, start_time, latency,
+                    request_class, endpoint)
+    # Only Done contends on the lock of the buffer, to close it.
+    with record_buffer.lock:
+      if record_buffer.closed:
+        return False
+      record_buffer.records.append(record)
+    return True
 
-    self._record_lock.acquire()
-    try:
+  def LogRecords(self, records):
+    """Logs many requests at once, e.g. from an asynchronous sender.
 
-      record = Record(bid_request, status_code, payload)
-      self._records.append(record)
-    finally:
-      self._record_lock.release()
+    Args:
+      records: An iterable of Record instances.
 
+    Returns:
+      True if the records were logged, False otherwise.
+    """
+    record_buffer = self._GetBuffer()
+    if record_buffer is None:
+      return False
+    with record_buffer.lock:
+      if record_buffer.closed:
+        return False
+      record_buffer.records.extend(records)
     return True
 
 
+class _RecordBuffer(object):
+  """The records logged by a thread, until Logger.Done closes it."""
+
+  __slots__ = ['lock', 'records', 'closed']
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.records = []
+    self.closed = False
+
+
+def _SendTimeKey(record):
+  """Returns the sort key of a record by send time, see Logger.Done."""
+  if record.start_time is None:
+    return float('-inf')
+  return record.start_time
+
+
 def EscapeUrl(input_str):
   """Returned the URL-escaped version of input_str.
 
@@ -129,6 +397,321 @@ def EscapeUrl(input_str):
   return urllib.quote_plus(input_str, '!()*,-./:_~')
 
 
+class RecordLogException(Exception):
+  """An exception thrown when a binary record log can not be read."""
+  pass
+
+
+def _TimeOrNan(value):
+  """Returns value, or NaN if value is None."""
+  if value is None:
+    return float('nan')
+  return value
+
+
+def _NanOrTime(value):
+  """Returns value, or None if value is NaN."""
+  if math.isnan(value):
+    return None
+  return value
+
+
+def WriteRecordLog(records, log_file, request_classes=(), endpoints=()):
+  """Writes records to a binary record log.
+
+  Args:
+    records: An iterable of Record instances, e.g. a locked Logger.
+    log_file: A file like object opened for binary writing, will not be
+        closed.
+    request_classes: The names of the traffic classes stored with the
+        records, e.g. those passed to LogSummarizer.SetRequestClasses. Other
+        classes are stored as unknown.
+    endpoints: The URLs stored with the records, e.g. those passed to
+        LogSummarizer.SetEndpoints. Other endpoints are stored as unknown.
+
+  Returns:
+    The number of records written.
+
+  Raises:
+    RecordLogException: If there are more than MAX_RECORD_LOG_NAMES classes
+        or endpoints.
+  """
+  request_classes = list(request_classes)
+  endpoints = list(endpoints)
+  if max(len(request_classes), len(endpoints)) > MAX_RECORD_LOG_NAMES:
+    raise RecordLogException('At most %d classes and endpoints are '
+                             'supported.' % MAX_RECORD_LOG_NAMES)
+  class_codes = dict((name, i + 1) for i, name in enumerate(request_classes))
+  endpoint_codes = dict((url, i + 1) for i, url in enumerate(endpoints))
+  names = json.dumps({'request_classes': request_classes,
+                      'endpoints': endpoints})
+  log_file.write(RECORD_LOG_MAGIC)
+  log_file.write(RECORD_LOG_NAMES_LENGTH.pack(len(names)))
+  log_file.write(names)
+  count = 0
+  for record in records:
+    bid_request = record.serialized_bid_request
+    payload = record.payload or ''
+    log_file.write(RECORD_LOG_HEADER.pack(
+        record.status, _TimeOrNan(record.start_time),
+        _TimeOrNan(record.latency), len(bid_request), len(payload),
+        class_codes.get(record.request_class, 0),
+        endpoint_codes.get(record.endpoint, 0)))
+    log_file.write(bid_request)
+    log_file.write(payload)
+    count += 1
+  return count
+
+
+def IsRecordLog(log_file):
+  """Returns True if the file starts with a record log magic.
+
+  Args:
+    log_file: A seekable file like object opened for binary reading; the
+        position is restored afterwards.
+  """
+  position = log_file.tell()
+  try:
+    return log_file.read(len(RECORD_LOG_MAGIC)) in (RECORD_LOG_MAGIC,
+                                                     RECORD_LOG_MAGIC_V1)
+  finally:
+    log_file.seek(position)
+
+
+def _ReadRecordLogStart(log_file):
+  """Reads the magic and names at the start of a record log.
+
+  Args:
+    log_file: A file like object opened for binary reading.
+
+  Returns:
+    A (record header struct, traffic class names, endpoint URLs) tuple.
+
+  Raises:
+    RecordLogException: If the file is not a record log or is truncated.
+  """
+  magic = log_file.read(len(RECORD_LOG_MAGIC))
+  if magic == RECORD_LOG_MAGIC_V1:
+    return RECORD_LOG_HEADER_V1, [], []
+  if magic != RECORD_LOG_MAGIC:
+    raise RecordLogException('Not a record log.')
+  length = log_file.read(RECORD_LOG_NAMES_LENGTH.size)
+  if len(length) != RECORD_LOG_NAMES_LENGTH.size:
+    raise RecordLogException('Truncated record log names.')
+  try:
+    names = json.loads(log_file.read(
+        RECORD_LOG_NAMES_LENGTH.unpack(length)[0]))
+    return (RECORD_LOG_HEADER,
+            [name.encode('utf-8') for name in names['request_classes']],
+            [url.encode('utf-8') for url in names['endpoints']])
+  except (ValueError, KeyError, TypeError, AttributeError):
+    raise RecordLogException('Invalid record log names.')
+
+
+def ReadRecordLogNames(log_file):
+  """Reads the traffic classes and endpoints a record log stores.
+
+  Args:
+    log_file: A seekable file like object opened for binary reading; the
+        position is restored afterwards.
+
+  Returns:
+    A (traffic class names, endpoint URLs) pair, to pass to
+    LogSummarizer.SetRequestClasses and SetEndpoints before summarizing the
+    records. Both are empty for logs written before they were stored.
+
+  Raises:
+    RecordLogException: If the file is not a record log or is truncated.
+  """
+  position = log_file.tell()
+  try:
+    _, request_classes, endpoints = _ReadRecordLogStart(log_file)
+    return request_classes, endpoints
+  finally:
+    log_file.seek(position)
+
+
+def ReadRecordLog(log_file):
+  """Reads records from a binary record log written by WriteRecordLog.
+
+  Records are read lazily, so arbitrarily large logs can be processed.
+
+  Args:
+    log_file: A file like object opened for binary reading.
+
+  Yields:
+    A Record instance for each record in the log.
+
+  Raises:
+    RecordLogException: If the file is not a record log or is truncated.
+  """
+  record_header, request_classes, endpoints = _ReadRecordLogStart(log_file)
+  request_classes = [None] + request_classes
+  endpoints = [None] + endpoints
+  while True:
+    header = log_file.read(record_header.size)
+    if not header:
+      return
+    if len(header) != record_header.size:
+      raise RecordLogException('Truncated record header.')
+    fields = record_header.unpack(header)
+    (status, start_time, latency, request_length, payload_length) = fields[:5]
+    class_code, endpoint_code = fields[5:] or (0, 0)
+    if class_code >= len(request_classes) or endpoint_code >= len(endpoints):
+      raise RecordLogException('Invalid record class or endpoint.')
+    serialized_request = log_file.read(request_length)
+    payload = log_file.read(payload_length)
+    if (len(serialized_request) != request_length or
+        len(payload) != payload_length):
+      raise RecordLogException('Truncated record.')
+    yield Record(serialized_request, status, payload, _NanOrTime(start_time),
+                 _NanOrTime(latency), request_classes[class_code],
+                 endpoints[endpoint_code])
+
+
+def Percentile(sorted_values, percentile):
+  """Returns a percentile of sorted values using the nearest-rank method.
+
+  Args:
+    sorted_values: A non-empty list of numbers in ascending order.
+    percentile: The percentile to return, in (0, 100].
+
+  Returns:
+    The smallest value such that at least percentile percent of the values are
+    less than or equal to it.
+  """
+  return results.Percentiles(sorted_values, [percentile])[0]
+
+
+def ClassifyRequest(bid_request):
+  """Returns the class of a request, one of REQUEST_CLASSES.
+
+  Args:
+    bid_request: A realtime_bidding_pb2.BidRequest object.
+  """
+  if bid_request.is_ping:
+    return PING
+  if bid_request.HasField('video'):
+    return VIDEO
+  return DISPLAY
+
+
+def PercentileKey(percentile):
+  """Returns the summary key of a latency percentile, e.g. 'p99.9'."""
+  return 'p%g' % percentile
+
+
+def _KeyPercentiles(latency_summary):
+  """Keys the percentiles of a results.Describe dictionary by PercentileKey.
+
+  Args:
+    latency_summary: The statistics of LATENCY_PERCENTILES, or None.
+
+  Returns:
+    The statistics, with a key per percentile instead of a list.
+  """
+  if latency_summary is None:
+    return None
+  for percentile, value in zip(LATENCY_PERCENTILES,
+                               latency_summary.pop('percentiles')):
+    latency_summary[PercentileKey(percentile)] = value
+  return latency_summary
+
+
+def FindSloViolations(summary, max_latency_ms=None, latency_percentile=99,
+                      max_error_rate=None, max_deadline_miss_rate=None):
+  """Checks a summary against service level objectives.
+
+  Args:
+    summary: A dictionary as returned by LogSummarizer.GetSummary.
+    max_latency_ms: The maximum allowed latency at latency_percentile, or None
+        to not check latency.
+    latency_percentile: One of LATENCY_PERCENTILES.
+    max_error_rate: The maximum allowed fraction of requests that received a
+        non-200 or unparseable response, or None to not check errors.
+    max_deadline_miss_rate: The maximum allowed fraction of requests slower
+        than the deadline, or None to not check deadline misses.
+
+  Returns:
+    A list of strings describing each violated objective, empty if all
+    objectives were met. An objective with nothing to measure, e.g. a
+    latency when no request received a response, is violated.
+  """
+  violations = []
+  if summary.get('requests_sent') == 0 and (
+      max_latency_ms is not None or max_error_rate is not None or
+      max_deadline_miss_rate is not None):
+    return ['no requests were sent']
+  if max_latency_ms is not None:
+    key = PercentileKey(latency_percentile)
+    if not summary['latency_ms']:
+      violations.append('%s latency unknown: no request has a latency' % key)
+    elif summary['latency_ms'][key] > max_latency_ms:
+      violations.append('%s latency %.1f ms exceeds %.1f ms' % (
+          key, summary['latency_ms'][key], max_latency_ms))
+  if max_error_rate is not None and summary['error_rate'] > max_error_rate:
+    violations.append('error rate %.4f exceeds %.4f' % (
+        summary['error_rate'], max_error_rate))
+  if (max_deadline_miss_rate is not None and
+      summary['deadline_miss_rate'] > max_deadline_miss_rate):
+    violations.append('deadline miss rate %.4f exceeds %.4f' % (
+        summary['deadline_miss_rate'], max_deadline_miss_rate))
+  return violations
+
+
+def _Chunks(iterable, chunk_size):
+  """Splits an iterable into lists.
+
+  Args:
+    iterable: Any iterable.
+    chunk_size: The maximum length of each list.
+
+  Yields:
+    Consecutive lists of at most chunk_size items.
+  """
+  iterator = iter(iterable)
+  while True:
+    chunk = list(itertools.islice(iterator, chunk_size))
+    if not chunk:
+      return
+    yield chunk
+
+
+def SummarizeChunk(records, encrypted_price=None,
+                   deadline_ms=DEFAULT_DEADLINE_MS, request_classes=(),
+                   endpoints=()):
+  """Summarizes a chunk of records, e.g. in a worker process.
+
+  Args:
+    records: A list of Record instances.
+    encrypted_price: See LogSummarizer.SetSampleEncryptedPrice.
+    deadline_ms: See LogSummarizer.SetDeadline.
+    request_classes: See LogSummarizer.SetRequestClasses.
+    endpoints: See LogSummarizer.SetEndpoints.
+
+  Returns:
+    A (LogSummarizer, chunk results) pair, see LogSummarizer.MergeChunk.
+    The LogSummarizer only holds counters. The chunk results hold a (bucket,
+    problems, problem_codes, has bid response, html_snippets) tuple per
+    record, with None for empty containers. The requests are left out as
+    the caller already has them, and so are the parsed responses, which the
+    caller parses again from the payloads only if it needs them.
+  """
+  summarizer = LogSummarizer(None, retain_records=False)
+  summarizer.SetSampleEncryptedPrice(encrypted_price)
+  summarizer.SetDeadline(deadline_ms)
+  summarizer.SetRequestClasses(request_classes)
+  summarizer.SetEndpoints(endpoints)
+  chunk_results = []
+  for record in records:
+    summarizer.SummarizeRecord(record)
+    chunk_results.append((record.bucket, record._problems or None,
+                          record._problem_codes or None,
+                          record._has_bid_response,
+                          record._html_snippets or None))
+  return summarizer, chunk_results
+
+
 class LogSummarizer(object):
   """Summarizes information stored in a Logger and outputs a report."""
 
@@ -222,20 +805,43 @@ class LogSummarizer(object):
 
   WINNING_PRICE_RATIO = 0.33
 
-  def __init__(self, logger):
+  # Number of problem codes to list in the report.
+  TOP_PROBLEMS_TO_REPORT = 10
+
+  def __init__(self, logger, retain_records=True):
     """Initializes a LogSummarizer.
 
     Args:
       logger: An iterable object containing Record instances.
+      retain_records: Whether to keep summarized records in the buckets so
+          that WriteLogFiles can write them. If False, only the counters are
+          kept.
     """
     self._logger = logger
+    self._retain_records = retain_records
     self._requests_sent = 0
     self._responses_ok = 0
     self._responses_successful_without_bids = 0
     self._processing_time_sum = 0
     self._processing_time_count = 0
+    self._responses_with_bids = 0
     self._encrypted_price = None
 
+    # Per-request metrics of every summarized record, stored in columns so
+    # that memory stays small for very large runs.
+    self._results = results.ResultsStore()
+    self._first_start_time = None
+    self._last_end_time = None
+    self._deadline_ms = DEFAULT_DEADLINE_MS
+    self._deadline_misses = 0
+    self._repeat_rates = {}
+    self._rate_control = None
+    # Names of the request classes, indexed by their code in the results.
+    self._request_classes = list(REQUEST_CLASSES)
+    # URLs of the endpoints, indexed by their code in the results. Code 0 is
+    # that of requests whose endpoint is unknown.
+    self._endpoints = [None]
+
     # Store records in the following buckets:
     # Good: the response can be parsed and no errors were detected.
     self._good = []
@@ -245,6 +851,22 @@ class LogSummarizer(object):
     self._invalid = []
     # Error: the HTTP response had a non-200 response code.
     self._error = []
+    self._buckets = {
+        GOOD: self._good,
+        PROBLEMATIC: self._problematic,
+        INVALID: self._invalid,
+        ERROR: self._error,
+    }
+    # Maps bucket -> number of records added to it.
+    self._bucket_sizes = collections.Counter()
+
+    # Log files keyed by bucket and SNIPPETS, set when streaming log files.
+    self._log_files = None
+    # Buckets, or SNIPPETS, whose log file header has been written.
+    self._log_headers_written = set()
+
+    # Maps problem code -> number of times the problem was found.
+    self._problem_counts = collections.Counter()
 
   def SetSampleEncryptedPrice(self, encrypted_price):
     """Sets the encrypted price to use for the ENCRYPTED_PRICE macro.
@@ -254,65 +876,364 @@ class LogSummarizer(object):
     """
     self._encrypted_price = encrypted_price
 
-  def Summarize(self):
-    """Collects and summarizes information from the logger."""
-    for record in self._logger:
-      self._requests_sent += 1
-      if record.status == httplib.OK:
-        self._responses_ok += 1
-      else:
-        # Responded with a non-OK code, don't to parse.
-        record.problems.append(self.REQUEST_ERROR_MESSAGES['not-ok'])
-        self._error.append(record)
-        continue
+  def SetDeadline(self, deadline_ms):
+    """Sets the deadline used to count late responses.
 
-      if not record.payload:
-        record.problems.append(self.RESPONSE_ERROR_MESSAGES['empty'])
-        self._invalid.append(record)
-        # Empty response, don't try to parse.
-        continue
+    Args:
+      deadline_ms: The deadline in milliseconds.
+    """
+    self._deadline_ms = deadline_ms
 
-      bid_response = realtime_bidding_pb2.BidResponse()
-      try:
-        bid_response.ParseFromString(record.payload)
-      except google.protobuf.message.DecodeError:
-        record.problems.append(self.RESPONSE_ERROR_MESSAGES['parse-error'])
-        self._invalid.append(record)
-        # Unparseable response, don't check its validity.
-        continue
+  def SetRepeatRates(self, repeat_rates):
+    """Sets the rates at which the requests repeat users, publishers etc.
 
-      if not bid_response.IsInitialized():
-        # It parsed but the message is not initialized which means it's not
-        # well-formed, consider this unparseable.
-        record.problems.append(self.RESPONSE_ERROR_MESSAGES['uninitialized'])
-        self._invalid.append(record)
-        continue
+    Args:
+      repeat_rates: A dictionary mapping names, e.g. 'google_user_id', to the
+          fraction of requests that repeat an earlier one, see
+          generator.ImpliedRepeatRates.
+    """
+    self._repeat_rates = dict(repeat_rates)
 
-      record.bid_response = bid_response
+  def SetRateControl(self, rate_control):
+    """Sets how the request rate was adapted to the bidder.
 
-      if not bid_response.HasField('processing_time_ms'):
-        record.problems.append(
-            self.RESPONSE_ERROR_MESSAGES['no-processing-time'])
-      else:
-        self._processing_time_count += 1
-        self._processing_time_sum += bid_response.processing_time_ms
+    Args:
+      rate_control: A dictionary as returned by
+          ratecontrol.AdaptiveRateController.GetSummary.
+    """
+    self._rate_control = dict(rate_control)
+
+  def SetRequestClasses(self, request_classes):
+    """Adds the names of the traffic classes requests are logged with.
+
+    Records logged with one of these names are counted in its class, and the
+    others in their class found by ClassifyRequest. The classes of
+    REQUEST_CLASSES keep the first codes.
+
+    Args:
+      request_classes: A list of class names, e.g. those of the
+          generator.TrafficClass instances of the run.
+    """
+    for request_class in request_classes:
+      if request_class not in self._request_classes:
+        self._request_classes.append(request_class)
+
+  def GetRequestClasses(self):
+    """Returns the names of the request classes, indexed by their code."""
+    return list(self._request_classes)
+
+  def SetEndpoints(self, endpoints):
+    """Adds the URLs requests are logged as sent to.
+
+    Records logged with one of these URLs are counted in its endpoint, and
+    the others as sent to an unknown endpoint.
+
+    Args:
+      endpoints: A list of URLs, e.g. those of the sender.LoadBalancer of the
+          run.
+    """
+    for endpoint in endpoints:
+      if endpoint not in self._endpoints:
+        self._endpoints.append(endpoint)
+
+  def GetEndpoints(self):
+    """Returns the URLs of the endpoints, indexed by their code.
+
+    Code 0 is None, for requests whose endpoint is unknown.
+    """
+    return list(self._endpoints)
 
-      if record.bid_request.is_ping:
-        self.ValidatePing(record)
+  def _AddProblem(self, record, code, message):
+    """Records a problem found in a record and counts it by code.
+
+    Args:
+      record: The Record instance the problem was found in.
+      code: A key of one of the *_ERROR_MESSAGES dictionaries.
+      message: The full problem description to store in the record.
+    """
+    record.problems.append(message)
+    record.problem_codes.append(code)
+    self._problem_counts[code] += 1
+
+  def _AddRequestProblem(self, record, code):
+    """Records a problem from REQUEST_ERROR_MESSAGES."""
+    self._AddProblem(record, code, self.REQUEST_ERROR_MESSAGES[code])
+
+  def _AddResponseProblem(self, record, code):
+    """Records a problem from RESPONSE_ERROR_MESSAGES."""
+    self._AddProblem(record, code, self.RESPONSE_ERROR_MESSAGES[code])
+
+  def _AddAdProblem(self, record, ad_index, code, detail=''):
+    """Records a problem from AD_ERROR_MESSAGES.
+
+    Args:
+      record: The Record instance the problem was found in.
+      ad_index: The index of the ad in the BidResponse.
+      code: A key of AD_ERROR_MESSAGES.
+      detail: A string appended to the message, e.g. the offending value.
+    """
+    self._AddProblem(record, code, (self.AD_ERROR_TEMPLATE % (
+        ad_index, self.AD_ERROR_MESSAGES[code])) + detail)
+
+  def _AddSnippetProblem(self, record, ad_index, code):
+    """Records a problem from SNIPPET_ERROR_MESSAGES."""
+    self._AddProblem(record, code, self.SNIPPET_ERROR_TEMPLATE % (
+        ad_index, self.SNIPPET_ERROR_MESSAGES[code]))
+
+  def _AddAdSlotProblem(self, record, first_index, second_index, code):
+    """Records a problem from ADSLOT_ERROR_MESSAGES."""
+    self._AddProblem(record, code, self.ADSLOT_ERROR_TEMPLATE % (
+        first_index, second_index, self.ADSLOT_ERROR_MESSAGES[code]))
+
+  def DescribeProblem(self, code):
+    """Returns the generic description of a problem code.
+
+    Args:
+      code: A key of one of the *_ERROR_MESSAGES dictionaries.
+
+    Returns:
+      The description of the problem, or the code itself if it is unknown.
+    """
+    for messages in (self.REQUEST_ERROR_MESSAGES, self.RESPONSE_ERROR_MESSAGES,
+                     self.AD_ERROR_MESSAGES, self.SNIPPET_ERROR_MESSAGES,
+                     self.ADSLOT_ERROR_MESSAGES):
+      if code in messages:
+        return messages[code].rstrip(': ')
+    return code
+
+  def GetTopProblems(self, n=None):
+    """Returns the most frequent problem codes.
+
+    Args:
+      n: The maximum number of problem codes to return, or None for all.
+
+    Returns:
+      A list of (code, count) tuples, most frequent first. Ties are ordered by
+      code so that the result is deterministic.
+    """
+    top = sorted(self._problem_counts.iteritems(),
+                 key=lambda (code, count): (-count, code))
+    if n is not None:
+      top = top[:n]
+    return top
+
+  def Summarize(self, processes=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Collects and summarizes information from the logger.
+
+    Args:
+      processes: The number of worker processes, 1 to summarize in this
+          process. See SummarizeRecords.
+      chunk_size: The number of records handed to a worker process at once.
+    """
+    self.SummarizeRecords(self._logger, processes, chunk_size)
+
+  def SummarizeRecords(self, records, processes=1,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """Summarizes records, optionally on several processes.
+
+    When using several processes, consecutive chunks of records are validated
+    by a pool of workers. The results are copied back onto the records and
+    merged in their original order, so the buckets and counters are identical
+    to summarizing serially. Only a few chunks are in flight at any time, so
+    records can be streamed from a large source.
+
+    Args:
+      records: An iterable of Record instances.
+      processes: The number of worker processes, 1 to summarize in this
+          process.
+      chunk_size: The number of records handed to a worker process at once.
+    """
+    if processes <= 1:
+      for record in records:
+        self.SummarizeRecord(record)
+      return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+      pending = collections.deque()
+      for chunk in _Chunks(records, chunk_size):
+        pending.append((chunk, pool.apply_async(
+            SummarizeChunk,
+            (chunk, self._encrypted_price, self._deadline_ms,
+             self._request_classes, self._endpoints[1:]))))
+        if len(pending) >= processes * CHUNKS_PER_PROCESS:
+          chunk, async_result = pending.popleft()
+          self.MergeChunk(chunk, async_result.get())
+      while pending:
+        chunk, async_result = pending.popleft()
+        self.MergeChunk(chunk, async_result.get())
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def MergeChunk(self, chunk, chunk_summary):
+    """Merges a chunk of records summarized elsewhere, e.g. by a worker.
+
+    Args:
+      chunk: The list of Record instances passed to SummarizeChunk.
+      chunk_summary: The value returned by SummarizeChunk.
+    """
+    summarizer, chunk_results = chunk_summary
+    for record, result in zip(chunk, chunk_results):
+      (record.bucket, record.problems, record.problem_codes,
+       record._has_bid_response, record.html_snippets) = result
+      record._bid_response = None
+    self.Merge(summarizer, chunk)
+
+  def SummarizeRecord(self, record):
+    """Validates a single record and adds it to one of the buckets.
+
+    Args:
+      record: A Record instance.
+    """
+    self._requests_sent += 1
+    self._RecordTiming(record)
+    if record.status == httplib.OK:
+      self._responses_ok += 1
+    else:
+      # Responded with a non-OK code, don't to parse.
+      self._AddRequestProblem(record, 'not-ok')
+      self._AddToBucket(record, ERROR)
+      return
+
+    if not record.payload:
+      self._AddResponseProblem(record, 'empty')
+      self._AddToBucket(record, INVALID)
+      # Empty response, don't try to parse.
+      return
+
+    bid_response = realtime_bidding_pb2.BidResponse()
+    try:
+      bid_response.ParseFromString(record.payload)
+    except google.protobuf.message.DecodeError:
+      self._AddResponseProblem(record, 'parse-error')
+      self._AddToBucket(record, INVALID)
+      # Unparseable response, don't check its validity.
+      return
+
+    if not bid_response.IsInitialized():
+      # It parsed but the message is not initialized which means it's not
+      # well-formed, consider this unparseable.
+      self._AddResponseProblem(record, 'uninitialized')
+      self._AddToBucket(record, INVALID)
+      return
+
+    record.bid_response = bid_response
+
+    if not bid_response.HasField('processing_time_ms'):
+      self._AddResponseProblem(record, 'no-processing-time')
+    else:
+      self._processing_time_count += 1
+      self._processing_time_sum += bid_response.processing_time_ms
+
+    if record.bid_request.is_ping:
+      self.ValidatePing(record)
+    else:
+      if not bid_response.ad:
+        self._responses_successful_without_bids += 1
+        self._AddToBucket(record, GOOD)
+        return
+        # No ads returned, don't validate ads.
+
+      self._responses_with_bids += 1
+
+      for i, ad in enumerate(bid_response.ad):
+        self.ValidateAd(ad, i, record)
+
+    if record.problems:
+      self._AddToBucket(record, PROBLEMATIC)
+    else:
+      self._AddToBucket(record, GOOD)
+
+  def _AddToBucket(self, record, bucket):
+    """Adds a summarized record to a bucket.
+
+    The record is retained in the bucket in compact form, or written to the
+    log files immediately if StreamLogFiles was called.
+
+    Args:
+      record: A Record instance.
+      bucket: One of BUCKETS.
+    """
+    record.bucket = bucket
+    self._bucket_sizes[bucket] += 1
+    request_class = record.request_class
+    if request_class not in self._request_classes:
+      request_class = ClassifyRequest(record.bid_request)
+    endpoint = record.endpoint
+    if endpoint not in self._endpoints:
+      endpoint = None
+    self._results.Append(
+        record.status, record.latency, record.start_time,
+        self._request_classes.index(request_class), BUCKETS.index(bucket),
+        len(record.serialized_bid_request), len(record.payload or ''),
+        self._endpoints.index(endpoint))
+    self._KeepRecord(record)
+
+  def _KeepRecord(self, record):
+    """Retains or writes a record that has been added to a bucket.
+
+    Args:
+      record: A Record instance.
+    """
+    if self._log_files is not None:
+      self._WriteRecord(record)
+    elif self._retain_records:
+      record.Compact()
+      self._buckets[record.bucket].append(record)
+
+  def Merge(self, other, records):
+    """Adds the results of another LogSummarizer to this one.
+
+    This allows records to be summarized in parallel: each worker summarizes
+    a consecutive chunk of records with its own LogSummarizer, and merging the
+    chunks in order gives the same buckets as summarizing serially.
+
+    Args:
+      other: A LogSummarizer that summarized records.
+      records: The Record instances summarized by other, in order.
+    """
+    self._requests_sent += other._requests_sent
+    self._responses_ok += other._responses_ok
+    self._responses_successful_without_bids += (
+        other._responses_successful_without_bids)
+    self._responses_with_bids += other._responses_with_bids
+    self._processing_time_sum += other._processing_time_sum
+    self._processing_time_count += other._processing_time_count
+    self._results.Extend(other._results)
+    self._deadline_misses += other._deadline_misses
+    if other._first_start_time is not None:
+      if self._first_start_time is None:
+        self._first_start_time = other._first_start_time
+        self._last_end_time = other._last_end_time
       else:
-        if not bid_response.ad:
-          self._responses_successful_without_bids += 1
-          self._good.append(record)
-          continue
-          # No ads returned, don't validate ads.
+        self._first_start_time = min(self._first_start_time,
+                                     other._first_start_time)
+        self._last_end_time = max(self._last_end_time, other._last_end_time)
+    self._problem_counts.update(other._problem_counts)
+    self._bucket_sizes.update(other._bucket_sizes)
+    for record in records:
+      self._KeepRecord(record)
 
-        for i, ad in enumerate(bid_response.ad):
-          self.ValidateAd(ad, i, record)
+  def _RecordTiming(self, record):
+    """Accumulates the latency and send time of a record, if known.
 
-      if record.problems:
-        self._problematic.append(record)
+    Args:
+      record: A Record instance.
+    """
+    if record.latency is None:
+      return
+    if record.latency * 1000 > self._deadline_ms:
+      self._deadline_misses += 1
+    if record.start_time is not None:
+      end_time = record.start_time + record.latency
+      if self._first_start_time is None:
+        self._first_start_time = record.start_time
+        self._last_end_time = end_time
       else:
-        self._good.append(record)
+        self._first_start_time = min(self._first_start_time, record.start_time)
+        self._last_end_time = max(self._last_end_time, end_time)
 
   def ValidatePing(self, record):
     """Validates a response for a ping request.
@@ -322,7 +1243,7 @@ class LogSummarizer(object):
     """
     bid_response = record.bid_response
     if bid_response.ad:
-      record.problems.append(self.RESPONSE_ERROR_MESSAGES['ads-in-ping'])
+      self._AddResponseProblem(record, 'ads-in-ping')
 
   def ValidateHtmlSnippetAd(self, ad, ad_index, record):
     """Validates a returned HTML 3rd party ad.
@@ -339,14 +1260,12 @@ class LogSummarizer(object):
       record: A Record instance containing the context for this validation.
     """
     if not ad.html_snippet:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['empty-snippet']))
+      self._AddAdProblem(record, ad_index, 'empty-snippet')
 
     self.ValidateClickThroughUrls(ad.click_through_url, ad_index, record)
 
     if record.bid_request.HasField('video'):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['video-in-request']))
+      self._AddAdProblem(record, ad_index, 'video-in-request')
 
   def ValidateTemplateAd(self, ad, ad_index, record):
     """Validates a returned HTML 3rd party ad.
@@ -365,20 +1284,15 @@ class LogSummarizer(object):
     """
     if not(ad.HasField('snippet_template') and
            len(ad.template_parameter) > 0):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['template-and-parameters']))
+      self._AddAdProblem(record, ad_index, 'template-and-parameters')
 
     params = TEMPLATE_PARAM_REGEX.findall(ad.snippet_template)
     if len(params) < 2:
-      record.problems.append(
-          (self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['at-least-two-params']))
-          + str(len(params)))
+      self._AddAdProblem(record, ad_index, 'at-least-two-params',
+                         str(len(params)))
     if len(params) > 4:
-      record.problems.append(
-          (self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['at-most-four-params']))
-          + str(len(params)))
+      self._AddAdProblem(record, ad_index, 'at-most-four-params',
+                         str(len(params)))
 
     int_params = []  # Converted to integers.
     non_int_params = []  # Extracted strings of parameters that aren't ints.
@@ -391,13 +1305,11 @@ class LogSummarizer(object):
     # Make sure the params are integers.
     if non_int_params:
       error_string = ', '.join(['%%%%%s%%%%' % p for p in non_int_params])
-      record.problems.append((self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['non-int-params'])) + error_string)
+      self._AddAdProblem(record, ad_index, 'non-int-params', error_string)
     elif sorted(int_params) != range(len(int_params)):
       # Parameters in the template must be numbered 0..N-1, where N is the
       # number of parameters.
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['non-consecutive-params']))
+      self._AddAdProblem(record, ad_index, 'non-consecutive-params')
 
     # Index of first backup parameter, initially -1 for none.
     backup_start = -1
@@ -412,26 +1324,21 @@ class LogSummarizer(object):
         backup_index = param_value.backup_index
         # Backup parameters must reference a valid index.
         if backup_index < 0 or backup_index >= len(int_params):
-          record.problems.append((self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['invalid-backup-reference'])) +
-              str(backup_index))
+          self._AddAdProblem(record, ad_index, 'invalid-backup-reference',
+                             str(backup_index))
       else:
         num_regular_params += 1
         if backup_start != -1:
           # We encountered a regular ad after a backup ad.
-          record.problems.append(self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['backup-not-at-end']))
+          self._AddAdProblem(record, ad_index, 'backup-not-at-end')
 
     if num_regular_params != len(params):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['param-mismatch']))
+      self._AddAdProblem(record, ad_index, 'param-mismatch')
 
     if ad.HasField('buyer_creative_id'):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['buyer-id-in-response']))
+      self._AddAdProblem(record, ad_index, 'buyer-id-in-response')
     if ad.click_through_url:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['url-in-response']))
+      self._AddAdProblem(record, ad_index, 'url-in-response')
 
     # Find slot dimension.
     width, height = None, None
@@ -444,11 +1351,9 @@ class LogSummarizer(object):
 
     for i, param_value in enumerate(ad.template_parameter):
       if not param_value.HasField('buyer_creative_id'):
-        record.problems.append(self.AD_ERROR_TEMPLATE % (
-            ad_index, self.AD_ERROR_MESSAGES['no-id-in-parameter']))
+        self._AddAdProblem(record, ad_index, 'no-id-in-parameter')
       if not param_value.HasField('parameter_value'):
-        record.problems.append(self.AD_ERROR_TEMPLATE % (
-            ad_index, self.AD_ERROR_MESSAGES['no-value-in-parameter']))
+        self._AddAdProblem(record, ad_index, 'no-value-in-parameter')
 
       self.ValidateClickThroughUrls([param_value.click_through_url],
                                     ad_index,
@@ -458,19 +1363,16 @@ class LogSummarizer(object):
              param_value.HasField('right') and
              param_value.HasField('bottom') and
              param_value.HasField('top')):
-        record.problems.append(self.AD_ERROR_TEMPLATE % (
-            ad_index, self.AD_ERROR_MESSAGES['no-bounds']))
+        self._AddAdProblem(record, ad_index, 'no-bounds')
       elif (width and height and
             (param_value.left < 0 or param_value.right > width
              or param_value.top > height or param_value.bottom < 0
              or param_value.right - param_value.left < 10
              or param_value.top - param_value.bottom < 10)):
-        record.problems.append(
-            (self.AD_ERROR_TEMPLATE % (
-                ad_index,
-                self.AD_ERROR_MESSAGES['invalid-template-dimensions'])) +
-            ('%d/%d/%d/%d.' % (param_value.left, param_value.right,
-                               param_value.bottom, param_value.top)))
+        self._AddAdProblem(
+            record, ad_index, 'invalid-template-dimensions',
+            '%d/%d/%d/%d.' % (param_value.left, param_value.right,
+                              param_value.bottom, param_value.top))
       elif not param_value.HasField('backup_index'):
         for other_param in ad.template_parameter[:i]:
           if other_param.HasField('backup_index'):
@@ -483,13 +1385,11 @@ class LogSummarizer(object):
             continue
           if other_param.bottom >= param_value.top:
             continue
-          record.problems.append(self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['one-dimension']))
+          self._AddAdProblem(record, ad_index, 'one-dimension')
           break
 
     if record.bid_request.HasField('video'):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['video-in-request']))
+      self._AddAdProblem(record, ad_index, 'video-in-request')
 
   def ValidateClickThroughUrls(self, click_through_urls, ad_index, record):
     """Validates click through URLs for an ad.
@@ -503,18 +1403,14 @@ class LogSummarizer(object):
       record: A Record instance containing the context for this validation.
     """
     if not click_through_urls:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['no-click-through-urls']))
+      self._AddAdProblem(record, ad_index, 'no-click-through-urls')
     for click_through_url in click_through_urls:
       parsed_url = urlparse.urlparse(click_through_url)
       # Must have scheme and netloc.
       if not (parsed_url[0]
               and (parsed_url[0] == 'http' or parsed_url[0] == 'https')
               and parsed_url[1]):
-        record.problems.append(
-            (self.AD_ERROR_TEMPLATE % (ad_index,
-                                       self.AD_ERROR_MESSAGES['invalid-url'])) +
-            click_through_url)
+        self._AddAdProblem(record, ad_index, 'invalid-url', click_through_url)
 
   def ValidateInstreamVideoAd(self, ad, ad_index, record):
     """Validates a returned instream video ad.
@@ -533,14 +1429,10 @@ class LogSummarizer(object):
     if not (parsed_url[0] and
             (parsed_url[0] == 'http' or parsed_url[0] == 'https') and
             parsed_url[1]):
-      record.problems.append(
-          (self.AD_ERROR_TEMPLATE % (
-              ad_index, self.AD_ERROR_MESSAGES['invalid-video-url']))
-          + ad.video_url)
+      self._AddAdProblem(record, ad_index, 'invalid-video-url', ad.video_url)
 
     if not record.bid_request.HasField('video'):
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['no-video-in-request']))
+      self._AddAdProblem(record, ad_index, 'no-video-in-request')
 
   def ValidateAd(self, ad, ad_index, record):
     """Validates a returned ad.
@@ -560,11 +1452,9 @@ class LogSummarizer(object):
         found_types.append(field)
 
     if not found_types:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['no-types']))
+      self._AddAdProblem(record, ad_index, 'no-types')
     elif len(found_types) > 1:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['mulitple-types']))
+      self._AddAdProblem(record, ad_index, 'mulitple-types')
 
     if ad.HasField('video_url'):
       self.ValidateInstreamVideoAd(ad, ad_index, record)
@@ -576,8 +1466,7 @@ class LogSummarizer(object):
       self.ValidateTemplateAd(ad, ad_index, record)
 
     if not ad.adslot:
-      record.problems.append(self.AD_ERROR_TEMPLATE % (
-          ad_index, self.AD_ERROR_MESSAGES['no-adslots']))
+      self._AddAdProblem(record, ad_index, 'no-adslots')
       self._responses_successful_without_bids += 1
 
     adslot_problems = False
@@ -610,8 +1499,7 @@ class LogSummarizer(object):
     # Check that one of the required click url macros is present.
     if not (re.search(self.CLICK_URL_ESC_RE, ad.html_snippet) or
             re.search(self.CLICK_URL_UNESC_RE, ad.html_snippet)):
-      record.problems.append(self.SNIPPET_ERROR_TEMPLATE % (
-          ad_index, self.SNIPPET_ERROR_MESSAGES['click-url-missing']))
+      self._AddSnippetProblem(record, ad_index, 'click-url-missing')
 
     adslot_id = ad.adslot[0].id
 
@@ -707,30 +1595,21 @@ class LogSummarizer(object):
     """
     problems_found = False
     if adslot.max_cpm_micros == 0:
-      record.problems.append(self.ADSLOT_ERROR_TEMPLATE % (
-          adslot_index, ad_index, self.ADSLOT_ERROR_MESSAGES['zero-bid']))
+      self._AddAdSlotProblem(record, adslot_index, ad_index, 'zero-bid')
       problems_found = True
 
     if adslot.HasField('min_cpm_micros'):
       if adslot.min_cpm_micros == 0:
-        record.problems.append(self.ADSLOT_ERROR_TEMPLATE % (
-            adslot_index,
-            ad_index,
-            self.ADSLOT_ERROR_MESSAGES['zero-min-cpm']))
+        self._AddAdSlotProblem(record, adslot_index, ad_index, 'zero-min-cpm')
         problems_found = True
       elif adslot.min_cpm_micros >= adslot.max_cpm_micros:
-        record.problems.append(self.ADSLOT_ERROR_TEMPLATE % (
-            adslot_index,
-            ad_index,
-            self.ADSLOT_ERROR_MESSAGES['min-more-than-max']))
+        self._AddAdSlotProblem(record, adslot_index, ad_index,
+                               'min-more-than-max')
         problems_found = True
 
     request_adslot = self.FindAdSlotInRequest(adslot.id, record.bid_request)
     if not request_adslot:
-      record.problems.append(self.ADSLOT_ERROR_TEMPLATE % (
-          ad_index,
-          adslot_index,
-          self.ADSLOT_ERROR_MESSAGES['invalid-slot-id']))
+      self._AddAdSlotProblem(record, ad_index, adslot_index, 'invalid-slot-id')
       problems_found = True
 
     return problems_found
@@ -751,58 +1630,104 @@ class LogSummarizer(object):
       snippet_log: A file like object for writing the rendered snippets, will
           not be closed by LogSummarizer.
     """
-    # Write header into snippet log file.
-    if self._good or self._problematic:
-      snippet_log.write('<html><head><title>Rendered snippets</title></head>\n')
-      snippet_log.write('<body><h1>Rendered Snippets</h1>')
-      snippet_log.write('<p>Your server has returned the following renderable'
-                        ' snippets:</p>')
-      snippet_log.write('<ul>')
-
-    if self._problematic:
-      problematic_log.write('=== Responses that parsed but had problems ===\n')
-    for record in self._problematic:
-      problematic_log.write('BidRequest:\n')
-      problematic_log.write(str(record.bid_request))
-      problematic_log.write('\nBidResponse:\n')
-      problematic_log.write(str(record.bid_response))
-      problematic_log.write('\nProblems:\n')
-      for problem in record.problems:
-        problematic_log.write('\t%s\n' % problem)
-      self.WriteSnippet(record, snippet_log)
-
-    if self._good:
-      good_log.write('=== Successful responses ===\n')
-    for record in self._good:
-      good_log.write('BidRequest:\n')
-      good_log.write(str(record.bid_request))
-      good_log.write('\nBidResponse:\n')
-      good_log.write(str(record.bid_response))
-      self.WriteSnippet(record, snippet_log)
-
-    if self._good or self._problematic:
+    self.StreamLogFiles(good_log, problematic_log, invalid_log, error_log,
+                        snippet_log)
+    for bucket in [PROBLEMATIC, GOOD, INVALID, ERROR]:
+      for record in self._buckets[bucket]:
+        self._WriteRecord(record)
+    self.FinishLogFiles()
+
+  def StreamLogFiles(self, good_log, problematic_log, invalid_log, error_log,
+                     snippet_log):
+    """Writes records to log files as soon as they are summarized.
+
+    Records summarized after this call are not retained, so memory use does
+    not grow with the number of records. FinishLogFiles must be called once all
+    records have been summarized. The arguments are the same as for
+    WriteLogFiles.
+    """
+    self._log_files = {
+        GOOD: good_log,
+        PROBLEMATIC: problematic_log,
+        INVALID: invalid_log,
+        ERROR: error_log,
+        SNIPPETS: snippet_log,
+    }
+    self._log_headers_written = set()
+
+  def FinishLogFiles(self):
+    """Completes the log files set by StreamLogFiles and stops streaming."""
+    if SNIPPETS in self._log_headers_written:
       # Write footer into snippet log file.
-      snippet_log.write('</ul></body></html>')
-
-    if self._invalid:
-      invalid_log.write('=== Responses that failed to parse ===\n')
-    for record in self._invalid:
-      invalid_log.write('BidRequest:\n')
-      invalid_log.write(str(record.bid_request))
-      invalid_log.write('\nPayload represented as a python list of bytes:\n')
+      self._log_files[SNIPPETS].write('</ul></body></html>')
+    self._log_files = None
+
+  def _WriteLogHeader(self, key):
+    """Writes the header of a log file unless it has already been written.
+
+    Args:
+      key: One of BUCKETS or SNIPPETS.
+    """
+    if key in self._log_headers_written:
+      return
+    self._log_headers_written.add(key)
+    log_file = self._log_files[key]
+    if key == SNIPPETS:
+      log_file.write('<html><head><title>Rendered snippets</title></head>\n')
+      log_file.write('<body><h1>Rendered Snippets</h1>')
+      log_file.write('<p>Your server has returned the following renderable'
+                     ' snippets:</p>')
+      log_file.write('<ul>')
+    elif key == PROBLEMATIC:
+      log_file.write('=== Responses that parsed but had problems ===\n')
+    elif key == GOOD:
+      log_file.write('=== Successful responses ===\n')
+    elif key == INVALID:
+      log_file.write('=== Responses that failed to parse ===\n')
+    elif key == ERROR:
+      log_file.write('=== Requests that received a non 200 HTTP response'
+                     ' ===\n')
+
+  def _WriteRecord(self, record):
+    """Writes a summarized record to the log file of its bucket.
+
+    Args:
+      record: A Record instance that has been added to a bucket.
+    """
+    if record.bucket in (GOOD, PROBLEMATIC):
+      # Rendered snippets of good and problematic records share one file.
+      self._WriteLogHeader(SNIPPETS)
+    self._WriteLogHeader(record.bucket)
+    log_file = self._log_files[record.bucket]
+
+    if record.bucket == PROBLEMATIC:
+      log_file.write('BidRequest:\n')
+      log_file.write(str(record.bid_request))
+      log_file.write('\nBidResponse:\n')
+      log_file.write(str(record.bid_response))
+      log_file.write('\nProblems:\n')
+      for problem in record.problems:
+        log_file.write('\t%s\n' % problem)
+      self.WriteSnippet(record, self._log_files[SNIPPETS])
+    elif record.bucket == GOOD:
+      log_file.write('BidRequest:\n')
+      log_file.write(str(record.bid_request))
+      log_file.write('\nBidResponse:\n')
+      log_file.write(str(record.bid_response))
+      self.WriteSnippet(record, self._log_files[SNIPPETS])
+    elif record.bucket == INVALID:
+      log_file.write('BidRequest:\n')
+      log_file.write(str(record.bid_request))
+      log_file.write('\nPayload represented as a python list of bytes:\n')
       byte_list = [ord(c) for c in record.payload]
-      invalid_log.write(str(byte_list))
-
-    if self._error:
-      error_log.write('=== Requests that received a non 200 HTTP response'
-                      ' ===\n')
-    for record in self._error:
-      error_log.write('BidRequest:\n')
-      error_log.write(str(record.bid_request))
-      error_log.write('HTTP response status code: %d\n' % record.status)
-      error_log.write('\nPayload represented as a python list of bytes:\n')
+      log_file.write(str(byte_list))
+    elif record.bucket == ERROR:
+      log_file.write('BidRequest:\n')
+      log_file.write(str(record.bid_request))
+      log_file.write('HTTP response status code: %d\n' % record.status)
+      log_file.write('\nPayload represented as a python list of bytes:\n')
       byte_list = [ord(c) for c in record.payload]
-      error_log.write(str(byte_list))
+      log_file.write(str(byte_list))
 
   def WriteSnippet(self, record, log):
     """Writes the snippets in the given record into the log."""
@@ -833,18 +1758,216 @@ class LogSummarizer(object):
       log.write(iframe)
       log.write('</li>')
 
+  def _Rate(self, count):
+    """Returns count as a fraction of the requests sent."""
+    if not self._requests_sent:
+      return 0.0
+    return float(count) / self._requests_sent
+
+  def GetLatencySummary(self):
+    """Summarizes the distribution of round trip times.
+
+    Returns:
+      A dictionary of latency statistics in milliseconds, including one entry
+      per LATENCY_PERCENTILES value keyed by PercentileKey, or None if no
+      record had timing information.
+    """
+    return _KeyPercentiles(results.Describe(
+        self._results.Latencies(), LATENCY_PERCENTILES, scale=1000))
+
+  def GetSizeSummary(self):
+    """Summarizes round trip times by request size.
+
+    Returns:
+      A list with a dictionary per results.SizeBucket of the requests, with
+      its min_bytes, max_bytes and requests, and latency_ms statistics as
+      returned by GetLatencySummary.
+    """
+    return [{'min_bytes': bucket.min_bytes,
+             'max_bytes': bucket.max_bytes,
+             'requests': bucket.requests,
+             'latency_ms': _KeyPercentiles(bucket.latency)}
+            for bucket in self._results.SizeHistogram(LATENCY_PERCENTILES,
+                                                      scale=1000)]
+
+  def GetClassSummary(self):
+    """Summarizes errors and round trip times by request class.
+
+    Returns:
+      A dictionary mapping the name of each class that has requests to a
+      dictionary with its requests, error_rate (the fraction of non-200
+      responses) and latency_ms statistics as returned by
+      GetLatencySummary.
+    """
+    return dict(
+        (self._request_classes[group.request_class],
+         {'requests': group.requests,
+          'error_rate': float(group.errors) / group.requests,
+          'latency_ms': _KeyPercentiles(group.latency)})
+        for group in self._results.ClassBreakdown(LATENCY_PERCENTILES,
+                                                  scale=1000))
+
+  def GetEndpointSummary(self):
+    """Summarizes errors and round trip times by endpoint.
+
+    Returns:
+      A dictionary mapping the URL of each endpoint set with SetEndpoints
+      that has requests to a dictionary as in GetClassSummary.
+    """
+    return dict(
+        (self._endpoints[group.endpoint],
+         {'requests': group.requests,
+          'error_rate': float(group.errors) / group.requests,
+          'latency_ms': _KeyPercentiles(group.latency)})
+        for group in self._results.EndpointBreakdown(LATENCY_PERCENTILES,
+                                                     scale=1000)
+        if group.endpoint)
+
+  def GetResults(self):
+    """Returns the results.ResultsStore with a row per summarized record.
+
+    Request classes, buckets and endpoints are stored as indices into
+    GetRequestClasses(), BUCKETS and GetEndpoints().
+    """
+    return self._results
+
+  def GetSummary(self):
+    """Returns a machine-readable summary of the test.
+
+    Returns:
+      A dictionary that can be serialized as JSON.
+    """
+    duration = 0.0
+    if self._first_start_time is not None:
+      duration = self._last_end_time - self._first_start_time
+    latency_summary = self.GetLatencySummary()
+    achieved_qps = None
+    if duration > 0 and latency_summary is not None:
+      achieved_qps = latency_summary['count'] / duration
+    average_processing_time = None
+    if self._processing_time_count:
+      average_processing_time = (self._processing_time_sum * 1.0 /
+                                 self._processing_time_count)
+    return {
+        'requests_sent': self._requests_sent,
+        'responses_ok': self._responses_ok,
+        'responses_with_bids': self._responses_with_bids,
+        'responses_successful_without_bids':
+            self._responses_successful_without_bids,
+        'buckets': dict((bucket, self._bucket_sizes[bucket])
+                        for bucket in BUCKETS),
+        'bid_rate': self._Rate(self._responses_with_bids),
+        'error_rate': self._Rate(self._bucket_sizes[ERROR] +
+                                 self._bucket_sizes[INVALID]),
+        'problem_rate': self._Rate(self._bucket_sizes[PROBLEMATIC]),
+        'duration_seconds': duration,
+        'achieved_qps': achieved_qps,
+        'latency_ms': latency_summary,
+        'deadline_ms': self._deadline_ms,
+        'deadline_misses': self._deadline_misses,
+        'deadline_miss_rate': self._Rate(self._deadline_misses),
+        'average_processing_time_ms': average_processing_time,
+        'repeat_rates': dict(self._repeat_rates),
+        'rate_control': self._rate_control,
+        'request_sizes': self.GetSizeSummary(),
+        'request_classes': self.GetClassSummary(),
+        'endpoints': self.GetEndpointSummary(),
+        'problem_counts': dict(self._problem_counts),
+        'top_problems': [
+            {'code': code, 'count': count,
+             'description': self.DescribeProblem(code)}
+            for code, count in self.GetTopProblems(
+                self.TOP_PROBLEMS_TO_REPORT)],
+    }
+
+  def WriteJsonSummary(self, summary_file):
+    """Writes the summary returned by GetSummary as JSON.
+
+    Args:
+      summary_file: A file like object, will not be closed by LogSummarizer.
+    """
+    json.dump(self.GetSummary(), summary_file, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    summary_file.write('\n')
+
   def PrintReport(self):
     """Prints a summary report."""
     print '=== Summary of Real-time Bidding test ==='
     print 'Requests sent: %d' % self._requests_sent
     print 'Responses with a 200/OK HTTP response code: %d' % self._responses_ok
-    print 'Responses with a non-200 HTTP response code: %d' % len(self._error)
-    print 'Good responses (no problems found): %d' % len(self._good)
-    print 'Invalid (unparseable) with a 200/OK HTTP response code: %d' % len(
-        self._invalid)
-    print 'Parseable responses with problems: %d' % len(self._problematic)
+    print 'Responses with a non-200 HTTP response code: %d' % (
+        self._bucket_sizes[ERROR])
+    print 'Good responses (no problems found): %d' % self._bucket_sizes[GOOD]
+    print 'Invalid (unparseable) with a 200/OK HTTP response code: %d' % (
+        self._bucket_sizes[INVALID])
+    print 'Parseable responses with problems: %d' % (
+        self._bucket_sizes[PROBLEMATIC])
     if self._processing_time_count:
       print 'Average processing time in milliseconds %d' % (
           self._processing_time_sum * 1.0 / self._processing_time_count)
     if self._responses_successful_without_bids == self._requests_sent:
       print 'ERROR: None of the responses had bids!'
+    latency_summary = self.GetLatencySummary()
+    if latency_summary:
+      summary = self.GetSummary()
+      if summary['achieved_qps']:
+        print 'Achieved QPS: %.1f' % summary['achieved_qps']
+      print 'Round trip latency in milliseconds: %s' % ', '.join(
+          '%s %.1f' % (key, latency_summary[key]) for key in
+          ['min'] + [PercentileKey(p) for p in LATENCY_PERCENTILES] + ['max'])
+      print 'Responses slower than the %d ms deadline: %d' % (
+          self._deadline_ms, self._deadline_misses)
+    if self._rate_control:
+      converged_qps = self._rate_control['converged_qps']
+      if converged_qps is None:
+        print 'Adaptive rate: no backoff up to %.1f QPS' % (
+            self._rate_control['final_qps'])
+      else:
+        print ('Adaptive rate: converged to %.1f QPS (%d backoffs, final '
+               '%.1f QPS)' % (converged_qps, self._rate_control['backoffs'],
+                             self._rate_control['final_qps']))
+    if self._repeat_rates:
+      print 'Implied repeat rates: %s' % ', '.join(
+          '%s %.1f%%' % (name, self._repeat_rates[name] * 100)
+          for name in sorted(self._repeat_rates))
+    if latency_summary:
+      keys = ['mean'] + [PercentileKey(p) for p in LATENCY_PERCENTILES]
+      print '=== Round trip latency in milliseconds by request size ==='
+      print '%-15s %10s%s' % ('Bytes', 'Requests',
+                              ''.join(' %8s' % key for key in keys))
+      for bucket in self.GetSizeSummary():
+        latency_ms = bucket['latency_ms']
+        print '%-15s %10d%s' % (
+            '%d-%d' % (bucket['min_bytes'], bucket['max_bytes'] - 1),
+            bucket['requests'],
+            ''.join(' %8.1f' % latency_ms[key] if latency_ms else
+                    ' %8s' % '-' for key in keys))
+      print '=== Round trip latency in milliseconds by request class ==='
+      print '%-15s %10s %8s%s' % ('Class', 'Requests', 'Errors',
+                                  ''.join(' %8s' % key for key in keys))
+      class_summary = self.GetClassSummary()
+      for request_class in sorted(class_summary):
+        summary = class_summary[request_class]
+        latency_ms = summary['latency_ms']
+        print '%-15s %10d %7.1f%%%s' % (
+            request_class, summary['requests'], summary['error_rate'] * 100,
+            ''.join(' %8.1f' % latency_ms[key] if latency_ms else
+                    ' %8s' % '-' for key in keys))
+      endpoint_summary = self.GetEndpointSummary()
+      if len(endpoint_summary) > 1:
+        print '=== Round trip latency in milliseconds by endpoint ==='
+        print '%-40s %10s %8s%s' % ('Endpoint', 'Requests', 'Errors',
+                                    ''.join(' %8s' % key for key in keys))
+        for endpoint in sorted(endpoint_summary):
+          summary = endpoint_summary[endpoint]
+          latency_ms = summary['latency_ms']
+          print '%-40s %10d %7.1f%%%s' % (
+              endpoint, summary['requests'], summary['error_rate'] * 100,
+              ''.join(' %8.1f' % latency_ms[key] if latency_ms else
+                      ' %8s' % '-' for key in keys))
+    top_problems = self.GetTopProblems(self.TOP_PROBLEMS_TO_REPORT)
+    if top_problems:
+      print '=== Top problems (%d distinct) ===' % len(self._problem_counts)
+      print '%10s  %-28s %s' % ('Count', 'Code', 'Description')
+      for code, count in top_problems:
+        print '%10d  %-28s %s' % (count, code, self.DescribeProblem(code))
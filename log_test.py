@@ -2,8 +2,12 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """Unit tests for log.py"""
 
+import json
+import pickle
 import re
 import StringIO
+import threading
+import time
 import unittest
 
 import log
@@ -31,11 +35,21 @@ class LoggerTest(unittest.TestCase):
     bid_request = realtime_bidding_pb2.BidRequest()
     bid_request.id = 'id111'
     self.logger.LogSynchronousRequest(bid_request, 200, 'Hello')
+    self.assertFalse(self.logger._done)
+    self.logger.Done()
     self.assertEqual(1, len(self.logger._records))
     self.assertEqual(bid_request, self.logger._records[0].bid_request)
     self.assertEqual(200, self.logger._records[0].status)
     self.assertEqual('Hello', self.logger._records[0].payload)
-    self.assertFalse(self.logger._done)
+
+  def testLogSynchronousRequestWithTiming(self):
+    """Tests logging a request with its send time and latency."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id112'
+    self.logger.LogSynchronousRequest(bid_request, 200, 'Hello', 1000.5, 0.25)
+    self.logger.Done()
+    self.assertEqual(1000.5, self.logger._records[0].start_time)
+    self.assertEqual(0.25, self.logger._records[0].latency)
 
   def testSetDone(self):
     """Tests locking the logger."""
@@ -83,6 +97,62 @@ class LoggerTest(unittest.TestCase):
       self.assertEqual(123, record.status)
       self.assertEqual('Payload', record.payload)
 
+  def testLogRecords(self):
+    """Tests logging a batch of records."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id114'
+    records = [log.Record(bid_request, 200, 'Payload') for _ in range(3)]
+    self.assertTrue(self.logger.LogRecords(records))
+    self.logger.Done()
+    self.assertEqual(records, self.Iterate())
+    self.assertFalse(self.logger.LogRecords(records))
+
+  def testLoggingFromThreads(self):
+    """Tests that records of several threads are merged by send time."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id115'
+
+    def LogRequests(offset):
+      for i in range(100):
+        self.logger.LogSynchronousRequest(bid_request, 200, 'Payload',
+                                          1000.0 + i * 4 + offset, 0.01)
+
+    threads = [threading.Thread(target=LogRequests, args=(offset,))
+               for offset in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.logger.Done()
+    self.assertEqual([1000.0 + i for i in range(400)],
+                     [record.start_time for record in self.Iterate()])
+
+  def testLoggingWhileDone(self):
+    """Tests that the records reported as logged are kept by Done."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id116'
+    logged = [[] for _ in range(4)]
+
+    def LogRequests(offset):
+      for i in range(10000):
+        start_time = 1000.0 + i * 4 + offset
+        if not self.logger.LogSynchronousRequest(bid_request, 200, 'Payload',
+                                                 start_time, 0.01):
+          break
+        logged[offset].append(start_time)
+
+    threads = [threading.Thread(target=LogRequests, args=(offset,))
+               for offset in range(4)]
+    for thread in threads:
+      thread.start()
+    while not any(logged):
+      time.sleep(0.001)
+    self.logger.Done()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(sorted(sum(logged, [])),
+                     [record.start_time for record in self.Iterate()])
+
   def testIsDone(self):
     """Tests checking whether the logger has been locked for updates."""
     self.assertFalse(self.logger.IsDone())
@@ -90,6 +160,58 @@ class LoggerTest(unittest.TestCase):
     self.assertTrue(self.logger.IsDone())
 
 
+class RecordTest(unittest.TestCase):
+  """Tests the log.Record class."""
+
+  def setUp(self):
+    self.bid_request = realtime_bidding_pb2.BidRequest()
+    self.bid_request.id = 'id111'
+    self.bid_response = realtime_bidding_pb2.BidResponse()
+    self.bid_response.processing_time_ms = 10
+
+  def testSerializedBidRequest(self):
+    """Tests that a request given as bytes is parsed on first access."""
+    serialized = self.bid_request.SerializeToString()
+    record = log.Record(serialized, 200, 'Hello')
+    self.assertEqual(serialized, record.serialized_bid_request)
+    self.assertEqual(None, record._bid_request)
+    self.assertEqual(self.bid_request, record.bid_request)
+    self.assertEqual([], record.problems)
+    self.assertEqual({}, record.html_snippets)
+    self.assertFalse(hasattr(record, '__dict__'))
+
+  def testCompact(self):
+    """Tests that Compact drops messages that can be recreated."""
+    record = log.Record(self.bid_request, 200,
+                        self.bid_response.SerializeToString())
+    record.bid_response = self.bid_response
+    record.problems.append('A problem')
+    record.html_snippets
+    record.Compact()
+    self.assertEqual(None, record._bid_request)
+    self.assertEqual(None, record._bid_response)
+    self.assertEqual(None, record._html_snippets)
+    self.assertEqual(self.bid_request, record.bid_request)
+    self.assertEqual(self.bid_response, record.bid_response)
+    self.assertEqual(['A problem'], record.problems)
+
+  def testPickle(self):
+    """Tests that records are pickled in compact form."""
+    record = log.Record(self.bid_request, 200, 'Hello', 1000.0, 0.01,
+                        'mobile', 'http://a/')
+    record.problem_codes.append('empty')
+    record.bucket = log.INVALID
+    copy = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(None, copy._bid_request)
+    self.assertEqual(self.bid_request, copy.bid_request)
+    self.assertEqual((200, 'Hello', 1000.0, 0.01, ['empty'], log.INVALID,
+                      'mobile', 'http://a/'),
+                     (copy.status, copy.payload, copy.start_time,
+                      copy.latency, copy.problem_codes, copy.bucket,
+                      copy.request_class, copy.endpoint))
+    self.assertEqual(None, copy.bid_response)
+
+
 class TestLogSummarizer(unittest.TestCase):
   def setUp(self):
     """Sets up tests."""
@@ -968,6 +1090,283 @@ class TestLogSummarizer(unittest.TestCase):
     self.assertTrue(record in self.summarizer._problematic)
     self.assertEqual(1, len(record.problems))
 
+  def testSummarizeRecordsProblemCodes(self):
+    """Tests that each problem is recorded with its code."""
+    bid_response, record = self.CreateSuccessfulRecord()
+    bid_response.ad[0].ClearField('click_through_url')
+    bid_response.ad[0].adslot[0].max_cpm_micros = 0
+    record.payload = bid_response.SerializeToString()
+    self.records.append(record)
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    self.assertEqual(['no-click-through-urls', 'zero-bid'],
+                     record.problem_codes)
+    self.assertEqual(len(record.problems), len(record.problem_codes))
+
+  def testGetTopProblems(self):
+    """Tests that problem codes are counted and ranked by frequency."""
+    for _ in range(3):
+      _, record = self.CreateSuccessfulRecord()
+      record.status = 500
+      self.records.append(record)
+    for _ in range(2):
+      _, record = self.CreateSuccessfulRecord()
+      record.payload = 'garbage'
+      self.records.append(record)
+    _, record = self.CreateSuccessfulRecord()
+    record.payload = ''
+    self.records.append(record)
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    self.assertEqual([('not-ok', 3), ('parse-error', 2), ('empty', 1)],
+                     self.summarizer.GetTopProblems())
+    self.assertEqual([('not-ok', 3)], self.summarizer.GetTopProblems(1))
+
+  def testDescribeProblem(self):
+    """Tests looking up the description of a problem code."""
+    self.summarizer = log.LogSummarizer(self.records)
+    self.assertEqual('0 max CPM bid.', self.summarizer.DescribeProblem(
+        'zero-bid'))
+    self.assertEqual('invalid click-through URL',
+                     self.summarizer.DescribeProblem('invalid-url'))
+    self.assertEqual('unknown', self.summarizer.DescribeProblem('unknown'))
+
+  def testGetSummary(self):
+    """Tests the machine-readable summary of timed records."""
+    for i in range(10):
+      _, record = self.CreateSuccessfulRecord()
+      record.start_time = 1000.0 + i * 0.1
+      record.latency = (i + 1) * 0.02
+      self.records.append(record)
+    self.records[0].status = 500
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.SetDeadline(150)
+    self.summarizer.SetRepeatRates({'google_user_id': 0.25})
+    self.summarizer.Summarize()
+    summary = self.summarizer.GetSummary()
+    self.assertEqual(10, summary['requests_sent'])
+    self.assertEqual({'good': 9, 'problematic': 0, 'invalid': 0, 'error': 1},
+                     summary['buckets'])
+    self.assertAlmostEqual(0.1, summary['error_rate'])
+    self.assertAlmostEqual(0.9, summary['bid_rate'])
+    # Latencies of 160 and 180 and 200 ms miss the 150 ms deadline.
+    self.assertEqual(3, summary['deadline_misses'])
+    self.assertAlmostEqual(1.1, summary['duration_seconds'])
+    self.assertAlmostEqual(10 / 1.1, summary['achieved_qps'])
+    latency_ms = summary['latency_ms']
+    self.assertEqual(10, latency_ms['count'])
+    self.assertAlmostEqual(20, latency_ms['min'])
+    self.assertAlmostEqual(100, latency_ms['p50'])
+    self.assertAlmostEqual(200, latency_ms['p99'])
+    self.assertAlmostEqual(110, latency_ms['mean'])
+    self.assertEqual({'not-ok': 1}, summary['problem_counts'])
+    self.assertEqual('not-ok', summary['top_problems'][0]['code'])
+    self.assertEqual({'google_user_id': 0.25}, summary['repeat_rates'])
+    request_sizes = summary['request_sizes']
+    self.assertEqual(10, sum(bucket['requests'] for bucket in request_sizes))
+    for bucket in request_sizes:
+      self.assertEqual(bucket['requests'], bucket['latency_ms']['count'])
+      self.assertTrue(bucket['min_bytes'] < bucket['max_bytes'])
+    display = summary['request_classes'][log.DISPLAY]
+    self.assertEqual(10, display['requests'])
+    self.assertAlmostEqual(0.1, display['error_rate'])
+    self.assertAlmostEqual(110, display['latency_ms']['mean'])
+
+  def testGetSummaryWithoutTiming(self):
+    """Tests that records without timing produce no latency statistics."""
+    _, record = self.CreateSuccessfulRecord()
+    self.records.append(record)
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    summary = self.summarizer.GetSummary()
+    self.assertEqual(None, summary['latency_ms'])
+    self.assertEqual(None, summary['achieved_qps'])
+    self.assertEqual(0, summary['deadline_misses'])
+
+  def testGetResults(self):
+    """Tests that every summarized record gets a row of metrics."""
+    for _ in range(3):
+      _, record = self.CreateSuccessfulRecord()
+      self.records.append(record)
+    self.records[0].status = 500
+    self.records[1].latency = 0.05
+    self.records[2].bid_request.video.videoad_start_delay = 1000
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    results = self.summarizer.GetResults()
+    self.assertEqual(3, len(results))
+    self.assertEqual([500, 200, 200], list(results.Column('status')))
+    self.assertEqual([log.ERROR, log.GOOD, log.PROBLEMATIC],
+                     [log.BUCKETS[b] for b in results.Column('bucket')])
+    self.assertEqual([log.DISPLAY, log.DISPLAY, log.VIDEO],
+                     [log.REQUEST_CLASSES[c]
+                      for c in results.Column('request_class')])
+    self.assertEqual([0.05], list(results.Latencies()))
+    self.assertEqual(len(self.records[0].payload),
+                     results.Column('response_size')[0])
+
+  def testRequestClasses(self):
+    """Tests counting records in the traffic class they were sent as."""
+    request_classes = ['mobile', None, 'multislot', 'unknown', 'multislot']
+    for request_class in request_classes:
+      _, record = self.CreateSuccessfulRecord()
+      record.request_class = request_class
+      record.latency = 0.01
+      self.records.append(record)
+    self.records[2].status = 500
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.SetRequestClasses(['mobile', 'multislot', log.DISPLAY])
+    self.assertEqual([log.DISPLAY, log.VIDEO, log.PING, 'mobile',
+                      'multislot'], self.summarizer.GetRequestClasses())
+    self.summarizer.Summarize()
+    classes = self.summarizer.GetRequestClasses()
+    self.assertEqual(['mobile', log.DISPLAY, 'multislot', log.DISPLAY,
+                      'multislot'],
+                     [classes[c] for c in
+                      self.summarizer.GetResults().Column('request_class')])
+    class_summary = self.summarizer.GetClassSummary()
+    self.assertEqual(['display', 'mobile', 'multislot'],
+                     sorted(class_summary))
+    self.assertEqual(2, class_summary['multislot']['requests'])
+    self.assertAlmostEqual(0.5, class_summary['multislot']['error_rate'])
+    self.assertAlmostEqual(10, class_summary['mobile']['latency_ms']['max'])
+
+    chunked = log.LogSummarizer(None)
+    chunked.SetRequestClasses(['mobile', 'multislot'])
+    chunked.MergeChunk(self.records, log.SummarizeChunk(
+        self.records, None, log.DEFAULT_DEADLINE_MS, ['mobile', 'multislot']))
+    self.assertEqual(class_summary, chunked.GetClassSummary())
+
+  def testEndpoints(self):
+    """Tests counting records by the endpoint they were sent to."""
+    endpoints = ['http://a/', 'http://b/', None, 'http://c/', 'http://b/']
+    for i, endpoint in enumerate(endpoints):
+      _, record = self.CreateSuccessfulRecord()
+      record.endpoint = endpoint
+      record.latency = 0.01 * (i + 1)
+      self.records.append(record)
+    self.records[1].status = 500
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.SetEndpoints(['http://a/', 'http://b/'])
+    self.assertEqual([None, 'http://a/', 'http://b/'],
+                     self.summarizer.GetEndpoints())
+    self.summarizer.Summarize()
+    self.assertEqual([1, 2, 0, 0, 2],
+                     list(self.summarizer.GetResults().Column('endpoint')))
+    endpoint_summary = self.summarizer.GetEndpointSummary()
+    self.assertEqual(['http://a/', 'http://b/'], sorted(endpoint_summary))
+    self.assertEqual(2, endpoint_summary['http://b/']['requests'])
+    self.assertAlmostEqual(0.5, endpoint_summary['http://b/']['error_rate'])
+    self.assertAlmostEqual(50, endpoint_summary['http://b/']['latency_ms'][
+        'max'])
+    self.assertEqual(endpoint_summary,
+                     self.summarizer.GetSummary()['endpoints'])
+
+    chunked = log.LogSummarizer(None)
+    chunked.SetEndpoints(['http://a/', 'http://b/'])
+    chunked.MergeChunk(self.records, log.SummarizeChunk(
+        self.records, None, log.DEFAULT_DEADLINE_MS, (),
+        ['http://a/', 'http://b/']))
+    self.assertEqual(endpoint_summary, chunked.GetEndpointSummary())
+
+  def testRateControl(self):
+    """Tests that the adaptation of the request rate is summarized."""
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    self.assertEqual(None, self.summarizer.GetSummary()['rate_control'])
+    rate_control = {'initial_qps': 10.0, 'max_qps': 100.0, 'final_qps': 40.0,
+                    'converged_qps': 55.0, 'adjustments': 12, 'backoffs': 3}
+    self.summarizer.SetRateControl(rate_control)
+    self.assertEqual(rate_control,
+                     self.summarizer.GetSummary()['rate_control'])
+
+  def testWriteJsonSummary(self):
+    """Tests that the JSON summary round trips."""
+    _, record = self.CreateSuccessfulRecord()
+    self.records.append(record)
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize()
+    summary_file = StringIO.StringIO()
+    self.summarizer.WriteJsonSummary(summary_file)
+    self.assertEqual(self.summarizer.GetSummary(),
+                     json.loads(summary_file.getvalue()))
+
+  def testSummarizeChunksAndMerge(self):
+    """Tests that merging summarized chunks equals summarizing serially."""
+    for i in range(6):
+      _, record = self.CreateSuccessfulRecord()
+      record.status = 500 if i % 3 == 0 else 200
+      record.start_time = 1000.0 + i
+      record.latency = 0.01 * i
+      self.records.append(record)
+    serial = log.LogSummarizer(self.records)
+    serial.Summarize()
+
+    self.summarizer = log.LogSummarizer(None)
+    for chunk in [self.records[:4], self.records[4:]]:
+      self.summarizer.MergeChunk(chunk, log.SummarizeChunk(chunk))
+    self.assertEqual(serial.GetSummary(), self.summarizer.GetSummary())
+    self.assertEqual(serial._good, self.summarizer._good)
+    self.assertEqual(serial._error, self.summarizer._error)
+
+  def testSummarizeInParallel(self):
+    """Tests that summarizing on several processes matches a serial run."""
+    for i in range(10):
+      bid_response, record = self.CreateSuccessfulRecord()
+      if i % 3 == 0:
+        bid_response.ad[0].adslot[0].max_cpm_micros = 0
+        record.payload = bid_response.SerializeToString()
+      elif i % 4 == 0:
+        record.payload = 'garbage'
+      record.latency = 0.001 * i
+      self.records.append(record)
+    serial = log.LogSummarizer(self.records)
+    serial.Summarize()
+    serial_problems = [list(record.problems) for record in self.records]
+    serial_buckets = dict((bucket, list(records)) for bucket, records in
+                          serial._buckets.iteritems())
+    for record in self.records:
+      record.problems = []
+      record.problem_codes = []
+
+    self.summarizer = log.LogSummarizer(self.records)
+    self.summarizer.Summarize(processes=2, chunk_size=3)
+    self.assertEqual(serial.GetSummary(), self.summarizer.GetSummary())
+    self.assertEqual(serial_buckets, self.summarizer._buckets)
+    self.assertEqual(serial_problems,
+                     [record.problems for record in self.records])
+
+  def testSummarizeLoggerInParallel(self):
+    """Tests that a locked Logger is summarized once on several processes."""
+    logger = log.Logger()
+    for _ in range(5):
+      _, record = self.CreateSuccessfulRecord()
+      logger.LogRecords([record])
+    logger.Done()
+    self.assertEqual(5, len(list(logger)))
+    self.assertEqual(5, len(list(logger)))
+    self.summarizer = log.LogSummarizer(logger)
+    self.summarizer.Summarize(processes=2, chunk_size=3)
+    self.assertEqual(5, self.summarizer.GetSummary()['requests_sent'])
+    self.assertEqual(5, len(self.summarizer._good))
+    self.assertTrue(self.summarizer._good[0].bid_response.ad)
+
+  def testStreamLogFiles(self):
+    """Tests that streamed records are written but not retained."""
+    self.SetupLogs()
+    _, record = self.CreateSuccessfulRecord()
+    self.summarizer = log.LogSummarizer(None, retain_records=False)
+    self.summarizer.StreamLogFiles(self.good_log, self.problematic_log,
+                                   self.invalid_log, self.error_log,
+                                   self.snippet_log)
+    self.summarizer.SummarizeRecord(record)
+    self.summarizer.FinishLogFiles()
+    self.assertEqual([], self.summarizer._good)
+    self.assertEqual(1, self.summarizer.GetSummary()['buckets']['good'])
+    self.CheckLogHasNLines(self.good_log, 3)
+    self.assertEqual(1, self.snippet_log.getvalue().count('<li>'))
+    self.assertTrue(self.snippet_log.getvalue().endswith('</html>'))
+
   def CheckLogHasNLines(self, log_obj, n, exact=False):
     """Checks that the given StringIO object contains n or more lines of text.
 
@@ -1085,8 +1484,8 @@ class TestFunctions(unittest.TestCase):
 
   def testEscapeUrl(self):
     """Tests escaping a string."""
-    # For documentation about how the string is escaped see:
-    # https://sites.google.com/a/google.com/adx-rtb/technical-documentation/response
+    # For documentation about how the string is escaped see the docstring of
+    # log.EscapeUrl.
     alphanum = 'abcdefghijklmnopqrstxyzuvwABCDEFGHIJKLMNOPQRSTXYZUVW0123456789'
     unchanged = '!()*,-./:_~'
     escapable = '<>=;'
@@ -1095,6 +1494,134 @@ class TestFunctions(unittest.TestCase):
     result = log.EscapeUrl(unescaped)
     self.assertEqual(alphanum + unchanged + escaped, result)
 
+  def testChunks(self):
+    """Tests splitting an iterable into chunks."""
+    self.assertEqual([[0, 1, 2], [3, 4, 5], [6]],
+                     list(log._Chunks(xrange(7), 3)))
+    self.assertEqual([], list(log._Chunks([], 3)))
+
+  def testClassifyRequest(self):
+    """Tests classifying requests."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id111'
+    self.assertEqual(log.DISPLAY, log.ClassifyRequest(bid_request))
+    bid_request.video.videoad_start_delay = 1000
+    self.assertEqual(log.VIDEO, log.ClassifyRequest(bid_request))
+    bid_request.is_ping = True
+    self.assertEqual(log.PING, log.ClassifyRequest(bid_request))
+
+  def testPercentile(self):
+    """Tests nearest-rank percentiles."""
+    values = range(1, 101)
+    self.assertEqual(1, log.Percentile(values, 1))
+    self.assertEqual(50, log.Percentile(values, 50))
+    self.assertEqual(99, log.Percentile(values, 99))
+    self.assertEqual(100, log.Percentile(values, 99.9))
+    self.assertEqual(7, log.Percentile([7], 50))
+
+  def testFindSloViolations(self):
+    """Tests checking a summary against service level objectives."""
+    summary = {
+        'latency_ms': {'p99': 80.0, 'p50': 20.0},
+        'error_rate': 0.02,
+        'deadline_miss_rate': 0.001,
+    }
+    self.assertEqual([], log.FindSloViolations(summary))
+    self.assertEqual([], log.FindSloViolations(
+        summary, max_latency_ms=90, max_error_rate=0.05,
+        max_deadline_miss_rate=0.01))
+    violations = log.FindSloViolations(
+        summary, max_latency_ms=50, max_error_rate=0.01,
+        max_deadline_miss_rate=0.0)
+    self.assertEqual(3, len(violations))
+    self.assertTrue(violations[0].startswith('p99 latency'))
+    self.assertEqual(1, len(log.FindSloViolations(
+        summary, max_latency_ms=10, latency_percentile=50)))
+
+  def testFindSloViolationsWithoutData(self):
+    """Tests that objectives with nothing to measure are violated."""
+    summary = {
+        'requests_sent': 3,
+        'latency_ms': None,
+        'error_rate': 1.0,
+        'deadline_miss_rate': 0.0,
+    }
+    self.assertEqual([], log.FindSloViolations(summary))
+    self.assertEqual(['p99 latency unknown: no request has a latency'],
+                     log.FindSloViolations(summary, max_latency_ms=50))
+    logger = log.Logger()
+    logger.Done()
+    summarizer = log.LogSummarizer(logger)
+    summarizer.Summarize()
+    summary = summarizer.GetSummary()
+    self.assertEqual([], log.FindSloViolations(summary))
+    self.assertEqual(['no requests were sent'], log.FindSloViolations(
+        summary, max_latency_ms=50, max_error_rate=0.01))
+    self.assertEqual(['no requests were sent'], log.FindSloViolations(
+        summary, max_deadline_miss_rate=0.01))
+
+  def testRecordLogRoundTrip(self):
+    """Tests writing and reading a binary record log."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id111'
+    records = [log.Record(bid_request, 200, 'payload', 1000.5, 0.125,
+                          'mobile', 'http://b/'),
+               log.Record(bid_request, 500, '', None, None),
+               log.Record(bid_request, 200, '', None, None, 'other',
+                          'http://c/')]
+    log_file = StringIO.StringIO()
+    self.assertEqual(3, log.WriteRecordLog(records, log_file, ['mobile'],
+                                           ['http://a/', 'http://b/']))
+    log_file.seek(0)
+    self.assertTrue(log.IsRecordLog(log_file))
+    self.assertEqual((['mobile'], ['http://a/', 'http://b/']),
+                     log.ReadRecordLogNames(log_file))
+    self.assertEqual(0, log_file.tell())
+    read_records = list(log.ReadRecordLog(log_file))
+    self.assertEqual(3, len(read_records))
+    for record, read_record in zip(records, read_records):
+      self.assertEqual(record.bid_request, read_record.bid_request)
+      self.assertEqual(record.status, read_record.status)
+      self.assertEqual(record.payload, read_record.payload)
+      self.assertEqual(record.start_time, read_record.start_time)
+      self.assertEqual(record.latency, read_record.latency)
+    self.assertEqual(['mobile', None, None],
+                     [record.request_class for record in read_records])
+    self.assertEqual(['http://b/', None, None],
+                     [record.endpoint for record in read_records])
+
+  def testReadRecordLogVersion1(self):
+    """Tests reading a record log without classes and endpoints."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id111'
+    serialized = bid_request.SerializeToString()
+    log_file = StringIO.StringIO(
+        log.RECORD_LOG_MAGIC_V1 +
+        log.RECORD_LOG_HEADER_V1.pack(200, 1000.5, 0.125, len(serialized), 2) +
+        serialized + 'ok')
+    self.assertTrue(log.IsRecordLog(log_file))
+    self.assertEqual(([], []), log.ReadRecordLogNames(log_file))
+    records = list(log.ReadRecordLog(log_file))
+    self.assertEqual(1, len(records))
+    self.assertEqual(bid_request, records[0].bid_request)
+    self.assertEqual((200, 'ok', 1000.5, 0.125, None, None),
+                     (records[0].status, records[0].payload,
+                      records[0].start_time, records[0].latency,
+                      records[0].request_class, records[0].endpoint))
+
+  def testReadInvalidRecordLog(self):
+    """Tests that reading a corrupt record log raises an exception."""
+    log_file = StringIO.StringIO('{"requests_sent": 1}')
+    self.assertFalse(log.IsRecordLog(log_file))
+    self.assertRaises(log.RecordLogException, list, log.ReadRecordLog(log_file))
+
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = 'id111'
+    log_file = StringIO.StringIO()
+    log.WriteRecordLog([log.Record(bid_request, 200, 'payload')], log_file)
+    log_file = StringIO.StringIO(log_file.getvalue()[:-1])
+    self.assertRaises(log.RecordLogException, list, log.ReadRecordLog(log_file))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Generates requests in worker processes, ahead of the threads sending them.
+
+Generating and serializing requests on the sender threads takes interpreter
+time away from sending them. A GenerationPool instead runs the generators of
+the sender threads in a few worker processes, which write the serialized
+requests into one bounded ring buffer in shared memory per thread. Each
+sender thread reads its requests from its ring buffer through a
+PipelinedGenerator, which has the interface of the generator it replaces.
+Workers keep the ring buffers full and wait whenever all of theirs are, so
+at most the capacity of the ring buffers is generated ahead.
+"""
+
+import collections
+import ctypes
+import mmap
+import multiprocessing
+import struct
+
+# Bytes of the ring buffer of each generator.
+DEFAULT_RING_SIZE = 1 << 20
+# Requests generated for a generator at a time, before writing them.
+DEFAULT_CHUNK_SIZE = 100
+
+# Requests are written to ring buffers as a _RECORD_HEADER (length of the
+# serialized request, length of the traffic class name, at most
+# generator.MAX_CLASS_NAME_LENGTH), the traffic class name and the serialized
+# request.
+_RECORD_HEADER = struct.Struct('<IB')
+
+
+class RingBuffer(object):
+  """A bounded stream of bytes from one process to another.
+
+  The bytes are held in an anonymous shared memory map, and the positions of
+  the writer and the reader in shared counters, so a RingBuffer created
+  before forking a process can be written by one process and read by the
+  other. Writes never block, and reads block until bytes are available.
+  """
+
+  def __init__(self, size=DEFAULT_RING_SIZE, condition=None):
+    """Creates an empty ring buffer.
+
+    Args:
+      size: The capacity of the ring buffer in bytes.
+      condition: The multiprocessing.Condition guarding the ring buffer and
+          notified when bytes are written or read, which may be shared by
+          several ring buffers, or None for a new one.
+    """
+    self._size = size
+    self._data = mmap.mmap(-1, size)
+    self._condition = condition or multiprocessing.Condition()
+    # Total numbers of bytes written and read.
+    self._written = multiprocessing.RawValue(ctypes.c_uint64, 0)
+    self._read = multiprocessing.RawValue(ctypes.c_uint64, 0)
+    self._closed = multiprocessing.RawValue(ctypes.c_bool, False)
+
+  def GetCondition(self):
+    """Returns the multiprocessing.Condition guarding the ring buffer."""
+    return self._condition
+
+  def HasFreeBytes(self):
+    """Returns True if bytes can be written, see Write.
+
+    The caller must hold the condition of the ring buffer.
+    """
+    return self._FreeBytes() > 0
+
+  def _FreeBytes(self):
+    return self._size - (self._written.value - self._read.value)
+
+  def Write(self, data):
+    """Writes as many bytes of data as there is room for, without waiting.
+
+    Args:
+      data: A string.
+
+    Returns:
+      The number of bytes of data written, 0 if the ring buffer is full or
+      closed.
+    """
+    with self._condition:
+      if self._closed.value:
+        return 0
+      count = min(len(data), self._FreeBytes())
+      if not count:
+        return 0
+      start = self._written.value % self._size
+      first = min(count, self._size - start)
+      self._data[start:start + first] = data[:first]
+      self._data[:count - first] = data[first:count]
+      self._written.value += count
+      self._condition.notify_all()
+      return count
+
+  def Read(self):
+    """Reads all the bytes written so far, waiting until there are some.
+
+    Returns:
+      A non-empty string, or '' if the ring buffer was closed and all its
+      bytes were read.
+    """
+    with self._condition:
+      while (self._written.value == self._read.value and
+             not self._closed.value):
+        self._condition.wait()
+      count = self._written.value - self._read.value
+      start = self._read.value % self._size
+      first = min(count, self._size - start)
+      data = self._data[start:start + first] + self._data[:count - first]
+      self._read.value += count
+      self._condition.notify_all()
+      return data
+
+  def Close(self):
+    """Stops further writes; reads return the remaining bytes, then ''."""
+    with self._condition:
+      self._closed.value = True
+      self._condition.notify_all()
+
+  def IsClosed(self):
+    """Returns True if the ring buffer was closed."""
+    return self._closed.value
+
+
+def EncodeRequest(request_class, payload):
+  """Returns the record of a serialized request in a ring buffer.
+
+  Args:
+    request_class: The name of the traffic class of the request, or None.
+    payload: The serialized request.
+
+  Returns:
+    A string, see DecodeRequests.
+  """
+  request_class = request_class or ''
+  return _RECORD_HEADER.pack(len(payload), len(request_class)) + (
+      request_class + payload)
+
+
+def DecodeRequests(data):
+  """Splits the records of requests read from a ring buffer.
+
+  Args:
+    data: A string of consecutive records, see EncodeRequest, the last one
+        possibly incomplete.
+
+  Returns:
+    A list of (request class, serialized request) pairs, with None for
+    requests without a class, and the bytes of the incomplete record.
+  """
+  requests = []
+  position = 0
+  end = len(data)
+  while end - position >= _RECORD_HEADER.size:
+    length, name_length = _RECORD_HEADER.unpack_from(data, position)
+    start = position + _RECORD_HEADER.size + name_length
+    if start + length > end:
+      break
+    request_class = data[position + _RECORD_HEADER.size:start] or None
+    requests.append((request_class, data[start:start + length]))
+    position = start + length
+  return requests, data[position:]
+
+
+def _GenerateRequests(generators, rings, chunk_size):
+  """Keeps the ring buffers of a worker process full until they are closed.
+
+  Args:
+    generators: The generators of the worker, see GenerationPool.Add.
+    rings: The RingBuffer of each generator, sharing a condition.
+    chunk_size: The number of requests to generate at a time per generator.
+  """
+  condition = rings[0].GetCondition()
+  pending = [''] * len(rings)
+  try:
+    while True:
+      progressed = False
+      for i, ring in enumerate(rings):
+        if ring.IsClosed():
+          continue
+        if not pending[i]:
+          pending[i] = ''.join(_GenerateChunk(generators[i], chunk_size))
+        written = ring.Write(pending[i])
+        if written:
+          pending[i] = pending[i][written:]
+          progressed = True
+      if all(ring.IsClosed() for ring in rings):
+        return
+      if not progressed:
+        with condition:
+          while not any(ring.IsClosed() or ring.HasFreeBytes()
+                        for ring in rings):
+            condition.wait()
+  finally:
+    # Lets the readers of the ring buffers notice if generation failed.
+    for ring in rings:
+      ring.Close()
+
+
+def _GenerateChunk(generator_obj, chunk_size):
+  """Yields the records of the next chunk_size requests of a generator."""
+  for _ in xrange(chunk_size):
+    bid_request = generator_obj.GenerateBidRequest()
+    if not isinstance(bid_request, str):
+      bid_request = bid_request.SerializeToString()
+    yield EncodeRequest(generator_obj.GetRequestClass(), bid_request)
+
+
+class GenerationPool(object):
+  """Worker processes generating the requests of several generators.
+
+  Generators are added before the pool is started, and each is assigned to
+  one of the workers, which generates its requests in the same order as it
+  would in the calling process. The pool must be started before any other
+  thread, as the workers are forked.
+  """
+
+  def __init__(self, processes, ring_size=DEFAULT_RING_SIZE,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    """Creates a pool without generators.
+
+    Args:
+      processes: The number of worker processes, at least 1.
+      ring_size: The capacity in bytes of the ring buffer of each generator.
+      chunk_size: The number of requests a worker generates at a time for a
+          generator.
+    """
+    self._conditions = [multiprocessing.Condition()
+                        for _ in xrange(max(1, processes))]
+    self._ring_size = ring_size
+    self._chunk_size = chunk_size
+    self._generators = []
+    self._rings = []
+    self._workers = []
+
+  def Add(self, generator_obj):
+    """Adds a generator, to be run by a worker once the pool is started.
+
+    Args:
+      generator_obj: A generator.RandomBidGeneratorWrapper, or another object
+          with GenerateBidRequest, GeneratePingRequest and GetRequestClass
+          methods.
+
+    Returns:
+      A PipelinedGenerator returning the requests of generator_obj.
+    """
+    condition = self._conditions[
+        len(self._generators) % len(self._conditions)]
+    ring = RingBuffer(self._ring_size, condition)
+    self._generators.append(generator_obj)
+    self._rings.append(ring)
+    return PipelinedGenerator(ring, generator_obj)
+
+  def Start(self):
+    """Starts the worker processes."""
+    for i, condition in enumerate(self._conditions):
+      assigned = range(i, len(self._generators), len(self._conditions))
+      if not assigned:
+        continue
+      worker = multiprocessing.Process(
+          target=_GenerateRequests,
+          args=([self._generators[j] for j in assigned],
+                [self._rings[j] for j in assigned], self._chunk_size))
+      worker.daemon = True
+      worker.start()
+      self._workers.append(worker)
+
+  def Stop(self):
+    """Closes the ring buffers and waits for the worker processes to exit."""
+    for ring in self._rings:
+      ring.Close()
+    for worker in self._workers:
+      worker.join()
+    self._workers = []
+
+
+class PipelinedGenerator(object):
+  """Returns the requests a GenerationPool worker generated for a generator.
+
+  Requests are returned serialized, like those of a generator that splices
+  requests. Pings are still generated by the original generator in the
+  calling process, as they are only a few.
+  """
+
+  def __init__(self, ring, generator_obj):
+    """Initializes a generator reading from a ring buffer.
+
+    Args:
+      ring: The RingBuffer the worker writes the requests to.
+      generator_obj: The original generator, see GenerationPool.Add.
+    """
+    self._ring = ring
+    self._generator = generator_obj
+    self._requests = collections.deque()
+    self._remainder = ''
+    self._request_class = None
+    # Class names are shared by all their requests rather than copied.
+    self._class_names = {}
+
+  def GenerateBidRequest(self):
+    """Returns the next serialized request of the generator.
+
+    Raises:
+      RuntimeError: If the worker process stopped generating requests.
+    """
+    while not self._requests:
+      data = self._ring.Read()
+      if not data:
+        raise RuntimeError('The request generation process stopped.')
+      requests, self._remainder = DecodeRequests(self._remainder + data)
+      self._requests.extend(requests)
+    request_class, payload = self._requests.popleft()
+    self._request_class = self._class_names.setdefault(request_class,
+                                                       request_class)
+    return payload
+
+  def GeneratePingRequest(self):
+    """Generates a ping request with the original generator."""
+    ping_request = self._generator.GeneratePingRequest()
+    self._request_class = self._generator.GetRequestClass()
+    return ping_request
+
+  def GetRequestClass(self):
+    """Returns the traffic class name of the last request returned."""
+    return self._request_class
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for pipeline.py."""
+
+import unittest
+
+import generator
+import pipeline
+
+
+class FailingGenerator(object):
+  """A generator that can not generate requests."""
+
+  def GenerateBidRequest(self):
+    raise ValueError('No requests.')
+
+
+class RingBufferTest(unittest.TestCase):
+  """Tests the RingBuffer class."""
+
+  def testWriteAndRead(self):
+    """Tests that writes stop when full and reads wrap around."""
+    ring = pipeline.RingBuffer(8)
+    self.assertEqual(5, ring.Write('abcde'))
+    self.assertEqual('abcde', ring.Read())
+    self.assertEqual(8, ring.Write('fghijklmnop'))
+    self.assertEqual(0, ring.Write('q'))
+    self.assertEqual('fghijklm', ring.Read())
+    self.assertEqual(3, ring.Write('nop'))
+    self.assertEqual('nop', ring.Read())
+
+  def testClose(self):
+    """Tests that a closed ring buffer returns its remaining bytes."""
+    ring = pipeline.RingBuffer(8)
+    ring.Write('abc')
+    ring.Close()
+    self.assertTrue(ring.IsClosed())
+    self.assertEqual(0, ring.Write('d'))
+    self.assertEqual('abc', ring.Read())
+    self.assertEqual('', ring.Read())
+
+
+class PipelineTest(unittest.TestCase):
+  """Tests generating requests in a GenerationPool."""
+
+  def testDecodeRequests(self):
+    """Tests that records split at any byte are decoded once complete."""
+    data = (pipeline.EncodeRequest('video', 'payload') +
+            pipeline.EncodeRequest(None, ''))
+    for split in xrange(len(data) + 1):
+      first, remainder = pipeline.DecodeRequests(data[:split])
+      second, remainder = pipeline.DecodeRequests(remainder + data[split:])
+      self.assertEqual([('video', 'payload'), (None, '')], first + second)
+      self.assertEqual('', remainder)
+    name = 'v' * generator.MAX_CLASS_NAME_LENGTH
+    self.assertEqual(([(name, 'payload')], ''), pipeline.DecodeRequests(
+        pipeline.EncodeRequest(name, 'payload')))
+
+  def testGenerationPool(self):
+    """Tests that pipelined requests are those of the original generators."""
+    pool = pipeline.GenerationPool(2, ring_size=4096, chunk_size=7)
+    generators = [pool.Add(generator.RandomBidGeneratorWrapper(
+        seed=1234, stream=stream)) for stream in xrange(3)]
+    pool.Start()
+    try:
+      for stream, generator_obj in enumerate(generators):
+        expected = generator.RandomBidGeneratorWrapper(seed=1234,
+                                                       stream=stream)
+        for _ in xrange(50):
+          self.assertEqual(expected.GenerateBidRequest().SerializeToString(),
+                           generator_obj.GenerateBidRequest())
+          self.assertEqual(expected.GetRequestClass(),
+                           generator_obj.GetRequestClass())
+        self.assertEqual(expected.GeneratePingRequest(),
+                         generator_obj.GeneratePingRequest())
+        self.assertEqual(generator.PING_CLASS,
+                         generator_obj.GetRequestClass())
+    finally:
+      pool.Stop()
+
+  def testFailedGeneration(self):
+    """Tests that readers notice when a worker stops generating requests."""
+    pool = pipeline.GenerationPool(1)
+    generator_obj = pool.Add(FailingGenerator())
+    pool.Start()
+    try:
+      self.assertRaises(RuntimeError, generator_obj.GenerateBidRequest)
+    finally:
+      pool.Stop()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Adapts the request rate to what the bidder sustains.
+
+An AdaptiveRateController raises the rate of all requesters additively while
+the bidder keeps up, and cuts it multiplicatively (AIMD) as soon as the
+error rate or a latency percentile of the responses of an interval exceeds
+its limit. The rate then oscillates just below the highest rate the bidder
+sustains, which is reported as the rate it converged to: a measure of how
+much load the bidder degrades gracefully under, rather than the collapse a
+fixed rate above it would cause.
+"""
+
+import collections
+import threading
+
+import results
+
+DEFAULT_INCREASE_QPS = 10.0
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_MAX_ERROR_RATE = 0.01
+DEFAULT_LATENCY_PERCENTILE = 99
+DEFAULT_INTERVAL = 1.0
+# The number of latest backoffs whose rates are averaged into the converged
+# rate, see AdaptiveRateController.GetConvergedQps.
+CONVERGED_BACKOFFS = 5
+
+# The rate of an interval of an AdaptiveRateController and what was decided
+# from its responses. error_rate is the fraction of non-200 responses, and
+# latency the configured percentile of their round trip times in seconds.
+Adjustment = collections.namedtuple(
+    'Adjustment', ['time', 'qps', 'responses', 'error_rate', 'latency',
+                   'backoff', 'new_qps'])
+
+
+class AdaptiveRateController(object):
+  """Sets the rate of all requesters from the responses they receive.
+
+  Requesters report each response with Record, and space their requests by
+  GetTimeBetweenRequests. The rate is adjusted at the end of each interval,
+  measured on the response times so that no extra thread is needed. Only
+  the responses to requests sent after the previous adjustment count, as
+  earlier ones reflect the previous rate.
+  """
+
+  def __init__(self, max_qps, initial_qps=None, min_qps=1.0,
+               increase_qps=DEFAULT_INCREASE_QPS,
+               decrease_factor=DEFAULT_DECREASE_FACTOR,
+               max_error_rate=DEFAULT_MAX_ERROR_RATE, max_latency=None,
+               latency_percentile=DEFAULT_LATENCY_PERCENTILE,
+               interval=DEFAULT_INTERVAL):
+    """Initializes a controller.
+
+    Args:
+      max_qps: The rate the controller never exceeds.
+      initial_qps: The rate to start at, or None for a tenth of max_qps.
+      min_qps: The rate the controller never goes below.
+      increase_qps: The rate added after an interval the bidder kept up.
+      decrease_factor: The factor the rate is multiplied by after an
+          interval the bidder did not keep up, in (0, 1).
+      max_error_rate: The highest fraction of non-200 responses of an
+          interval the bidder keeps up with.
+      max_latency: The highest latency_percentile of the round trip times of
+          an interval, in seconds, the bidder keeps up with, or None to only
+          check errors.
+      latency_percentile: The percentile of the round trip times checked,
+          see results.Percentiles.
+      interval: The number of seconds between adjustments.
+
+    Raises:
+      ValueError: If a parameter is out of range.
+    """
+    if initial_qps is None:
+      initial_qps = max_qps / 10.0
+    if not 0 < min_qps <= max_qps:
+      raise ValueError('The minimum rate must be positive and at most the '
+                       'maximum rate.')
+    if not 0 < decrease_factor < 1:
+      raise ValueError('The decrease factor must be in (0, 1).')
+    if increase_qps <= 0 or interval <= 0:
+      raise ValueError('The increase and interval must be positive.')
+    self._max_qps = float(max_qps)
+    self._min_qps = float(min_qps)
+    self._initial_qps = min(max(float(initial_qps), self._min_qps),
+                            self._max_qps)
+    self._increase_qps = float(increase_qps)
+    self._decrease_factor = float(decrease_factor)
+    self._max_error_rate = max_error_rate
+    self._max_latency = max_latency
+    self._latency_percentile = latency_percentile
+    self._interval = float(interval)
+    self._senders = 1
+    self._lock = threading.Lock()
+    self._qps = self._initial_qps
+    # The time of the last adjustment, None before the first response, and
+    # the latencies and number of errors of the responses since.
+    self._adjusted_time = None
+    self._latencies = []
+    self._errors = 0
+    self._adjustments = []
+
+  def SetSenders(self, senders):
+    """Sets the number of requesters the rate is shared by."""
+    self._senders = max(1, senders)
+
+  def GetQps(self):
+    """Returns the current rate of all requesters together."""
+    return self._qps
+
+  def GetTimeBetweenRequests(self):
+    """Returns the seconds each requester waits between requests."""
+    return self._senders / self._qps
+
+  def Record(self, status, start_time, latency):
+    """Adds a response, adjusting the rate if an interval ended.
+
+    Args:
+      status: The HTTP status code.
+      start_time: The POSIX timestamp at which the request was sent.
+      latency: The round trip time of the request in seconds.
+    """
+    if start_time is None or latency is None:
+      return
+    end_time = start_time + latency
+    with self._lock:
+      if self._adjusted_time is None:
+        self._adjusted_time = start_time
+      elif start_time < self._adjusted_time:
+        return
+      self._latencies.append(latency)
+      if status != 200:
+        self._errors += 1
+      if end_time - self._adjusted_time >= self._interval:
+        self._Adjust(end_time)
+
+  def _Adjust(self, now):
+    """Sets the rate of the next interval from the responses of this one."""
+    self._latencies.sort()
+    error_rate = float(self._errors) / len(self._latencies)
+    latency = results.Percentiles(self._latencies,
+                                  [self._latency_percentile])[0]
+    backoff = (error_rate > self._max_error_rate or
+               (self._max_latency is not None and
+                latency > self._max_latency))
+    if backoff:
+      new_qps = max(self._min_qps, self._qps * self._decrease_factor)
+    else:
+      new_qps = min(self._max_qps, self._qps + self._increase_qps)
+    self._adjustments.append(Adjustment(
+        now, self._qps, len(self._latencies), error_rate, latency, backoff,
+        new_qps))
+    self._qps = new_qps
+    self._adjusted_time = now
+    self._latencies = []
+    self._errors = 0
+
+  def GetAdjustments(self):
+    """Returns the list of Adjustment tuples, oldest first."""
+    with self._lock:
+      return list(self._adjustments)
+
+  def GetConvergedQps(self):
+    """Returns the rate the controller converged to.
+
+    This is the mean rate of the last CONVERGED_BACKOFFS intervals the
+    bidder did not keep up with, the peaks the rate oscillates below.
+
+    Returns:
+      A number of queries per second, or None if the bidder always kept up.
+    """
+    backoff_rates = [adjustment.qps for adjustment in self.GetAdjustments()
+                     if adjustment.backoff][-CONVERGED_BACKOFFS:]
+    if not backoff_rates:
+      return None
+    return sum(backoff_rates) / len(backoff_rates)
+
+  def GetSummary(self):
+    """Returns a dictionary describing the adaptation, for the summary."""
+    adjustments = self.GetAdjustments()
+    return {
+        'initial_qps': self._initial_qps,
+        'max_qps': self._max_qps,
+        'final_qps': self._qps,
+        'converged_qps': self.GetConvergedQps(),
+        'adjustments': len(adjustments),
+        'backoffs': sum(1 for adjustment in adjustments
+                        if adjustment.backoff),
+    }
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for ratecontrol.py."""
+
+import unittest
+
+import ratecontrol
+
+
+class AdaptiveRateControllerTest(unittest.TestCase):
+  """Tests the AdaptiveRateController class."""
+
+  def setUp(self):
+    self.controller = ratecontrol.AdaptiveRateController(
+        100, 20, increase_qps=10, decrease_factor=0.5, max_error_rate=0.1,
+        max_latency=0.1, latency_percentile=90, interval=1.0)
+    self.time = 1000.0
+
+  def RecordInterval(self, statuses, latency=0.0625):
+    """Records responses to requests sent over the next second.
+
+    The last response arrives at the end of the second, ending the interval.
+    """
+    for i, status in enumerate(statuses):
+      start_time = self.time + float(i) / len(statuses)
+      if i == len(statuses) - 1:
+        start_time = self.time + 1 - latency
+      self.controller.Record(status, start_time, latency)
+    self.time += 1
+
+  def testIncrease(self):
+    """Tests that the rate grows additively up to the maximum."""
+    self.controller.SetSenders(4)
+    self.assertEqual(20, self.controller.GetQps())
+    self.assertAlmostEqual(0.2, self.controller.GetTimeBetweenRequests())
+    for _ in xrange(3):
+      self.RecordInterval([200] * 10)
+    self.assertEqual(50, self.controller.GetQps())
+    for _ in xrange(10):
+      self.RecordInterval([200] * 10)
+    self.assertEqual(100, self.controller.GetQps())
+    self.assertEqual(None, self.controller.GetConvergedQps())
+
+  def testBackoffOnErrors(self):
+    """Tests that the rate is halved when too many responses fail."""
+    self.RecordInterval([200] * 10)
+    self.RecordInterval([503] * 2 + [200] * 8)
+    self.assertEqual(15, self.controller.GetQps())
+    adjustment = self.controller.GetAdjustments()[-1]
+    self.assertTrue(adjustment.backoff)
+    self.assertAlmostEqual(0.2, adjustment.error_rate)
+    self.assertEqual(30, adjustment.qps)
+
+  def testBackoffOnLatency(self):
+    """Tests that the rate is halved when the latency percentile is high."""
+    self.RecordInterval([200] * 10, latency=0.125)
+    self.assertEqual(10, self.controller.GetQps())
+    self.assertEqual(0.125, self.controller.GetAdjustments()[0].latency)
+
+  def testMinimum(self):
+    """Tests that the rate never goes below the minimum."""
+    for _ in xrange(10):
+      self.RecordInterval([500] * 10)
+    self.assertEqual(1, self.controller.GetQps())
+
+  def testIgnoresEarlierRequests(self):
+    """Tests that requests sent before an adjustment are not counted."""
+    self.RecordInterval([200] * 10)
+    self.controller.Record(500, self.time - 0.5, 1.0)
+    self.RecordInterval([200] * 10)
+    self.assertEqual([30, 40], [adjustment.new_qps for adjustment in
+                                self.controller.GetAdjustments()])
+
+  def testConverged(self):
+    """Tests that the converged rate averages the rates that backed off."""
+    # A bidder that fails above 45 QPS.
+    for _ in xrange(30):
+      qps = self.controller.GetQps()
+      self.RecordInterval([200 if qps <= 45 else 503] * 10)
+    converged = self.controller.GetConvergedQps()
+    self.assertTrue(45 < converged <= 55)
+    summary = self.controller.GetSummary()
+    self.assertEqual(converged, summary['converged_qps'])
+    self.assertEqual(20, summary['initial_qps'])
+    self.assertEqual(30, summary['adjustments'])
+    self.assertTrue(summary['backoffs'] > 0)
+
+  def testInvalid(self):
+    """Tests that invalid parameters are rejected."""
+    self.assertRaises(ValueError, ratecontrol.AdaptiveRateController, 100,
+                      decrease_factor=1)
+    self.assertRaises(ValueError, ratecontrol.AdaptiveRateController, 100,
+                      min_qps=200)
+    self.assertRaises(ValueError, ratecontrol.AdaptiveRateController, 100,
+                      interval=0)
+
+
+if __name__ == '__main__':
+  unittest.main()
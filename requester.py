@@ -2,14 +2,20 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """A class that drives a request sender."""
 import datetime
+import gc
 import optparse
 import os
 import random
+import sys
 import threading
 import time
 
 import generator
+import idfile
 import log
+import pipeline
+import ratecontrol
+import sampling
 import sender
 
 
@@ -19,11 +25,28 @@ INVALID_LOG_TEMPLATE = 'invalid-%s.log'
 ERROR_LOG_TEMPLATE = 'error-%s.log'
 SNIPPET_LOG_TEMPLATE = 'snippets-%s.html'
 
+# Exit status when a service level objective was violated.
+SLO_VIOLATION_EXIT_STATUS = 3
+
+# Salt of the random sequence that decides which requests are pings, see
+# generator.DeriveSeed.
+PING_DECISION_SALT = 'ping-decision'
+
+# Collection threshold of the oldest generation of the garbage collector
+# with --defer_full_collections, so high that it is never reached.
+DEFERRED_COLLECTION_THRESHOLD = (1 << 31) - 1
+
 
 def CreateRequesters(num_senders, max_qps, url, logger_obj, google_ids=None,
                      seconds=0, requests=0, interval=0,
                      instream_video_proportion=0.0, mobile_proportion=0.0,
-                     adgroup_ids=None):
+                     adgroup_ids=None, seed=None, batch_size=0,
+                     splice=False, distributions=None, session_users=0,
+                     session_length=generator.DEFAULT_SESSION_LENGTH,
+                     think_time=generator.DEFAULT_THINK_TIME,
+                     traffic_mix=None, generation_pool=None,
+                     pipeline_depth=1, http2=False, balancer=None,
+                     rate_controller=None):
   """Creates num_senders threads, and a sender.HTTPSender object for each.
 
   Args:
@@ -31,19 +54,54 @@ def CreateRequesters(num_senders, max_qps, url, logger_obj, google_ids=None,
     max_qps: Max overall qps.
     url: The URL to which senders will send requests.
     logger_obj: A log.Logger object.
-    google_ids: A list of Google user IDs or None to randomly generate user ids.
+    google_ids: A sequence of Google user IDs, e.g. an idfile.IdFile, or None
+        to randomly generate user ids.
     seconds: The number of seconds to continue sending requests.
     requests: The number of requests to send.
     interval: The number of seconds to wait between thread creation.
     instream_video_proportion: Proportion of requests to genereate that are for
-        instream video slots.
-    mobile_proportion: Proportion of mobile requests to be generated.
-    adgroup_ids: A list of AdGroup IDs or None to randomly generate
-        pretargeted AdGroup IDs.
+        instream video slots, unless there is a traffic_mix.
+    mobile_proportion: Proportion of mobile requests to be generated, unless
+        there is a traffic_mix.
+    adgroup_ids: A list or generator.AdGroupIdPool of AdGroup IDs, or None
+        to randomly generate pretargeted AdGroup IDs.
+    seed: The run seed, or None for a new random seed. Each requester
+        generates its own stream of requests from it, see
+        generator.DeriveSeed.
+    batch_size: If positive, requests are generated this many at a time, see
+        generator.RandomBidGeneratorWrapper.
+    splice: Whether batches of requests are spliced together already
+        serialized, see generator.RandomBidGeneratorWrapper.
+    distributions: Sampling weights of the generator's tables, see
+        generator.LoadDistributions, or None to sample them uniformly.
+    session_users: If positive, each requester sends the requests of this
+        many users browsing in sessions, see generator.SessionSimulator.
+    session_length: The distribution of the number of requests of a
+        session, see generator.SessionSimulator.
+    think_time: The distribution of the seconds between the requests of a
+        session.
+    traffic_mix: A generator.TrafficMix of the classes of requests to send,
+        see generator.LoadTrafficMix, or None for generator.DefaultTrafficMix.
+    generation_pool: A pipeline.GenerationPool to generate the requests of
+        each requester in, to be started before the requesters, or None to
+        generate them in the requester threads.
+    pipeline_depth: The number of requests each requester may send on its
+        connection before reading their responses, see
+        sender.HTTPSender.StartRequest, or of concurrent streams with http2.
+    http2: Whether to send requests with HTTP/2, see sender.HTTP2Sender.
+    balancer: A sender.LoadBalancer spreading the requests over several URLs
+        instead of url, or None.
+    rate_controller: A ratecontrol.AdaptiveRateController setting the rate
+        of the requesters, at most max_qps, or None to send at max_qps.
 
   Returns:
     A list of Requester objects.
   """
+  if seed is None:
+    seed = generator.NewSeed()
+  if traffic_mix is None:
+    traffic_mix = generator.DefaultTrafficMix(instream_video_proportion,
+                                              mobile_proportion)
   seconds = seconds or 0
   requests = requests or 0
   # Create at most max_qps/10 threads, giving each thread at least 10 QPS.
@@ -51,13 +109,32 @@ def CreateRequesters(num_senders, max_qps, url, logger_obj, google_ids=None,
   num_senders = max(num_senders, 1)  # Avoid setting num_senders to 0.
   send_rate_per_sender = num_senders / float(max_qps)
   requests_per_sender = requests / num_senders
+  if adgroup_ids is not None:
+    adgroup_ids = generator.AdGroupIdPool(adgroup_ids)
+  if rate_controller is not None:
+    rate_controller.SetSenders(num_senders)
   requesters = []
   for i in xrange(num_senders):
     generator_obj = generator.RandomBidGeneratorWrapper(
-        google_ids, instream_video_proportion, mobile_proportion, adgroup_ids)
-    sender_obj = sender.HTTPSender(url)
+        google_ids, instream_video_proportion, mobile_proportion, adgroup_ids,
+        seed, i, batch_size, splice, distributions, session_users,
+        session_length, think_time, traffic_mix.classes)
+    if generation_pool is not None:
+      generator_obj = generation_pool.Add(generator_obj)
+    sender_class = sender.HTTPSender
+    if http2:
+      sender_class = sender.HTTP2Sender
+    if balancer is not None:
+      sender_obj = sender.BalancingSender(balancer, pipeline_depth,
+                                          sender_class)
+    else:
+      sender_obj = sender_class(url, pipeline_depth)
+    ping_random = random.Random(
+        generator.DeriveSeed(seed, i, 0, PING_DECISION_SALT))
     requester = Requester(generator_obj, logger_obj, sender_obj,
-                          send_rate_per_sender, seconds, requests_per_sender)
+                          send_rate_per_sender, seconds, requests_per_sender,
+                          ping_random, traffic_mix.ping_proportion,
+                          pipeline_depth, rate_controller)
     requester.name = 'requester-thread-%d' % i
     requesters.append(requester)
     if interval:
@@ -75,19 +152,32 @@ class Requester(threading.Thread):
   """
 
   def __init__(self, generator_obj, logger_obj, sender_obj,
-               time_between_requests, seconds=None, requests=None):
+               time_between_requests, seconds=None, requests=None,
+               random_obj=None,
+               ping_proportion=generator.DEFAULT_PING_PROPORTION,
+               pipeline_depth=1, rate_controller=None):
     """Initializes a Requester object.
 
     Args:
       generator_obj: An RandomBidGenerator object.
       logger_obj: A logging.Logger object.
-      sender_obj: A sender.HTTPSender object.
+      sender_obj: A sender.HTTPSender object. The URL each request was sent
+          to is logged if the sender has a GetEndpoint method.
       time_between_requests: The time in (fractional) seconds to wait between
           requests.
       seconds: Number of seconds to run test. Specify only one of seconds or
           requests.
       requests: Number of requests to generate. Specify only one of seconds or
           requests.
+      random_obj: A random.Random deciding which requests are pings, or None
+          to use a new one.
+      ping_proportion: The fraction of the requests that are pings.
+      pipeline_depth: If greater than 1, requests are pipelined, with up to
+          this many requests sent before reading their responses, see
+          _StartPipelined.
+      rate_controller: A ratecontrol.AdaptiveRateController the responses
+          are reported to, setting the time between requests instead of
+          time_between_requests, or None.
 
     Raises:
       ValueError: If none or both of seconds and requests are specified.
@@ -96,6 +186,10 @@ class Requester(threading.Thread):
     self._generator = generator_obj
     self._logger = logger_obj
     self._sender = sender_obj
+    self._random = random_obj or random.Random()
+    self._ping_proportion = ping_proportion
+    self._pipeline_depth = pipeline_depth
+    self._rate_controller = rate_controller
     self._time_between_requests = float(time_between_requests)
     self._generated_requests = 0
     self._last_request_start_time = 0.0
@@ -123,22 +217,99 @@ class Requester(threading.Thread):
     if not self._use_requests_as_stop_signal:
       self._start_time = self._GetCurrentTime()
       self._stop_time = self._start_time + self._timedelta
+    if self._pipeline_depth > 1:
+      self._StartPipelined()
+      return
 
     while self._ShouldSendMoreRequests():
-      request = self._GenerateRequest()
-      payload = request.SerializeToString()
+      payload = self._GeneratePayload()
       request_start_time = self._GetCurrentTime()
       status, data = self._sender(payload)
-      self._logger.LogSynchronousRequest(request, status, data)
+      latency = self._GetCurrentTime() - request_start_time
+      self._logger.LogSynchronousRequest(payload, status, data,
+                                         request_start_time, latency,
+                                         self._generator.GetRequestClass(),
+                                         self._GetEndpoint())
+      if self._rate_controller is not None:
+        self._rate_controller.Record(status, request_start_time, latency)
       self._Wait()
       self._last_request_start_time = request_start_time
 
+  def _StartPipelined(self):
+    """Sends requests without waiting for their responses, see Start.
+
+    Up to pipeline_depth requests are outstanding on the connection of the
+    sender. The latency of a request is the time from sending it to reading
+    its response. Responses are read as soon as they arrive, including while
+    waiting to send the next request, so that the wait is not counted.
+    """
+    pending = {}
+    while self._ShouldSendMoreRequests():
+      payload = self._GeneratePayload()
+      request_start_time = self._GetCurrentTime()
+      request_id = self._sender.StartRequest(payload)
+      pending[request_id] = (payload, request_start_time,
+                             self._generator.GetRequestClass(),
+                             self._GetEndpoint())
+      if len(pending) >= self._pipeline_depth:
+        self._FinishRequest(pending)
+      self._WaitPipelined(pending)
+      self._last_request_start_time = request_start_time
+    while pending:
+      self._FinishRequest(pending)
+
+  def _FinishRequest(self, pending):
+    """Reads the next response to a pipelined request and logs it.
+
+    Args:
+      pending: A dictionary of the (payload, start time, request class,
+          endpoint) of the requests sent whose responses were not read yet,
+          by request ID.
+    """
+    request_id, status, data = self._sender.FinishRequest()
+    payload, request_start_time, request_class, endpoint = pending.pop(
+        request_id)
+    latency = self._GetCurrentTime() - request_start_time
+    self._logger.LogSynchronousRequest(payload, status, data,
+                                       request_start_time, latency,
+                                       request_class, endpoint)
+    if self._rate_controller is not None:
+      self._rate_controller.Record(status, request_start_time, latency)
+
+  def _GetEndpoint(self):
+    """Returns the URL the last request was sent to, or None if unknown."""
+    get_endpoint = getattr(self._sender, 'GetEndpoint', None)
+    if get_endpoint is None:
+      return None
+    return get_endpoint()
+
+  def _WaitPipelined(self, pending):
+    """Waits like _Wait, reading the responses that arrive meanwhile.
+
+    Args:
+      pending: The requests whose responses were not read yet, see
+          _FinishRequest.
+    """
+    time_between_requests = self._GetTimeBetweenRequests()
+    if self._last_request_start_time:
+      wake_time = self._last_request_start_time + time_between_requests
+    else:
+      wake_time = self._GetCurrentTime() + time_between_requests
+    time_to_wait = wake_time - self._GetCurrentTime()
+    while pending and time_to_wait > 0:
+      if not self._sender.ResponseReady(time_to_wait):
+        return
+      self._FinishRequest(pending)
+      time_to_wait = wake_time - self._GetCurrentTime()
+    if time_to_wait > 0:
+      time.sleep(time_to_wait)
+
   def _Wait(self):
     """Waits some time to throttle request rate.
 
     It's convenient to have this as a separate method for mocking.
     """
-    time_to_wait = self._time_between_requests
+    time_to_wait = self._GetTimeBetweenRequests()
 
     # Subtract time since the start of the last request.
     if self._last_request_start_time:
@@ -150,6 +321,12 @@ class Requester(threading.Thread):
     if time_to_wait:
       time.sleep(time_to_wait)
 
+  def _GetTimeBetweenRequests(self):
+    """Returns the seconds between the starts of consecutive requests."""
+    if self._rate_controller is not None:
+      return self._rate_controller.GetTimeBetweenRequests()
+    return self._time_between_requests
+
   def _ShouldSendMoreRequests(self):
     """Returns True if more requests should be sent.
 
@@ -165,16 +342,27 @@ class Requester(threading.Thread):
     """Generates and returns a request.
 
     Returns:
-      A randomly generated BidRequest.
+      A randomly generated BidRequest, or a serialized one if the generator
+      splices requests.
     """
-    # Generate ping requests 1% of the time.
-    if random.random() < 0.01:
+    if self._random.random() < self._ping_proportion:
       bid_request = self._generator.GeneratePingRequest()
     else:
       bid_request = self._generator.GenerateBidRequest()
     self._generated_requests += 1
     return bid_request
 
+  def _GeneratePayload(self):
+    """Generates a request and returns it serialized."""
+    request = self._GenerateRequest()
+    if isinstance(request, str):
+      return request  # Spliced requests are already serialized.
+    return request.SerializeToString()
+
+  def GetGeneratedRequests(self):
+    """Returns the number of requests generated so far."""
+    return self._generated_requests
+
   def _GetCurrentTime(self):
     """Returns the current time as a POSIX timestamp (seconds since epoch).
 
@@ -187,47 +375,109 @@ class Requester(threading.Thread):
     return time.time()
 
 
-def PrintSummary(logger, encrypted_price):
+def DeferFullCollections():
+  """Stops the garbage collector from collecting its oldest generation.
+
+  Every request and response of a run is kept until the summary, as
+  serialized strings in log.Record objects that can not be part of a
+  reference cycle. Each automatic collection of the oldest generation still
+  scans all of them while holding the interpreter lock, which stalls every
+  sender thread for up to a second in long runs. The younger generations,
+  where cyclic garbage of the generators and senders is found, are still
+  collected as usual.
+
+  Returns:
+    The previous thresholds, to restore with gc.set_threshold.
+  """
+  thresholds = gc.get_threshold()
+  gc.set_threshold(thresholds[0], thresholds[1],
+                   DEFERRED_COLLECTION_THRESHOLD)
+  return thresholds
+
+
+def PrintSummary(logger, encrypted_price, deadline_ms=log.DEFAULT_DEADLINE_MS,
+                 summary_filename=None, processes=1, repeat_rates=None,
+                 request_classes=(), endpoints=(), rate_control=None):
   """Prints a summary of results optionally substituting an encrypted price.
 
   Args:
     logger: A log.Logger object.
     encrypted_price: A string representing an encrypted price to substitue for
       the WINNING_PRICE macro, or None to substitute a non-encrypted number.
+    deadline_ms: Responses slower than this are counted as deadline misses.
+    summary_filename: Path of a file to write the JSON summary to, or None.
+    processes: The number of processes used to validate the responses.
+    repeat_rates: The implied repeat rates of the requests to report, see
+      generator.ImpliedRepeatRates, or None.
+    request_classes: The names of the traffic classes of the requests, see
+      log.LogSummarizer.SetRequestClasses.
+    endpoints: The URLs the requests were sent to, see
+      log.LogSummarizer.SetEndpoints.
+    rate_control: The summary of the ratecontrol.AdaptiveRateController of
+      the run to report, or None.
+
+  Returns:
+    The log.LogSummarizer holding the results.
   """
   logger.Done()
   summarizer = log.LogSummarizer(logger)
   if encrypted_price:
     summarizer.SetSampleEncryptedPrice(encrypted_price)
-  summarizer.Summarize()
+  summarizer.SetDeadline(deadline_ms)
+  if repeat_rates:
+    summarizer.SetRepeatRates(repeat_rates)
+  summarizer.SetRequestClasses(request_classes)
+  summarizer.SetEndpoints(endpoints)
+  if rate_control:
+    summarizer.SetRateControl(rate_control)
+  summarizer.Summarize(processes)
+  log_files = OpenLogFiles(GetLogTimestamp())
+  summarizer.WriteLogFiles(*[log_file for _, log_file in log_files])
+  CloseLogFiles(log_files)
+  summarizer.PrintReport()
+  if summary_filename:
+    with open(summary_filename, 'w') as summary_file:
+      summarizer.WriteJsonSummary(summary_file)
+  return summarizer
+
+
+def GetLogTimestamp():
+  """Returns the current time formatted for use in log file names."""
   timestamp = str(datetime.datetime.now())
   timestamp = timestamp.replace(' ', '-', timestamp.count(' '))
   timestamp = timestamp.replace(':', '', timestamp.count(':'))
-  good_log_filename = GOOD_LOG_TEMPLATE % timestamp
-  good_log = open(good_log_filename, 'w')
-  problematic_log_filename = PROBLEMATIC_LOG_TEMPLATE % timestamp
-  problematic_log = open(problematic_log_filename, 'w')
-  invalid_log_filename = INVALID_LOG_TEMPLATE % timestamp
-  invalid_log = open(invalid_log_filename, 'w')
-  error_log_filename = ERROR_LOG_TEMPLATE % (timestamp)
-  error_log = open(error_log_filename, 'w')
-  snippet_log_filename = SNIPPET_LOG_TEMPLATE % (timestamp)
-  snippet_log = open(snippet_log_filename, 'w')
-  summarizer.WriteLogFiles(good_log, problematic_log, invalid_log, error_log,
-                           snippet_log)
-  good_log.close()
-  problematic_log.close()
-  invalid_log.close()
-  error_log.close()
-  snippet_log.close()
-  summarizer.PrintReport()
+  return timestamp
 
-  # Cleanup by deleting empty files.
-  for file_name in [good_log_filename, problematic_log_filename,
-                    invalid_log_filename, error_log_filename,
-                    snippet_log_filename]:
-    if not os.path.getsize(file_name):
-      os.remove(file_name)
+
+def OpenLogFiles(timestamp):
+  """Opens the log files written by log.LogSummarizer.
+
+  Args:
+    timestamp: A string included in each file name, see GetLogTimestamp.
+
+  Returns:
+    A list of (filename, file) pairs in the order of the arguments of
+    log.LogSummarizer.WriteLogFiles.
+  """
+  log_files = []
+  for template in [GOOD_LOG_TEMPLATE, PROBLEMATIC_LOG_TEMPLATE,
+                   INVALID_LOG_TEMPLATE, ERROR_LOG_TEMPLATE,
+                   SNIPPET_LOG_TEMPLATE]:
+    filename = template % timestamp
+    log_files.append((filename, open(filename, 'w')))
+  return log_files
+
+
+def CloseLogFiles(log_files):
+  """Closes log files opened by OpenLogFiles, deleting empty ones.
+
+  Args:
+    log_files: A list of (filename, file) pairs returned by OpenLogFiles.
+  """
+  for filename, log_file in log_files:
+    log_file.close()
+    if not os.path.getsize(filename):
+      os.remove(filename)
 
 
 def SetupCommandLineOptions():
@@ -237,7 +487,19 @@ def SetupCommandLineOptions():
     An optparse.OptionParser object.
   """
   parser = optparse.OptionParser()
-  parser.add_option('--url', help='URL of the bidder.')
+  parser.add_option('--url', help='URL of the bidder, or comma-separated '
+                    'URLs of several bidders to spread the requests over, '
+                    'see --balancing.')
+  parser.add_option('--balancing', type='choice',
+                    choices=sender.BALANCING_STRATEGIES,
+                    default=sender.ROUND_ROBIN,
+                    help='How requests are spread over several --url: %s '
+                    '(%s by default).' % (
+                        ', '.join(sender.BALANCING_STRATEGIES),
+                        sender.ROUND_ROBIN))
+  parser.add_option('--url_weights', type='string',
+                    help='Comma-separated weights of the --url endpoints, '
+                    'for the weighted and least_outstanding --balancing.')
   parser.add_option('--max_qps', type='int',
                     help='Maximum queries per second to send to the bidder.')
   parser.add_option('--seconds', type='int',
@@ -259,7 +521,9 @@ def SetupCommandLineOptions():
   parser.add_option('--google_user_ids_file', type='string',
                     help='Path to a file containing a list of Google IDs one '
                     'per line. These will be used instead of randomly '
-                    ' generated ID if specified.')
+                    'generated ID if specified. The file is memory-mapped, '
+                    'with an index of its lines saved to the same path '
+                    'followed by %s.' % idfile.INDEX_SUFFIX)
   parser.add_option('--instream_video_proportion', type='float',
                     default=0.1,
                     help='Proportion of requests that are for in-stream video'
@@ -268,10 +532,163 @@ def SetupCommandLineOptions():
                     default=0.2,
                     help='Proportion of requests that are for mobile slots '
                     '(0.2 by default).')
+  parser.add_option('--traffic_mix_file', type='string',
+                    help='Path to a JSON file with the classes of requests '
+                    'to send, the weight, generator and parameters of each, '
+                    'and the proportion of pings, instead of '
+                    '--instream_video_proportion and --mobile_proportion. '
+                    'See generator.LoadTrafficMix.')
   parser.add_option('--adgroup_ids_file', type='string',
                     help='Path to a file containing a list of AdGroup IDs '
                     'one per line. These will be used in the matching ad data '
                     'instead of randomly generated IDs.')
+  parser.add_option('--distribution_file', type='string',
+                    help='Path to a JSON file with sampling weights for the '
+                    'publishers, geos, devices and other tables requests are '
+                    'generated from. See generator.LoadDistributions.')
+  parser.add_option('--user_popularity', type='string',
+                    help='Generate requests for a fixed population of users '
+                    'with the given popularity: zipf:<exponent> or '
+                    'hotset:<hot fraction>:<hot traffic>, e.g. zipf:1.1 or '
+                    'hotset:0.01:0.9. The IDs of --google_user_ids_file are '
+                    'the population if given, the first ones being the '
+                    'most popular. Random users never repeat by default.')
+  parser.add_option('--user_population', type='int',
+                    default=generator.DEFAULT_USER_POPULATION,
+                    help='Number of users with --user_popularity without '
+                    '--google_user_ids_file (%d by default).' %
+                    generator.DEFAULT_USER_POPULATION)
+  parser.add_option('--publisher_popularity', type='string',
+                    help='Popularity of publishers, see --user_popularity.')
+  parser.add_option('--adgroup_popularity', type='string',
+                    help='Generate requests matching a fixed population of '
+                    'adgroups with the given popularity, see '
+                    '--user_popularity. The IDs of --adgroup_ids_file are '
+                    'the population if given.')
+  parser.add_option('--adgroup_population', type='int',
+                    default=generator.DEFAULT_ADGROUP_POPULATION,
+                    help='Number of adgroups with --adgroup_popularity '
+                    'without --adgroup_ids_file (%d by default).' %
+                    generator.DEFAULT_ADGROUP_POPULATION)
+  parser.add_option('--session_users', type='int', default=0,
+                    help='Simulate this many active users per thread, each '
+                    'browsing in a session of several requests with the '
+                    'same user ID, geo, user agent and device, instead of '
+                    'sending each request for a user of its own (0 by '
+                    'default). Users come from the population of '
+                    '--user_popularity or --google_user_ids_file if any.')
+  parser.add_option('--session_length', type='string',
+                    default=generator.DEFAULT_SESSION_LENGTH,
+                    help='Distribution of the number of requests of a '
+                    'session: fixed:<value>, uniform:<low>:<high>, '
+                    'exponential:<mean> or pareto:<minimum>:<shape> (%s by '
+                    'default).' % generator.DEFAULT_SESSION_LENGTH)
+  parser.add_option('--think_time', type='string',
+                    default=generator.DEFAULT_THINK_TIME,
+                    help='Distribution of the seconds between the requests '
+                    'of a session, see --session_length (%s by default).' %
+                    generator.DEFAULT_THINK_TIME)
+  parser.add_option('--seed', type='int',
+                    help='Seed for generating requests. Runs with the same '
+                    'seed, options and thread count send the same requests. '
+                    'A random seed is used and printed by default.')
+  parser.add_option('--generation_batch_size', type='int', default=0,
+                    help='Generate requests this many at a time, which uses '
+                    'less CPU per request, especially with NumPy installed '
+                    '(0, one at a time, by default).')
+  parser.add_option('--splice_requests', action='store_true', default=False,
+                    help='Assemble batches of requests from pre-serialized '
+                    'fields instead of building and serializing messages, '
+                    'which uses less CPU. Requires --generation_batch_size.')
+  parser.add_option('--pipeline_depth', type='int', default=1,
+                    help='Send up to this many requests on the connection of '
+                    'each thread before reading their responses, with '
+                    'HTTP/1.1 pipelining (1, no pipelining, by default). '
+                    'With --http2, the number of concurrent streams.')
+  parser.add_option('--http2', action='store_true', default=False,
+                    help='Send requests with HTTP/2 in cleartext (h2c) with '
+                    'prior knowledge, which requires the h2 library.')
+  parser.add_option('--adaptive_rate', action='store_true', default=False,
+                    help='Adapt the rate to what the bidder sustains, up to '
+                    '--max_qps: raise it by --adaptive_increase_qps after '
+                    'each --adaptive_interval the bidder keeps up, and '
+                    'multiply it by --adaptive_decrease_factor otherwise.')
+  parser.add_option('--adaptive_initial_qps', type='float',
+                    help='Rate to start at with --adaptive_rate (a tenth of '
+                    '--max_qps by default).')
+  parser.add_option('--adaptive_increase_qps', type='float',
+                    default=ratecontrol.DEFAULT_INCREASE_QPS,
+                    help='Rate added after an interval the bidder kept up '
+                    'with (%g by default).' % ratecontrol.DEFAULT_INCREASE_QPS)
+  parser.add_option('--adaptive_decrease_factor', type='float',
+                    default=ratecontrol.DEFAULT_DECREASE_FACTOR,
+                    help='Factor the rate is multiplied by after an interval '
+                    'the bidder did not keep up with (%g by default).' %
+                    ratecontrol.DEFAULT_DECREASE_FACTOR)
+  parser.add_option('--adaptive_interval', type='float',
+                    default=ratecontrol.DEFAULT_INTERVAL,
+                    help='Seconds between rate adjustments (%g by default).' %
+                    ratecontrol.DEFAULT_INTERVAL)
+  parser.add_option('--adaptive_max_error_rate', type='float',
+                    default=ratecontrol.DEFAULT_MAX_ERROR_RATE,
+                    help='The bidder did not keep up with an interval if the '
+                    'fraction of non-200 responses exceeds this value (%g by '
+                    'default).' % ratecontrol.DEFAULT_MAX_ERROR_RATE)
+  parser.add_option('--adaptive_max_latency_ms', type='float',
+                    help='The bidder did not keep up with an interval if the '
+                    'round trip latency at --adaptive_latency_percentile '
+                    'exceeds this many milliseconds (--deadline_ms by '
+                    'default).')
+  parser.add_option('--adaptive_latency_percentile', type='choice',
+                    choices=[str(p) for p in log.LATENCY_PERCENTILES],
+                    default=str(ratecontrol.DEFAULT_LATENCY_PERCENTILE),
+                    help='Latency percentile checked by '
+                    '--adaptive_max_latency_ms (%d by default).' %
+                    ratecontrol.DEFAULT_LATENCY_PERCENTILE)
+  parser.add_option('--generation_processes', type='int', default=0,
+                    help='Generate requests in this many worker processes, '
+                    'ahead of the threads sending them, rather than in the '
+                    'sending threads (0 by default).')
+  parser.add_option('--defer_full_collections', action='store_true',
+                    default=False,
+                    help='Do not let the garbage collector scan all the '
+                    'requests and responses kept for the summary while '
+                    'requests are sent, which pauses every thread in long '
+                    'runs at high QPS.')
+  parser.add_option('--deadline_ms', type='int',
+                    default=log.DEFAULT_DEADLINE_MS,
+                    help='Responses slower than this many milliseconds are '
+                    'reported as deadline misses (%d by default).' %
+                    log.DEFAULT_DEADLINE_MS)
+  parser.add_option('--summarize_processes', type='int', default=1,
+                    help='Number of processes used to validate the responses '
+                    'once all requests have been sent (1 by default).')
+  parser.add_option('--summary_file', type='string',
+                    help='Path to write a JSON summary of the results to.')
+  parser.add_option('--record_log', type='string',
+                    help='Path to write a binary log of all requests and '
+                    'responses to, for later analysis with compare.py.')
+  parser.add_option('--results_file', type='string',
+                    help='Path to write per-request metrics to, for later '
+                    'analysis with results.py.')
+  parser.add_option('--slo_latency_ms', type='float',
+                    help='Exit with status %d if the round trip latency at '
+                    '--slo_latency_percentile exceeds this many '
+                    'milliseconds.' % SLO_VIOLATION_EXIT_STATUS)
+  parser.add_option('--slo_latency_percentile', type='choice',
+                    choices=[str(p) for p in log.LATENCY_PERCENTILES],
+                    default='99',
+                    help='Latency percentile checked by --slo_latency_ms, one '
+                    'of %s (99 by default).' % ', '.join(
+                        str(p) for p in log.LATENCY_PERCENTILES))
+  parser.add_option('--slo_error_rate', type='float',
+                    help='Exit with status %d if the fraction of non-200 or '
+                    'unparseable responses exceeds this value.' %
+                    SLO_VIOLATION_EXIT_STATUS)
+  parser.add_option('--slo_deadline_miss_rate', type='float',
+                    help='Exit with status %d if the fraction of responses '
+                    'slower than --deadline_ms exceeds this value.' %
+                    SLO_VIOLATION_EXIT_STATUS)
   return parser
 
 
@@ -294,6 +711,15 @@ def ParseCommandLineArguments(parser):
     parser.error('--url requires a value.')
   if not opts.max_qps:
     parser.error('--max_qps requires a value.')
+  if opts.http2 and sender.h2 is None:
+    parser.error('--http2 requires the h2 library.')
+  if opts.splice_requests and opts.generation_batch_size <= 0:
+    parser.error('--splice_requests requires --generation_batch_size.')
+  for name in ('session_length', 'think_time'):
+    try:
+      sampling.QuantileFunction(getattr(opts, name))
+    except ValueError as e:
+      parser.error('invalid --%s: %s' % (name, e))
   return opts
 
 
@@ -328,27 +754,141 @@ def main():
 
   google_user_ids = None
   if opts.google_user_ids_file:
-    google_user_ids = GetIdsFromFile(opts.google_user_ids_file)
+    # Memory-mapped rather than read, as cookie matching lists can have tens
+    # of millions of IDs, and shared by all threads.
+    try:
+      google_user_ids = idfile.IdFile(opts.google_user_ids_file)
+    except IOError:
+      print 'Could not open file for reading: %s' % opts.google_user_ids_file
 
   adgroup_ids = None
   if opts.adgroup_ids_file:
-    adgroup_ids = [int(i) for i in GetIdsFromFile(opts.adgroup_ids_file)]
+    # A single compact pool is shared by the generators of all threads.
+    adgroup_ids = generator.AdGroupIdPool(
+        int(i) for i in GetIdsFromFile(opts.adgroup_ids_file))
 
   if (opts.instream_video_proportion + opts.mobile_proportion) > 1:
     raise Exception('Video and mobile proportions exceed 1')
-
-  requesters = CreateRequesters(opts.num_threads, opts.max_qps, opts.url,
+  traffic_mix = generator.DefaultTrafficMix(opts.instream_video_proportion,
+                                            opts.mobile_proportion)
+  if opts.traffic_mix_file:
+    try:
+      with open(opts.traffic_mix_file) as traffic_mix_file:
+        traffic_mix = generator.LoadTrafficMix(traffic_mix_file)
+    except (IOError, ValueError) as e:
+      parser.error('invalid --traffic_mix_file: %s' % e)
+
+  distributions = None
+  if opts.distribution_file:
+    try:
+      with open(opts.distribution_file) as distribution_file:
+        distributions = generator.LoadDistributions(distribution_file)
+    except (IOError, ValueError) as e:
+      parser.error('invalid --distribution_file: %s' % e)
+  try:
+    popularity = generator.PopularityDistributions(
+        opts.user_popularity,
+        len(google_user_ids) if google_user_ids else opts.user_population,
+        opts.publisher_popularity, opts.adgroup_popularity,
+        len(adgroup_ids) if adgroup_ids else opts.adgroup_population)
+  except ValueError as e:
+    parser.error(str(e))
+  if popularity:
+    if set(popularity).intersection(distributions or {}):
+      parser.error('--publisher_popularity conflicts with the publisher '
+                   'weights of --distribution_file.')
+    distributions = dict(distributions or {}, **popularity)
+
+  urls = [url.strip() for url in opts.url.split(',') if url.strip()]
+  if not urls:
+    parser.error('--url requires a value.')
+  balancer = None
+  if len(urls) > 1 or opts.url_weights:
+    try:
+      weights = None
+      if opts.url_weights:
+        weights = [float(weight) for weight in opts.url_weights.split(',')]
+      balancer = sender.LoadBalancer(urls, opts.balancing, weights)
+    except ValueError as e:
+      parser.error('invalid --url or --url_weights: %s' % e)
+
+  rate_controller = None
+  if opts.adaptive_rate:
+    max_latency_ms = opts.adaptive_max_latency_ms or opts.deadline_ms
+    try:
+      rate_controller = ratecontrol.AdaptiveRateController(
+          opts.max_qps, opts.adaptive_initial_qps,
+          increase_qps=opts.adaptive_increase_qps,
+          decrease_factor=opts.adaptive_decrease_factor,
+          max_error_rate=opts.adaptive_max_error_rate,
+          max_latency=max_latency_ms / 1000.0,
+          latency_percentile=float(opts.adaptive_latency_percentile),
+          interval=opts.adaptive_interval)
+    except ValueError as e:
+      parser.error('invalid --adaptive_rate option: %s' % e)
+
+  seed = opts.seed
+  if seed is None:
+    seed = generator.NewSeed()
+  print 'Random seed: %d' % seed
+
+  generation_pool = None
+  if opts.generation_processes > 0:
+    generation_pool = pipeline.GenerationPool(opts.generation_processes)
+  requesters = CreateRequesters(opts.num_threads, opts.max_qps, urls[0],
                                 logger_obj, google_user_ids, opts.seconds,
                                 opts.requests, opts.thread_interval,
                                 opts.instream_video_proportion,
-                                opts.mobile_proportion, adgroup_ids)
+                                opts.mobile_proportion, adgroup_ids, seed,
+                                opts.generation_batch_size,
+                                opts.splice_requests, distributions,
+                                opts.session_users, opts.session_length,
+                                opts.think_time, traffic_mix,
+                                generation_pool, opts.pipeline_depth,
+                                opts.http2, balancer, rate_controller)
+  if generation_pool is not None:
+    # Started before the requester threads, as the workers are forked.
+    generation_pool.Start()
+  if opts.defer_full_collections:
+    thresholds = DeferFullCollections()
   for requester in requesters:
     requester.start()
 
   for requester in requesters:
     requester.join()
-
-  PrintSummary(logger_obj, opts.sample_encrypted_price)
+  if generation_pool is not None:
+    generation_pool.Stop()
+  if opts.defer_full_collections:
+    gc.set_threshold(*thresholds)
+
+  mean_session_length = 1
+  if opts.session_users > 0:
+    mean_session_length = generator.MeanSessionLength(opts.session_length)
+  repeat_rates = generator.ImpliedRepeatRates(
+      distributions,
+      sum(requester.GetGeneratedRequests() for requester in requesters),
+      google_user_ids, mean_session_length)
+  request_classes = [traffic_class.name
+                     for traffic_class in traffic_mix.classes]
+  summarizer = PrintSummary(logger_obj, opts.sample_encrypted_price,
+                            opts.deadline_ms, opts.summary_file,
+                            opts.summarize_processes, repeat_rates,
+                            request_classes, urls,
+                            rate_controller and rate_controller.GetSummary())
+  if opts.record_log:
+    with open(opts.record_log, 'wb') as record_log:
+      log.WriteRecordLog(logger_obj, record_log, request_classes, urls)
+  if opts.results_file:
+    with open(opts.results_file, 'wb') as results_file:
+      summarizer.GetResults().Dump(results_file)
+  violations = log.FindSloViolations(
+      summarizer.GetSummary(), opts.slo_latency_ms,
+      float(opts.slo_latency_percentile), opts.slo_error_rate,
+      opts.slo_deadline_miss_rate)
+  for violation in violations:
+    print 'SLO VIOLATION: %s' % violation
+  if violations:
+    sys.exit(SLO_VIOLATION_EXIT_STATUS)
 
 
 if __name__ == '__main__':
@@ -2,12 +2,14 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """Unit tests for requester.py."""
 
+import gc
 import time
 import unittest
 
 import realtime_bidding_pb2
 
 import log
+import ratecontrol
 import requester
 
 
@@ -25,15 +27,60 @@ class MockGenerator(object):
     if not self.request:
       self.request = realtime_bidding_pb2.BidRequest()
       self.request.id = '1234'
+    self.request_class = None
+    self.pings = 0
 
   def GenerateBidRequest(self):
     """Generates a string instead of a real bid request."""
+    self.request_class = 'display'
     return self.request
 
   def GeneratePingRequest(self):
     """Generates a string instead of a ping request."""
+    self.request_class = 'ping'
+    self.pings += 1
     return self.request
 
+  def GetRequestClass(self):
+    """Returns the class of the last request."""
+    return self.request_class
+
+
+class MockPipeliningSender(object):
+  """A mock pipelining sender that echoes the requests it was sent."""
+
+  def __init__(self):
+    self.outstanding = []
+    self.max_outstanding = 0
+
+  def StartRequest(self, payload):
+    self.outstanding.append((len(self.outstanding), payload))
+    self.max_outstanding = max(self.max_outstanding, len(self.outstanding))
+    return self.outstanding[-1][0]
+
+  def FinishRequest(self):
+    # Responses arrive in reverse order, as they may with HTTP/2.
+    request_id, payload = self.outstanding.pop()
+    return (request_id, 200, payload)
+
+  def ResponseReady(self, _):
+    return bool(self.outstanding)
+
+
+
+class MockBalancingSender(object):
+  """A mock sender alternating between two endpoints."""
+
+  def __init__(self):
+    self.sent = 0
+
+  def __call__(self, payload):
+    self.sent += 1
+    return (200, '')
+
+  def GetEndpoint(self):
+    return ['http://a/', 'http://b/'][(self.sent - 1) % 2]
+
 
 class MockMethod(object):
   """A callable class to mock out methods in Requester."""
@@ -122,6 +169,17 @@ class TestRequester(unittest.TestCase):
     self.assertEqual(1, self.requester._generated_requests)
     self.assertEqual(generator.request, request)
 
+  def testPingProportion(self):
+    """Tests that the given fraction of the requests are pings."""
+    for ping_proportion, pings in [(0.0, 0), (1.0, 10)]:
+      generator = MockGenerator()
+      self.requester = requester.Requester(generator, None, None, 0.1,
+                                           requests=10,
+                                           ping_proportion=ping_proportion)
+      for _ in range(10):
+        self.requester._GenerateRequest()
+      self.assertEqual(pings, generator.pings)
+
   def testShouldSendMoreRequestsStopsOnMaxRequests(self):
     """Tests that ShouldSendMoreRequests stops at the maximum request count."""
     generator = MockGenerator()
@@ -193,6 +251,104 @@ class TestRequester(unittest.TestCase):
     self.requester.Start()
     self.assertEqual(2, self.requester._Wait._call_count)
 
+  def testStartLogsTiming(self):
+    """Tests that Requester logs the send time and latency of requests."""
+    generator = MockGenerator()
+    logger = log.Logger()
+    self.requester = requester.Requester(generator, logger, None, 0.1,
+                                         requests=1)
+    self.requester._Wait = NoOp
+    self.requester._GetCurrentTime = MockMethod(
+        '_GetCurrentTime', [(), ()], [100.0, 100.25])
+    self.requester._sender = MockMethod(
+        '_sender', [(generator.request.SerializeToString(),)], [(200, '')])
+    self.requester.Start()
+    logger.Done()
+    records = list(logger)
+    self.assertEqual(1, len(records))
+    self.assertEqual(100.0, records[0].start_time)
+    self.assertEqual(0.25, records[0].latency)
+    self.assertEqual(generator.request_class, records[0].request_class)
+
+  def testStartPipelined(self):
+    """Tests that pipelined requests are logged with their own latency."""
+    generator = MockGenerator()
+    logger = log.Logger()
+    sender_obj = MockPipeliningSender()
+    self.requester = requester.Requester(generator, logger, sender_obj, 0.1,
+                                         requests=5, ping_proportion=0,
+                                         pipeline_depth=2)
+    # The clock advances by a second each time it is read.
+    clock = iter(xrange(100, 1000))
+    self.requester._GetCurrentTime = lambda: float(next(clock))
+    self.requester.Start()
+    logger.Done()
+    records = list(logger)
+    self.assertEqual(5, len(records))
+    self.assertEqual(2, sender_obj.max_outstanding)
+    self.assertEqual([], sender_obj.outstanding)
+    for record in records:
+      self.assertEqual(generator.request.SerializeToString(),
+                       record.payload)
+      self.assertTrue(record.latency > 0)
+      self.assertEqual('display', record.request_class)
+
+  def testStartLogsEndpoints(self):
+    """Tests that Requester logs the endpoint each request was sent to."""
+    generator = MockGenerator()
+    logger = log.Logger()
+    self.requester = requester.Requester(generator, logger,
+                                         MockBalancingSender(), 0.1,
+                                         requests=3)
+    self.requester._Wait = NoOp
+    self.requester.Start()
+    logger.Done()
+    self.assertEqual(['http://a/', 'http://b/', 'http://a/'],
+                     [record.endpoint for record in logger])
+
+  def testStartAdaptsRate(self):
+    """Tests that responses set the rate of an adaptive rate controller."""
+    generator = MockGenerator()
+    logger = log.Logger()
+    controller = ratecontrol.AdaptiveRateController(100, 10, interval=1.0)
+    self.requester = requester.Requester(generator, logger,
+                                         MockBalancingSender(), 0.01,
+                                         requests=3,
+                                         rate_controller=controller)
+    self.requester._Wait = NoOp
+    # Each request takes half a second.
+    clock = iter([100.0, 100.5, 100.5, 101.0, 101.0, 101.5])
+    self.requester._GetCurrentTime = lambda: next(clock)
+    self.requester.Start()
+    self.assertEqual(1, len(controller.GetAdjustments()))
+    self.assertEqual(20, controller.GetQps())
+    self.assertAlmostEqual(0.05, self.requester._GetTimeBetweenRequests())
+
+  def testStartSendsSerializedRequests(self):
+    """Tests that requests a generator already serialized are sent as is."""
+    generator = MockGenerator()
+    generator.request = generator.request.SerializeToString()
+    logger = log.Logger()
+    self.requester = requester.Requester(generator, logger, None, 0.1,
+                                         requests=1)
+    self.requester._Wait = NoOp
+    self.requester._sender = MockMethod(
+        '_sender', [(generator.request,)], [(200, '')])
+    self.requester.Start()
+    logger.Done()
+    self.assertEqual(generator.request,
+                     list(logger)[0].serialized_bid_request)
+
+  def testDeferFullCollections(self):
+    """Tests that only the oldest generation stops being collected."""
+    thresholds = gc.get_threshold()
+    try:
+      self.assertEqual(thresholds, requester.DeferFullCollections())
+      self.assertEqual(thresholds[:2] + (
+          requester.DEFERRED_COLLECTION_THRESHOLD,), gc.get_threshold())
+    finally:
+      gc.set_threshold(*thresholds)
+
   def testWait(self):
     """Tests that _Wait sleeps for the correct amount of time."""
     time_to_wait = 0.1
@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Stores per-request metrics in compact columns.
+
+A ResultsStore keeps one row per request in typed arrays rather than one
+Python object per request, so that tens of millions of requests can be
+summarized. Reports are computed with NumPy when it is installed, and with
+plain Python otherwise. Stores can be dumped to a file whose columns can be
+memory-mapped when loaded again.
+"""
+
+import array
+import collections
+import json
+import math
+import optparse
+import struct
+import sys
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Name and array typecode of each column. Unknown times are stored as NaN;
+# request_class, bucket and endpoint are small integer codes defined by the
+# caller.
+COLUMNS = [
+    ('status', 'i'),
+    ('latency', 'd'),
+    ('start_time', 'd'),
+    ('request_class', 'B'),
+    ('bucket', 'B'),
+    ('request_size', 'I'),
+    ('response_size', 'I'),
+    ('endpoint', 'B'),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+
+# Results files start with RESULTS_MAGIC and the length of a JSON header
+# describing the columns. Each column follows as little-endian values,
+# starting at an offset that is a multiple of COLUMN_ALIGNMENT.
+RESULTS_MAGIC = 'RTBRES01'
+RESULTS_HEADER_LENGTH = struct.Struct('<I')
+COLUMN_ALIGNMENT = 8
+
+# Requests sent in an interval of a time series. mean_latency is in seconds,
+# or None if no request in the interval has a known latency.
+Interval = collections.namedtuple(
+    'Interval', ['start', 'requests', 'errors', 'mean_latency'])
+
+# Requests whose serialized size is in [min_bytes, max_bytes). latency is
+# the Describe dictionary of their known latencies, or None if none is known.
+SizeBucket = collections.namedtuple(
+    'SizeBucket', ['min_bytes', 'max_bytes', 'requests', 'latency'])
+
+# Requests of the class with the integer code request_class. errors counts
+# those whose HTTP status was not 200, and latency is as in SizeBucket.
+ClassGroup = collections.namedtuple(
+    'ClassGroup', ['request_class', 'requests', 'errors', 'latency'])
+
+# Requests sent to the endpoint with the integer code endpoint, as in
+# ClassGroup.
+EndpointGroup = collections.namedtuple(
+    'EndpointGroup', ['endpoint', 'requests', 'errors', 'latency'])
+
+
+class ResultsException(Exception):
+  """An exception thrown for invalid uses of a ResultsStore."""
+  pass
+
+
+def _NumpyType(typecode):
+  """Returns the little-endian NumPy dtype of an array typecode."""
+  return numpy.dtype(typecode).newbyteorder('<')
+
+
+def Percentiles(sorted_values, percentiles):
+  """Returns several percentiles using the nearest-rank method.
+
+  Args:
+    sorted_values: A non-empty sequence of numbers in ascending order, e.g. a
+        NumPy array.
+    percentiles: A list of percentiles, each in (0, 100].
+
+  Returns:
+    A list with the percentile values, in the order of percentiles.
+  """
+  count = len(sorted_values)
+  indices = [min(max(int(math.ceil(p / 100.0 * count)), 1), count) - 1
+             for p in percentiles]
+  if numpy is not None and isinstance(sorted_values, numpy.ndarray):
+    return [float(value) for value in sorted_values.take(indices)]
+  return [sorted_values[index] for index in indices]
+
+
+def Describe(values, percentiles, scale=1):
+  """Summarizes the distribution of some numbers.
+
+  Args:
+    values: A sequence of numbers in any order.
+    percentiles: The percentiles to compute, see Percentiles.
+    scale: A factor the values are multiplied by first, e.g. 1000 to convert
+        seconds to milliseconds.
+
+  Returns:
+    None if values is empty, otherwise a dictionary with the count, mean,
+    stddev (sample standard deviation), min and max of the values, and their
+    percentiles as a list parallel to percentiles.
+  """
+  count = len(values)
+  if not count:
+    return None
+  if numpy is not None:
+    sorted_values = numpy.sort(numpy.asarray(values, dtype=numpy.float64) *
+                               scale)
+    mean = float(sorted_values.mean())
+    stddev = 0.0
+    if count > 1:
+      stddev = float(sorted_values.std(ddof=1))
+  else:
+    sorted_values = sorted(value * scale for value in values)
+    mean = math.fsum(sorted_values) / count
+    variance = 0.0
+    if count > 1:
+      variance = (math.fsum((value - mean) ** 2 for value in sorted_values) /
+                  (count - 1))
+    stddev = math.sqrt(variance)
+  return {
+      'count': count,
+      'mean': mean,
+      'stddev': stddev,
+      'min': float(sorted_values[0]),
+      'max': float(sorted_values[-1]),
+      'percentiles': Percentiles(sorted_values, percentiles),
+  }
+
+
+class ResultsStore(object):
+  """Per-request metrics stored in columns, see COLUMNS."""
+
+  def __init__(self):
+    self._columns = collections.OrderedDict(
+        (name, array.array(typecode)) for name, typecode in COLUMNS)
+    self._read_only = False
+
+  def __len__(self):
+    return len(self._columns['status'])
+
+  def Append(self, status, latency, start_time, request_class, bucket,
+             request_size, response_size, endpoint=0):
+    """Adds the metrics of one request.
+
+    Args:
+      status: The HTTP status code.
+      latency: The round trip time in seconds, or None if unknown.
+      start_time: The POSIX timestamp at which the request was sent, or None
+          if unknown.
+      request_class: The integer code of the kind of request.
+      bucket: The integer code of the bucket the response was summarized into.
+      request_size: The size of the serialized request in bytes.
+      response_size: The size of the response payload in bytes.
+      endpoint: The integer code of the endpoint the request was sent to.
+
+    Raises:
+      ResultsException: If the store was loaded from a file.
+    """
+    if self._read_only:
+      raise ResultsException('Loaded results can not be modified.')
+    columns = self._columns
+    columns['status'].append(status)
+    columns['latency'].append(float('nan') if latency is None else latency)
+    columns['start_time'].append(
+        float('nan') if start_time is None else start_time)
+    columns['request_class'].append(request_class)
+    columns['bucket'].append(bucket)
+    columns['request_size'].append(request_size)
+    columns['response_size'].append(response_size)
+    columns['endpoint'].append(endpoint)
+
+  def Extend(self, other):
+    """Appends all rows of another store, e.g. one filled by a worker.
+
+    Args:
+      other: A ResultsStore.
+
+    Raises:
+      ResultsException: If this store was loaded from a file.
+    """
+    if self._read_only:
+      raise ResultsException('Loaded results can not be modified.')
+    for name, column in self._columns.iteritems():
+      other_column = other._columns[name]
+      if isinstance(other_column, array.array):
+        column.extend(other_column)
+      else:
+        column.extend(other_column.tolist())
+
+  def Column(self, name):
+    """Returns the values of a column.
+
+    Args:
+      name: One of COLUMN_NAMES.
+
+    Returns:
+      A NumPy array sharing memory with the store if NumPy is installed,
+      otherwise an array.array. It must not be used after rows are added.
+    """
+    column = self._columns[name]
+    if numpy is not None and isinstance(column, array.array):
+      if not column:
+        return numpy.zeros(0, dtype=column.typecode)
+      return numpy.frombuffer(column, dtype=column.typecode)
+    return column
+
+  def Latencies(self):
+    """Returns the latencies in seconds of the rows where it is known."""
+    latencies = self.Column('latency')
+    if numpy is not None:
+      return latencies[~numpy.isnan(latencies)]
+    return [latency for latency in latencies if not math.isnan(latency)]
+
+  def TimeSeries(self, interval):
+    """Splits the requests into consecutive intervals by send time.
+
+    Args:
+      interval: The length of each interval in seconds.
+
+    Returns:
+      A list of Interval tuples, one per interval from the first to the last
+      request with a known send time. start is relative to the first request.
+    """
+    start_times = self.Column('start_time')
+    statuses = self.Column('status')
+    latencies = self.Column('latency')
+    if numpy is not None:
+      known = ~numpy.isnan(start_times)
+      if not known.any():
+        return []
+      start_times = start_times[known]
+      bins = ((start_times - start_times.min()) // interval).astype(numpy.intp)
+      length = int(bins.max()) + 1
+      requests = numpy.bincount(bins, minlength=length)
+      errors = numpy.bincount(bins, weights=statuses[known] != 200,
+                              minlength=length)
+      latencies = latencies[known]
+      timed = ~numpy.isnan(latencies)
+      timed_counts = numpy.bincount(bins[timed], minlength=length)
+      latency_sums = numpy.bincount(bins[timed], weights=latencies[timed],
+                                    minlength=length)
+      rows = zip(requests.tolist(), errors.astype(int).tolist(),
+                 timed_counts.tolist(), latency_sums.tolist())
+    else:
+      known = [i for i, start_time in enumerate(start_times)
+               if not math.isnan(start_time)]
+      if not known:
+        return []
+      first = min(start_times[i] for i in known)
+      rows = []
+      for i in known:
+        index = int((start_times[i] - first) // interval)
+        while len(rows) <= index:
+          rows.append([0, 0, 0, 0.0])
+        row = rows[index]
+        row[0] += 1
+        if statuses[i] != 200:
+          row[1] += 1
+        if not math.isnan(latencies[i]):
+          row[2] += 1
+          row[3] += latencies[i]
+    series = []
+    for index, (requests, errors, timed, latency_sum) in enumerate(rows):
+      mean_latency = None
+      if timed:
+        mean_latency = latency_sum / timed
+      series.append(Interval(index * interval, requests, errors,
+                             mean_latency))
+    return series
+
+  def SizeHistogram(self, percentiles, scale=1):
+    """Groups the requests by request size, in powers of two of bytes.
+
+    Args:
+      percentiles: The latency percentiles to compute, see Percentiles.
+      scale: A factor latencies are multiplied by, see Describe.
+
+    Returns:
+      A list of SizeBucket tuples in increasing size order, for the buckets
+      that have requests. Buckets go from a power of two to the next one,
+      except the first that starts at 0.
+    """
+    sizes = self.Column('request_size')
+    latencies = self.Column('latency')
+    if numpy is not None:
+      exponents = numpy.frexp(numpy.maximum(sizes, 1))[1] - 1
+      groups = []
+      for exponent in numpy.unique(exponents).tolist():
+        bucket_latencies = latencies[exponents == exponent]
+        groups.append((exponent, len(bucket_latencies),
+                       bucket_latencies[~numpy.isnan(bucket_latencies)]))
+    else:
+      grouped = collections.defaultdict(list)
+      for size, latency in zip(sizes, latencies):
+        grouped[max(size, 1).bit_length() - 1].append(latency)
+      groups = [(exponent, len(bucket_latencies),
+                 [latency for latency in bucket_latencies
+                  if not math.isnan(latency)])
+                for exponent, bucket_latencies in sorted(grouped.items())]
+    return [SizeBucket(1 << exponent if exponent else 0, 2 << exponent,
+                       requests, Describe(known, percentiles, scale))
+            for exponent, requests, known in groups]
+
+  def ClassBreakdown(self, percentiles, scale=1):
+    """Groups the requests by request class.
+
+    Args:
+      percentiles: The latency percentiles to compute, see Percentiles.
+      scale: A factor latencies are multiplied by, see Describe.
+
+    Returns:
+      A list of ClassGroup tuples in increasing order of class code, for the
+      classes that have requests.
+    """
+    return [ClassGroup(*group) for group in
+            self._Breakdown('request_class', percentiles, scale)]
+
+  def EndpointBreakdown(self, percentiles, scale=1):
+    """Groups the requests by endpoint, see ClassBreakdown.
+
+    Returns:
+      A list of EndpointGroup tuples in increasing order of endpoint code,
+      for the endpoints that have requests.
+    """
+    return [EndpointGroup(*group) for group in
+            self._Breakdown('endpoint', percentiles, scale)]
+
+  def _Breakdown(self, name, percentiles, scale):
+    """Groups the requests by the code in a column.
+
+    Args:
+      name: The name of the column.
+      percentiles: The latency percentiles to compute, see Percentiles.
+      scale: A factor latencies are multiplied by, see Describe.
+
+    Returns:
+      A list of (code, requests, errors, latency) tuples in increasing order
+      of code, for the codes that have requests.
+    """
+    codes = self.Column(name)
+    statuses = self.Column('status')
+    latencies = self.Column('latency')
+    if numpy is not None:
+      groups = []
+      for code in numpy.unique(codes).tolist():
+        selected = codes == code
+        code_latencies = latencies[selected]
+        groups.append((code, len(code_latencies),
+                       int((statuses[selected] != 200).sum()),
+                       code_latencies[~numpy.isnan(code_latencies)]))
+    else:
+      grouped = collections.defaultdict(lambda: [0, 0, []])
+      for code, status, latency in zip(codes, statuses, latencies):
+        group = grouped[code]
+        group[0] += 1
+        if status != 200:
+          group[1] += 1
+        if not math.isnan(latency):
+          group[2].append(latency)
+      groups = [(code, requests, errors, known)
+                for code, (requests, errors, known) in sorted(grouped.items())]
+    return [(code, requests, errors, Describe(known, percentiles, scale))
+            for code, requests, errors, known in groups]
+
+  def Dump(self, results_file):
+    """Writes the store so that LoadResults can memory-map it.
+
+    Args:
+      results_file: A file like object opened for binary writing, will not be
+          closed.
+    """
+    columns = []
+    offset = 0
+    for name, column in self._columns.iteritems():
+      columns.append([name, column.typecode, offset])
+      offset += len(column) * column.itemsize
+      offset += -offset % COLUMN_ALIGNMENT
+    header = json.dumps({'rows': len(self), 'columns': columns})
+    data_offset = (len(RESULTS_MAGIC) + RESULTS_HEADER_LENGTH.size +
+                   len(header))
+    header += ' ' * (-data_offset % COLUMN_ALIGNMENT)
+    results_file.write(RESULTS_MAGIC)
+    results_file.write(RESULTS_HEADER_LENGTH.pack(len(header)))
+    results_file.write(header)
+    for name, column in self._columns.iteritems():
+      if sys.byteorder != 'little' and column.itemsize > 1:
+        column = array.array(column.typecode, column)
+        column.byteswap()
+      data = column.tostring()
+      results_file.write(data)
+      results_file.write('\0' * (-len(data) % COLUMN_ALIGNMENT))
+
+
+def LoadResults(filename):
+  """Loads a store written by ResultsStore.Dump.
+
+  With NumPy, the columns are memory-mapped rather than read, so only the
+  pages that are used are loaded. The returned store is read-only. Columns
+  missing from files written before they were added are all zeros.
+
+  Args:
+    filename: The path of the results file.
+
+  Returns:
+    A ResultsStore.
+
+  Raises:
+    ResultsException: If the file is not a results file.
+  """
+  with open(filename, 'rb') as results_file:
+    if results_file.read(len(RESULTS_MAGIC)) != RESULTS_MAGIC:
+      raise ResultsException('Not a results file.')
+    (header_length,) = RESULTS_HEADER_LENGTH.unpack(
+        results_file.read(RESULTS_HEADER_LENGTH.size))
+    header = json.loads(results_file.read(header_length))
+    data_offset = results_file.tell()
+    rows = header['rows']
+    store = ResultsStore()
+    for name, typecode, offset in header['columns']:
+      typecode = str(typecode)
+      if name not in store._columns:
+        raise ResultsException('Unknown column %s.' % name)
+      if numpy is not None:
+        if rows:
+          column = numpy.memmap(filename, dtype=_NumpyType(typecode),
+                                mode='r', offset=data_offset + offset,
+                                shape=(rows,))
+        else:
+          column = numpy.zeros(0, dtype=_NumpyType(typecode))
+      else:
+        column = array.array(typecode)
+        results_file.seek(data_offset + offset)
+        column.fromfile(results_file, rows)
+        if sys.byteorder != 'little':
+          column.byteswap()
+      store._columns[name] = column
+    loaded = set(name for name, _, _ in header['columns'])
+    for name, typecode in COLUMNS:
+      if name not in loaded:
+        if numpy is not None:
+          store._columns[name] = numpy.zeros(rows, dtype=_NumpyType(typecode))
+        else:
+          store._columns[name] = array.array(typecode, [0] * rows)
+    store._read_only = True
+    return store
+
+
+def SetupCommandLineOptions():
+  """Sets up command line option parsing.
+
+  Returns:
+    An optparse.OptionParser object.
+  """
+  parser = optparse.OptionParser(usage='%prog [options] RESULTS_FILE')
+  parser.add_option('--interval', type='float', default=1.0,
+                    help='Length of each interval of the time series in '
+                    'seconds (1 by default).')
+  return parser
+
+
+def main():
+  parser = SetupCommandLineOptions()
+  opts, args = parser.parse_args()
+  if len(args) != 1:
+    parser.error('exactly one results file is required.')
+  if opts.interval <= 0:
+    parser.error('--interval must be positive.')
+
+  store = LoadResults(args[0])
+  print '%10s %10s %10s %12s' % ('Second', 'Requests', 'Errors',
+                                 'Latency (ms)')
+  for interval in store.TimeSeries(opts.interval):
+    mean_latency = '-'
+    if interval.mean_latency is not None:
+      mean_latency = '%.2f' % (interval.mean_latency * 1000)
+    print '%10.1f %10d %10d %12s' % (interval.start, interval.requests,
+                                     interval.errors, mean_latency)
+
+
+if __name__ == '__main__':
+  main()
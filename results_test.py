@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for results.py."""
+
+import os
+import tempfile
+import unittest
+
+import results
+
+
+class ResultsStoreTest(unittest.TestCase):
+  """Tests the results module, with NumPy if it is installed."""
+
+  def setUp(self):
+    self.store = results.ResultsStore()
+    # Ten requests per second for three seconds, every fifth one failing.
+    for i in range(30):
+      status = 500 if i % 5 == 0 else 200
+      self.store.Append(status, 0.001 * (i + 1), 1000.0 + i * 0.1, i % 3,
+                        i % 4, 100 + i, 10, i % 2)
+    self.store.Append(200, None, None, 0, 0, 100, 10)
+
+  def testAppend(self):
+    """Tests that rows are stored in columns."""
+    self.assertEqual(31, len(self.store))
+    self.assertEqual([500, 200, 200], list(self.store.Column('status'))[:3])
+    self.assertEqual([100, 101, 102],
+                     list(self.store.Column('request_size'))[:3])
+    self.assertEqual(30, len(self.store.Latencies()))
+
+  def testExtend(self):
+    """Tests appending the rows of another store."""
+    store = results.ResultsStore()
+    store.Append(404, 0.5, 1.0, 1, 2, 3, 4)
+    store.Extend(self.store)
+    self.assertEqual(32, len(store))
+    self.assertEqual([404, 500], list(store.Column('status'))[:2])
+
+  def testDescribe(self):
+    """Tests summarizing a distribution."""
+    self.assertEqual(None, results.Describe([], [50]))
+    description = results.Describe(self.store.Latencies(), [50, 99],
+                                   scale=1000)
+    self.assertEqual(30, description['count'])
+    self.assertAlmostEqual(15.5, description['mean'])
+    self.assertAlmostEqual(8.8034084, description['stddev'])
+    self.assertAlmostEqual(1.0, description['min'])
+    self.assertAlmostEqual(30.0, description['max'])
+    self.assertEqual([15.0, 30.0],
+                     [round(p, 6) for p in description['percentiles']])
+
+  def testTimeSeries(self):
+    """Tests splitting requests into intervals."""
+    series = self.store.TimeSeries(1.0)
+    self.assertEqual([0.0, 1.0, 2.0], [i.start for i in series])
+    self.assertEqual([10, 10, 10], [i.requests for i in series])
+    self.assertEqual([2, 2, 2], [i.errors for i in series])
+    self.assertAlmostEqual(0.0055, series[0].mean_latency)
+    self.assertEqual([], results.ResultsStore().TimeSeries(1.0))
+
+  def testSizeHistogram(self):
+    """Tests grouping requests by size."""
+    self.store.Append(200, 0.5, 1.0, 0, 0, 0, 0)
+    self.store.Append(200, None, 1.0, 0, 0, 4000, 0)
+    histogram = self.store.SizeHistogram([50], scale=1000)
+    self.assertEqual([(0, 2), (64, 128), (128, 256), (2048, 4096)],
+                     [(b.min_bytes, b.max_bytes) for b in histogram])
+    self.assertEqual([1, 29, 2, 1], [b.requests for b in histogram])
+    self.assertAlmostEqual(500, histogram[0].latency['mean'])
+    self.assertEqual(28, histogram[1].latency['count'])
+    self.assertEqual(2, histogram[2].latency['count'])
+    self.assertEqual(None, histogram[3].latency)
+    self.assertEqual([], results.ResultsStore().SizeHistogram([50]))
+
+  def testClassBreakdown(self):
+    """Tests grouping requests by class."""
+    breakdown = self.store.ClassBreakdown([50], scale=1000)
+    self.assertEqual([0, 1, 2], [group.request_class for group in breakdown])
+    self.assertEqual([11, 10, 10], [group.requests for group in breakdown])
+    self.assertEqual([2, 2, 2], [group.errors for group in breakdown])
+    self.assertEqual(10, breakdown[0].latency['count'])
+    self.assertAlmostEqual(15.5, breakdown[1].latency['mean'])
+    self.assertEqual([], results.ResultsStore().ClassBreakdown([50]))
+
+  def testEndpointBreakdown(self):
+    """Tests grouping requests by endpoint."""
+    breakdown = self.store.EndpointBreakdown([50], scale=1000)
+    self.assertEqual([0, 1], [group.endpoint for group in breakdown])
+    self.assertEqual([16, 15], [group.requests for group in breakdown])
+    self.assertEqual([3, 3], [group.errors for group in breakdown])
+    self.assertEqual(15, breakdown[0].latency['count'])
+    self.assertAlmostEqual(16.0, breakdown[1].latency['mean'])
+    self.assertEqual([], results.ResultsStore().EndpointBreakdown([50]))
+
+  def testDumpAndLoad(self):
+    """Tests that a dumped store loads with the same columns."""
+    handle, filename = tempfile.mkstemp()
+    try:
+      with os.fdopen(handle, 'wb') as results_file:
+        self.store.Dump(results_file)
+      loaded = results.LoadResults(filename)
+      self.assertEqual(len(self.store), len(loaded))
+      for name in results.COLUMN_NAMES:
+        self.assertEqual(str(list(self.store.Column(name))),
+                         str(list(loaded.Column(name))))
+      self.assertEqual(self.store.TimeSeries(1.0), loaded.TimeSeries(1.0))
+      self.assertRaises(results.ResultsException, loaded.Append,
+                        200, None, None, 0, 0, 0, 0)
+      del loaded
+    finally:
+      os.remove(filename)
+
+  def testLoadMissingColumn(self):
+    """Tests that columns missing from a file are loaded as zeros."""
+    handle, filename = tempfile.mkstemp()
+    try:
+      del self.store._columns['endpoint']
+      with os.fdopen(handle, 'wb') as results_file:
+        self.store.Dump(results_file)
+      loaded = results.LoadResults(filename)
+      self.assertEqual([0] * 31, list(loaded.Column('endpoint')))
+      self.assertEqual(list(self.store.Column('status')),
+                       list(loaded.Column('status')))
+      del loaded
+    finally:
+      os.remove(filename)
+
+  def testLoadEmpty(self):
+    """Tests dumping and loading a store without rows."""
+    handle, filename = tempfile.mkstemp()
+    try:
+      with os.fdopen(handle, 'wb') as results_file:
+        results.ResultsStore().Dump(results_file)
+      self.assertEqual(0, len(results.LoadResults(filename)))
+    finally:
+      os.remove(filename)
+
+  def testLoadInvalid(self):
+    """Tests that other files are rejected."""
+    handle, filename = tempfile.mkstemp()
+    try:
+      with os.fdopen(handle, 'wb') as results_file:
+        results_file.write('garbage')
+      self.assertRaises(results.ResultsException, results.LoadResults,
+                        filename)
+    finally:
+      os.remove(filename)
+
+
+class ResultsStoreWithoutNumpyTest(ResultsStoreTest):
+  """Tests the results module with the plain Python fallbacks."""
+
+  def setUp(self):
+    self.numpy = results.numpy
+    results.numpy = None
+    ResultsStoreTest.setUp(self)
+
+  def tearDown(self):
+    results.numpy = self.numpy
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Samples elements of a table with given weights in constant time.
+
+Uses Vose's alias method: the weights are rearranged once into a table of
+columns of equal total weight, each holding at most two elements, so that a
+sample needs one uniform random number whatever the number of elements or
+the skew of the weights.
+"""
+
+import math
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+class AliasTable(object):
+  """Draws indices of a table with probabilities proportional to weights."""
+
+  def __init__(self, weights):
+    """Builds the alias table, in time linear in the number of weights.
+
+    Args:
+      weights: A non-empty list of non-negative numbers, not all zero.
+
+    Raises:
+      ValueError: If the weights are invalid.
+    """
+    count = len(weights)
+    if not count:
+      raise ValueError('At least one weight is required.')
+    if any(weight < 0 for weight in weights):
+      raise ValueError('Weights can not be negative.')
+    total = math.fsum(weights)
+    if not total > 0:
+      raise ValueError('At least one weight must be positive.')
+    self.weights = list(weights)
+    self._positive_count = sum(1 for weight in weights if weight > 0)
+    # Scaled so that the average is 1, each column holds a weight of 1.
+    scaled = [weight * count / total for weight in weights]
+    self.probabilities = [1.0] * count
+    self.aliases = range(count)
+    small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+    while small and large:
+      less, more = small.pop(), large.pop()
+      self.probabilities[less] = scaled[less]
+      self.aliases[less] = more
+      scaled[more] -= 1.0 - scaled[less]
+      if scaled[more] < 1.0:
+        small.append(more)
+      else:
+        large.append(more)
+    # Whatever remains has a weight of 1 up to rounding errors, and keeps its
+    # own column.
+    if numpy is not None:
+      self._probability_array = numpy.array(self.probabilities)
+      self._alias_array = numpy.array(self.aliases, dtype=numpy.intp)
+
+  def __len__(self):
+    return len(self.probabilities)
+
+  def Index(self, random_number):
+    """Returns the index drawn for a random number in [0, 1).
+
+    The integer part of random_number * len(self) picks a column, and the
+    fractional part decides between the column's element and its alias.
+    """
+    position = random_number * len(self.probabilities)
+    column = int(position)
+    if position - column < self.probabilities[column]:
+      return column
+    return self.aliases[column]
+
+  def Sample(self, random_obj):
+    """Returns an index drawn with a random.Random instance."""
+    return self.Index(random_obj.random())
+
+  def Indices(self, random_numbers):
+    """Returns the indices drawn for several random numbers, see Index.
+
+    Args:
+      random_numbers: A list or NumPy array of floats in [0, 1).
+
+    Returns:
+      A list of indices.
+    """
+    if numpy is not None:
+      positions = numpy.asarray(random_numbers) * len(self.probabilities)
+      columns = positions.astype(numpy.intp)
+      keep = positions - columns < self._probability_array[columns]
+      return numpy.where(keep, columns, self._alias_array[columns]).tolist()
+    return [self.Index(random_number) for random_number in random_numbers]
+
+  def PositiveCount(self):
+    """Returns the number of indices that can be drawn."""
+    return self._positive_count
+
+
+def ZipfWeights(count, exponent):
+  """Returns Zipf weights, where element k has weight 1 / (k + 1) ** exponent.
+
+  Args:
+    count: The number of elements.
+    exponent: The skew, 0 for uniform weights. Around 1 for the popularity of
+        users or web sites.
+
+  Returns:
+    A list of weights, the first element being the most popular.
+  """
+  if numpy is not None:
+    return (1.0 / numpy.arange(1, count + 1) ** exponent).tolist()
+  return [1.0 / rank ** exponent for rank in xrange(1, count + 1)]
+
+
+def HotSetWeights(count, hot_fraction, hot_traffic):
+  """Returns weights where a hot set of elements gets most of the traffic.
+
+  Args:
+    count: The number of elements.
+    hot_fraction: The fraction of the elements that are hot, the first ones.
+        At least one element is hot.
+    hot_traffic: The fraction of the draws that pick a hot element.
+
+  Returns:
+    A list of weights, uniform within the hot and the cold elements.
+  """
+  hot_count = min(count, max(1, int(round(count * hot_fraction))))
+  if hot_count == count:
+    return [1.0] * count
+  return ([hot_traffic / hot_count] * hot_count +
+          [(1.0 - hot_traffic) / (count - hot_count)] * (count - hot_count))
+
+
+def PopularityWeights(specification, count):
+  """Returns the weights of count elements given a popularity specification.
+
+  Args:
+    specification: 'uniform', 'zipf:<exponent>' (see ZipfWeights) or
+        'hotset:<hot fraction>:<hot traffic>' (see HotSetWeights), e.g.
+        'zipf:1.1' or 'hotset:0.01:0.9'.
+    count: The number of elements, at least 1.
+
+  Returns:
+    A list of weights, the first element being the most popular.
+
+  Raises:
+    ValueError: If the specification is invalid.
+  """
+  if count < 1:
+    raise ValueError('The population must have at least one element.')
+  parts = specification.split(':')
+  try:
+    parameters = [float(part) for part in parts[1:]]
+  except ValueError:
+    raise ValueError('Invalid popularity %s.' % specification)
+  if parts[0] == 'uniform' and not parameters:
+    return [1.0] * count
+  if parts[0] == 'zipf' and len(parameters) == 1 and parameters[0] >= 0:
+    return ZipfWeights(count, parameters[0])
+  if (parts[0] == 'hotset' and len(parameters) == 2 and
+      0 <= parameters[0] <= 1 and 0 <= parameters[1] <= 1):
+    return HotSetWeights(count, parameters[0], parameters[1])
+  raise ValueError('Invalid popularity %s, expected uniform, '
+                   'zipf:<exponent> or hotset:<hot fraction>:<hot traffic>.'
+                   % specification)
+
+
+def RepeatRate(weights, draws):
+  """Returns the expected fraction of draws that repeat an earlier draw.
+
+  This is the hit rate of an unbounded cache of the drawn elements: element i
+  drawn with probability p is seen at least once in n draws with probability
+  1 - (1 - p) ** n, so n draws are expected to hit the sum of these distinct
+  elements and to repeat one for the rest.
+
+  Args:
+    weights: The weights the elements are drawn with.
+    draws: The number of draws.
+
+  Returns:
+    A fraction in [0, 1), 0 if there are no draws.
+  """
+  if draws <= 0:
+    return 0.0
+  total = math.fsum(weights)
+  if numpy is not None:
+    probabilities = numpy.asarray(weights, dtype=numpy.float64) / total
+    with numpy.errstate(divide='ignore'):
+      distinct = -numpy.expm1(draws * numpy.log1p(-probabilities)).sum()
+  else:
+    distinct = math.fsum(-math.expm1(draws * math.log1p(-weight / total))
+                         for weight in weights if weight < total)
+    distinct += sum(1 for weight in weights if weight >= total)
+  return max(0.0, 1.0 - distinct / draws)
+
+
+def UniformRepeatRate(count, draws):
+  """Returns RepeatRate for count elements with equal weights."""
+  if draws <= 0:
+    return 0.0
+  if count == 1:
+    return 1.0 - 1.0 / draws
+  distinct = -count * math.expm1(draws * math.log1p(-1.0 / count))
+  return max(0.0, 1.0 - distinct / draws)
+
+
+def QuantileFunction(specification):
+  """Returns the quantile function of a distribution of positive numbers.
+
+  Drawing a uniform random number in [0, 1) and passing it to the quantile
+  function draws a value from the distribution.
+
+  Args:
+    specification: 'fixed:<value>', 'uniform:<low>:<high>',
+        'exponential:<mean>' or 'pareto:<minimum>:<shape>', e.g.
+        'exponential:30' or 'pareto:1:1.5' for a heavy tail.
+
+  Returns:
+    A function mapping a float in [0, 1) to a value.
+
+  Raises:
+    ValueError: If the specification is invalid.
+  """
+  parts = specification.split(':')
+  try:
+    parameters = [float(part) for part in parts[1:]]
+  except ValueError:
+    raise ValueError('Invalid distribution %s.' % specification)
+  if all(parameter >= 0 for parameter in parameters):
+    if parts[0] == 'fixed' and len(parameters) == 1:
+      return lambda random_number: parameters[0]
+    if (parts[0] == 'uniform' and len(parameters) == 2 and
+        parameters[0] <= parameters[1]):
+      low, high = parameters
+      return lambda random_number: low + (high - low) * random_number
+    if parts[0] == 'exponential' and len(parameters) == 1:
+      mean = parameters[0]
+      return lambda random_number: -mean * math.log1p(-random_number)
+    if (parts[0] == 'pareto' and len(parameters) == 2 and
+        parameters[1] > 0):
+      minimum, shape = parameters
+      return lambda random_number: (
+          minimum * (1.0 - random_number) ** (-1.0 / shape))
+  raise ValueError('Invalid distribution %s, expected fixed:<value>, '
+                   'uniform:<low>:<high>, exponential:<mean> or '
+                   'pareto:<minimum>:<shape>.' % specification)
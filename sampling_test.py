@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for sampling.py."""
+
+import math
+import random
+import unittest
+
+import sampling
+
+
+class AliasTableTest(unittest.TestCase):
+  """Tests the AliasTable class."""
+
+  def testSampleFrequencies(self):
+    """Tests that indices are drawn in proportion to their weights."""
+    table = sampling.AliasTable([5, 0, 3, 2])
+    random_obj = random.Random(1234)
+    counts = [0] * len(table)
+    for _ in range(20000):
+      counts[table.Sample(random_obj)] += 1
+    self.assertEqual(0, counts[1])
+    for index, weight in [(0, 0.5), (2, 0.3), (3, 0.2)]:
+      self.assertAlmostEqual(weight, counts[index] / 20000.0, delta=0.02)
+    self.assertEqual(3, table.PositiveCount())
+
+  def testIndex(self):
+    """Tests that the whole range of random numbers maps to valid indices."""
+    table = sampling.AliasTable([1, 0, 0, 7])
+    indices = set(table.Index(i / 1000.0) for i in range(1000))
+    self.assertEqual(set([0, 3]), indices)
+    self.assertEqual([0, 0, 0], [sampling.AliasTable([2]).Index(u)
+                                 for u in [0.0, 0.5, 0.999]])
+
+  def testIndicesWithoutNumpy(self):
+    """Tests that Indices gives the same result with or without NumPy."""
+    random_obj = random.Random(1234)
+    weights = [random_obj.random() for _ in range(50)]
+    random_numbers = [random_obj.random() for _ in range(1000)]
+    table = sampling.AliasTable(weights)
+    indices = table.Indices(random_numbers)
+    self.assertEqual([table.Index(u) for u in random_numbers], indices)
+    numpy = sampling.numpy
+    sampling.numpy = None
+    try:
+      self.assertEqual(indices,
+                       sampling.AliasTable(weights).Indices(random_numbers))
+    finally:
+      sampling.numpy = numpy
+
+  def testInvalidWeights(self):
+    """Tests that invalid weights are rejected."""
+    for weights in [[], [1, -1], [0, 0]]:
+      self.assertRaises(ValueError, sampling.AliasTable, weights)
+
+
+class PopularityTest(unittest.TestCase):
+  """Tests the popularity weights and repeat rates."""
+
+  def testPopularityWeights(self):
+    """Tests parsing popularity specifications."""
+    self.assertEqual([1.0] * 3, sampling.PopularityWeights('uniform', 3))
+    self.assertEqual([1.0, 0.25, 1 / 9.0],
+                     sampling.PopularityWeights('zipf:2', 3))
+    weights = sampling.PopularityWeights('hotset:0.2:0.9', 10)
+    self.assertEqual([0.45, 0.45], weights[:2])
+    for weight in weights[2:]:
+      self.assertAlmostEqual(0.0125, weight)
+    self.assertEqual([1.0] * 2, sampling.PopularityWeights('hotset:1:0.5', 2))
+    for specification in ['zipf', 'zipf:x', 'zipf:-1', 'hotset:0.1',
+                          'hotset:2:0.5', 'pareto:1']:
+      self.assertRaises(ValueError, sampling.PopularityWeights,
+                        specification, 10)
+    self.assertRaises(ValueError, sampling.PopularityWeights, 'uniform', 0)
+
+  def testRepeatRate(self):
+    """Tests the repeat rate against repeated draws."""
+    weights = sampling.ZipfWeights(1000, 1.0)
+    table = sampling.AliasTable(weights)
+    random_obj = random.Random(1234)
+    drawn = set(table.Sample(random_obj) for _ in range(2000))
+    self.assertAlmostEqual(1 - len(drawn) / 2000.0,
+                           sampling.RepeatRate(weights, 2000), delta=0.02)
+    self.assertAlmostEqual(sampling.UniformRepeatRate(100, 50),
+                           sampling.RepeatRate([3] * 100, 50))
+    self.assertAlmostEqual(0.9, sampling.RepeatRate([1, 0], 10))
+    self.assertEqual(0.0, sampling.RepeatRate(weights, 0))
+    numpy = sampling.numpy
+    sampling.numpy = None
+    try:
+      self.assertAlmostEqual(0.9, sampling.RepeatRate([1, 0], 10))
+      self.assertAlmostEqual(sampling.UniformRepeatRate(100, 50),
+                             sampling.RepeatRate([3] * 100, 50))
+    finally:
+      sampling.numpy = numpy
+
+
+class QuantileFunctionTest(unittest.TestCase):
+  """Tests the distributions of QuantileFunction."""
+
+  def testQuantiles(self):
+    """Tests the values drawn from each distribution."""
+    self.assertEqual(3.0, sampling.QuantileFunction('fixed:3')(0.7))
+    uniform = sampling.QuantileFunction('uniform:2:4')
+    self.assertEqual([2.0, 3.0], [uniform(0.0), uniform(0.5)])
+    exponential = sampling.QuantileFunction('exponential:30')
+    self.assertEqual(0.0, exponential(0.0))
+    self.assertAlmostEqual(30 * math.log(2), exponential(0.5))
+    pareto = sampling.QuantileFunction('pareto:1:2')
+    self.assertEqual(1.0, pareto(0.0))
+    self.assertAlmostEqual(2.0, pareto(0.75))
+    for specification in ['fixed', 'fixed:-1', 'uniform:3:2', 'pareto:1:0',
+                          'exponential:x', 'normal:1:2']:
+      self.assertRaises(ValueError, sampling.QuantileFunction, specification)
+
+
+if __name__ == '__main__':
+  unittest.main()
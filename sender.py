@@ -2,12 +2,40 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """A class that sends randomly generated bid requests to an HTTP server."""
 
+import collections
 import httplib
+import select
+import socket
+import threading
+import time
 import urlparse
 
+try:
+  import h2.config
+  import h2.connection
+  import h2.errors
+  import h2.events
+except ImportError:
+  h2 = None
+
 CONTENT_TYPE = "application/octet-stream"
 CONTENT_TYPE_HEADER = "Content-type"
 
+# Bytes read from the socket at a time when reading pipelined responses.
+RECEIVE_SIZE = 65536
+
+# Strategies of a LoadBalancer.
+ROUND_ROBIN = 'round_robin'
+WEIGHTED = 'weighted'
+LEAST_OUTSTANDING = 'least_outstanding'
+BALANCING_STRATEGIES = [ROUND_ROBIN, WEIGHTED, LEAST_OUTSTANDING]
+# The maximum number of endpoints, see results.COLUMNS.
+MAX_ENDPOINTS = 255
+
+
+class ConnectionClosed(httplib.HTTPException):
+  """The server closed the connection before the end of a response."""
+
 
 class HTTPSender(object):
   """Sends requests to the given url.
@@ -15,7 +43,18 @@ class HTTPSender(object):
   You can send things by either invoking the Send() method implicitly or just
   calling an instance of the class, which invokes the Send method."""
 
-  def __init__(self, url):
+  def __init__(self, url, pipeline_depth=1):
+    """Initializes a sender for a URL.
+
+    Args:
+      url: The http URL to send requests to.
+      pipeline_depth: The number of requests that may be written to the
+          connection before reading their responses, see StartRequest.
+
+    Raises:
+      ValueError: If the URL is invalid.
+    """
+    self._url = url
     parsed = urlparse.urlparse(url)
     # Set some defaults.
     self._port = '80'
@@ -43,7 +82,24 @@ class HTTPSender(object):
     if (parsed[2] or parsed[3] or parsed[4] or parsed[5]):
       self._path = urlparse.urlunparse(('', '', parsed[2], parsed[3],
                                         parsed[4], parsed[5]))
-    self._connection = None
+    self._pipeline_depth = max(1, pipeline_depth)
+    host_header = self._host
+    if self._port != '80':
+      host_header = '%s:%s' % (self._host, self._port)
+    # The request line and headers of all requests, up to the value of the
+    # Content-Length header.
+    self._request_prefix = (
+        'POST %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: identity\r\n'
+        '%s: %s\r\nContent-Length: ' % (self._path, host_header,
+                                         CONTENT_TYPE_HEADER, CONTENT_TYPE))
+    # The connection, its _ResponseReader, the
+    # (request ID, request) written to it whose responses were not read yet
+    # and the number of responses read from it.
+    self._socket = None
+    self._reader = None
+    self._unanswered = collections.deque()
+    self._answered = 0
+    self._next_request_id = 0
 
   def __call__(self, *args):
     """Makes instances of HTTPSender callable.
@@ -58,17 +114,858 @@ class HTTPSender(object):
   def Send(self, payload):
     """Sends the given payload to the pre-configured URL.
 
+    The request is written with a single call, and the response parsed
+    directly from the socket, which costs much less CPU than httplib.
+
     Args:
       payload: Data to send.
 
     Returns:
       A tuple of the form (<http response code>, <http response payload>).
+
+    Raises:
+      httplib.HTTPException: If the response is invalid, or the server
+          closed a new connection without responding.
     """
-    if not self._connection:
-      self._connection = httplib.HTTPConnection(self._host, self._port)
-    self._connection.request('POST', self._path, payload,
-                             {CONTENT_TYPE_HEADER: CONTENT_TYPE})
-    response = self._connection.getresponse()
-    status = response.status
-    data = response.read()
+    self.StartRequest(payload)
+    _, status, data = self.FinishRequest()
     return (status, data)
+
+  def GetEndpoint(self):
+    """Returns the URL requests are sent to."""
+    return self._url
+
+  def GetPipelineDepth(self):
+    """Returns the number of requests that may be outstanding at a time."""
+    return self._pipeline_depth
+
+  def StartRequest(self, payload):
+    """Sends a payload without waiting for the responses of earlier ones.
+
+    The requests are pipelined on a single HTTP/1.1 connection, so their
+    responses are read in the same order with FinishRequest. The caller
+    should not have more than GetPipelineDepth requests outstanding.
+
+    Args:
+      payload: Data to send.
+
+    Returns:
+      The ID of the request, returned with its response by FinishRequest.
+    """
+    request_id = self._next_request_id
+    self._next_request_id += 1
+    request = '%s%d\r\n\r\n%s' % (self._request_prefix, len(payload),
+                                    payload)
+    self._unanswered.append((request_id, request))
+    if self._socket is None:
+      try:
+        self._Connect()
+      except socket.error:
+        # The request was not sent, and must not be sent by a later call.
+        self._unanswered.pop()
+        if self._socket is not None:
+          self._socket.close()
+          self._socket = self._reader = None
+        raise
+      return request_id
+    try:
+      self._socket.sendall(request)
+    except socket.error:
+      # The server closed the connection, which FinishRequest handles.
+      pass
+    return request_id
+
+  def FinishRequest(self):
+    """Reads the response of the oldest request sent by StartRequest.
+
+    If the server closes the connection, the requests whose responses were
+    not read are sent again on a new connection.
+
+    Returns:
+      A tuple of the form (<request ID>, <http response code>, <http response
+      payload>).
+
+    Raises:
+      httplib.HTTPException: If the response is invalid, or the server
+          closed a connection without responding to any request.
+    """
+    while True:
+      try:
+        status, data, keep_alive = self._reader.ReadResponse()
+        break
+      except ConnectionClosed:
+        if not self._answered:
+          raise
+        self._Connect()
+    request_id, _ = self._unanswered.popleft()
+    self._answered += 1
+    if not keep_alive:
+      self._Connect()
+    return (request_id, status, data)
+
+  def ResponseReady(self, timeout):
+    """Waits until a response to a pipelined request starts arriving.
+
+    Args:
+      timeout: The maximum number of seconds to wait.
+
+    Returns:
+      True if FinishRequest can read a response without waiting for the
+      server to start sending it.
+    """
+    return (self._reader is not None and bool(self._unanswered) and
+            self._reader.HasData(timeout))
+
+  def GetSockets(self):
+    """Returns the sockets of the connections, for select.select."""
+    if self._socket is None:
+      return []
+    return [self._socket]
+
+  def _Connect(self):
+    """Opens a new connection for pipelined requests.
+
+    The requests of the previous connection that were not answered are sent
+    again.
+    """
+    if self._socket is not None:
+      self._socket.close()
+      self._socket = self._reader = None
+    if not self._unanswered:
+      return
+    self._socket = _OpenSocket(self._host, self._port)
+    self._reader = _ResponseReader(self._socket)
+    self._answered = 0
+    self._socket.sendall(''.join(request for _, request in self._unanswered))
+
+
+def _OpenSocket(host, port):
+  """Returns a socket connected to a server, for pipelined requests."""
+  sock = socket.create_connection((host, int(port)))
+  # Requests are written in one call each, which should not wait for the
+  # acknowledgement of the previous ones.
+  sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  return sock
+
+
+class HTTP2Sender(HTTPSender):
+  """Sends requests to the given url as concurrent HTTP/2 streams.
+
+  Requests are sent in cleartext with prior knowledge (h2c) on a single
+  connection, as concurrent streams, see StartRequest. A connection the
+  server sends GOAWAY on is still read until the streams it accepted
+  complete, while new streams start on a new connection. Requires the h2
+  library.
+  """
+
+  def __init__(self, url, pipeline_depth=1):
+    """Initializes a sender for a URL.
+
+    Args:
+      url: The http URL to send requests to.
+      pipeline_depth: The number of concurrent streams the caller may start
+          before reading their responses.
+
+    Raises:
+      ImportError: If the h2 library is not installed.
+      ValueError: If the URL is invalid.
+    """
+    if h2 is None:
+      raise ImportError('HTTP/2 requires the h2 library.')
+    super(HTTP2Sender, self).__init__(url, pipeline_depth)
+    authority = self._host
+    if self._port != '80':
+      authority = '%s:%s' % (self._host, self._port)
+    self._headers = [(':method', 'POST'), (':scheme', 'http'),
+                     (':authority', authority), (':path', self._path),
+                     (CONTENT_TYPE_HEADER.lower(), CONTENT_TYPE)]
+    # The _HTTP2Connection new streams are started on, the connections that
+    # received GOAWAY and still have streams the server will complete, and
+    # the _Streams waiting for the current connection to allow more streams.
+    self._connection = None
+    self._draining = []
+    self._waiting = collections.deque()
+    # The (request ID, status, data) of the completed requests not returned
+    # by FinishRequest yet.
+    self._completed = collections.deque()
+
+  def Send(self, payload):
+    """Sends the given payload on a stream and waits for its response.
+
+    Args:
+      payload: Data to send.
+
+    Returns:
+      A tuple of the form (<http response code>, <http response payload>).
+    """
+    self.StartRequest(payload)
+    _, status, data = self.FinishRequest()
+    return (status, data)
+
+  def StartRequest(self, payload):
+    """Sends a payload on a new stream, without waiting for responses.
+
+    The body is sent as the flow control windows of the server allow. If the
+    server does not allow more concurrent streams, responses are received
+    until it does.
+
+    Args:
+      payload: Data to send.
+
+    Returns:
+      The ID of the request, returned with its response by FinishRequest.
+    """
+    request_id = self._next_request_id
+    self._next_request_id += 1
+    stream = _Stream(request_id, payload)
+    self._waiting.append(stream)
+    try:
+      self._StartWaiting()
+      while stream in self._waiting:
+        self._Receive(None)
+    except Exception:
+      # The request was not sent, and must not be sent by a later call.
+      if stream in self._waiting:
+        self._waiting.remove(stream)
+      raise
+    return request_id
+
+  def FinishRequest(self):
+    """Waits for the response of any request sent by StartRequest.
+
+    Streams refused by the server are sent again. When the server closes a
+    connection, or sends GOAWAY, the streams it did not process are sent
+    again on a new connection, while those it did are still received.
+
+    Returns:
+      A tuple of the form (<request ID>, <http response code>, <http response
+      payload>), for the requests in the order their responses completed.
+
+    Raises:
+      httplib.HTTPException: If the server reset a stream, or closed a
+          connection without completing any stream.
+    """
+    while not self._completed:
+      self._Receive(None)
+    return self._completed.popleft()
+
+  def ResponseReady(self, timeout):
+    """Waits until the response to a request is complete.
+
+    Args:
+      timeout: The maximum number of seconds to wait.
+
+    Returns:
+      True if FinishRequest can return a response without waiting.
+    """
+    deadline = time.time() + timeout
+    while not self._completed and any(
+        connection.streams for connection in self._GetConnections()):
+      if not self._Receive(max(0, deadline - time.time())):
+        return False
+    return bool(self._completed)
+
+  def GetSockets(self):
+    """Returns the sockets of the connections, for select.select."""
+    return [connection.socket for connection in self._GetConnections()]
+
+  def _GetConnections(self):
+    """Returns the draining connections, then the current one if any."""
+    if self._connection is None:
+      return list(self._draining)
+    return self._draining + [self._connection]
+
+  def _StartWaiting(self):
+    """Starts the waiting streams the current connection allows.
+
+    A new connection is opened if there is none.
+    """
+    while self._waiting:
+      if self._connection is None:
+        self._connection = _HTTP2Connection(self._host, self._port,
+                                            self._headers)
+      if self._connection.IsFull():
+        break
+      self._connection.StartStream(self._waiting.popleft())
+    if self._connection is not None:
+      self._connection.Flush()
+
+  def _Receive(self, timeout):
+    """Receives and handles the frames that arrive first on any connection.
+
+    Args:
+      timeout: The maximum number of seconds to wait, or None to wait until
+          frames arrive.
+
+    Returns:
+      False if no frames arrived before timeout.
+    """
+    connections = self._GetConnections()
+    readable = select.select([connection.socket
+                              for connection in connections], [], [],
+                             timeout)[0]
+    for connection in connections:
+      if connection.socket in readable:
+        self._ReceiveFrom(connection)
+    self._StartWaiting()
+    return bool(readable)
+
+  def _ReceiveFrom(self, connection):
+    """Receives and handles the next frames of a connection.
+
+    Raises:
+      httplib.HTTPException: See FinishRequest.
+    """
+    try:
+      data = connection.socket.recv(RECEIVE_SIZE)
+    except socket.error:
+      data = ''
+    if not data:
+      self._Drop(connection, 0)
+      return
+    for event in connection.h2_connection.receive_data(data):
+      stream = connection.streams.get(getattr(event, 'stream_id', None))
+      if isinstance(event, h2.events.ResponseReceived) and stream:
+        stream.status = int(dict(event.headers)[':status'])
+      elif isinstance(event, h2.events.DataReceived):
+        if stream:
+          stream.data.append(event.data)
+        # Reopens the flow control windows of the server.
+        connection.h2_connection.acknowledge_received_data(
+            event.flow_controlled_length, event.stream_id)
+      elif isinstance(event, h2.events.StreamEnded) and stream:
+        del connection.streams[event.stream_id]
+        connection.completed_streams += 1
+        self._completed.append((stream.request_id, stream.status,
+                                ''.join(stream.data)))
+      elif isinstance(event, h2.events.StreamReset) and stream:
+        del connection.streams[event.stream_id]
+        connection.bodies.pop(event.stream_id, None)
+        if event.error_code != h2.errors.ErrorCodes.REFUSED_STREAM:
+          raise httplib.HTTPException(
+              'Stream reset by the server with error %s.' % event.error_code)
+        # Refused streams were not processed, and are sent again.
+        self._waiting.appendleft(stream)
+      elif isinstance(event, h2.events.ConnectionTerminated):
+        self._Drop(connection, event.last_stream_id)
+        if connection not in self._draining:
+          return
+    if connection is self._connection or connection.streams:
+      connection.Flush()
+    else:
+      self._draining.remove(connection)
+      connection.socket.close()
+
+  def _Drop(self, connection, last_stream_id):
+    """Stops starting streams on a connection the server is closing.
+
+    The streams up to last_stream_id are still received, and the others are
+    sent again on a new connection.
+
+    Args:
+      connection: The _HTTP2Connection that received GOAWAY or was closed.
+      last_stream_id: The highest stream ID the server may process, 0 if the
+          connection was closed.
+
+    Raises:
+      ConnectionClosed: If the connection is closed before completing any
+          stream.
+    """
+    if connection is self._connection:
+      self._connection = None
+    elif connection in self._draining:
+      self._draining.remove(connection)
+    lost = sorted((stream_id for stream_id in connection.streams
+                   if stream_id > last_stream_id), reverse=True)
+    for stream_id in lost:
+      connection.bodies.pop(stream_id, None)
+      self._waiting.appendleft(connection.streams.pop(stream_id))
+    if connection.streams:
+      self._draining.append(connection)
+      return
+    connection.socket.close()
+    if lost and not connection.completed_streams:
+      for _ in lost:
+        self._waiting.popleft()
+      raise ConnectionClosed('Connection closed without a response.')
+
+
+if h2 is not None:
+
+  class _GracefulH2Connection(h2.connection.H2Connection):
+    """An H2Connection that keeps receiving streams after GOAWAY.
+
+    The server still completes the streams up to the last stream ID of its
+    GOAWAY, which an H2Connection would reject as it closes on GOAWAY.
+    """
+
+    def _receive_goaway_frame(self, frame):
+      state = self.state_machine.state
+      result = super(_GracefulH2Connection, self)._receive_goaway_frame(frame)
+      self.state_machine.state = state
+      return result
+
+
+class _HTTP2Connection(object):
+  """A connection of an HTTP2Sender, and the requests of its streams."""
+
+  def __init__(self, host, port, headers):
+    """Opens a connection.
+
+    Args:
+      host: The host name of the server.
+      port: The port of the server.
+      headers: The headers of all requests, see HTTP2Sender.
+    """
+    self.socket = _OpenSocket(host, port)
+    self.h2_connection = _GracefulH2Connection(
+        config=h2.config.H2Configuration(client_side=True,
+                                         header_encoding=None))
+    self.h2_connection.initiate_connection()
+    self._headers = headers
+    # The _Stream of each open stream by stream ID, the parts of request
+    # bodies waiting for the flow control window by stream ID, and the
+    # number of streams completed.
+    self.streams = {}
+    self.bodies = collections.OrderedDict()
+    self.completed_streams = 0
+
+  def IsFull(self):
+    """Returns True if the server does not allow more concurrent streams."""
+    return (self.h2_connection.open_outbound_streams >=
+            self.h2_connection.remote_settings.max_concurrent_streams)
+
+  def StartStream(self, stream):
+    """Sends the headers of a request on a new stream, and its body."""
+    stream.status = None
+    stream.data = []
+    stream_id = self.h2_connection.get_next_available_stream_id()
+    self.streams[stream_id] = stream
+    self.h2_connection.send_headers(
+        stream_id,
+        self._headers + [('content-length', str(len(stream.payload)))],
+        end_stream=not stream.payload)
+    if stream.payload:
+      self.bodies[stream_id] = stream.payload
+
+  def Flush(self):
+    """Sends the request bodies that fit and the pending frames."""
+    self._SendBodies()
+    try:
+      self.socket.sendall(self.h2_connection.data_to_send())
+    except socket.error:
+      # The server closed the connection, which HTTP2Sender handles when
+      # receiving.
+      pass
+
+  def _SendBodies(self):
+    """Sends as much of the request bodies as the flow control allows."""
+    connection = self.h2_connection
+    for stream_id, body in self.bodies.items():
+      while body:
+        size = min(len(body), connection.max_outbound_frame_size,
+                   connection.local_flow_control_window(stream_id))
+        if size <= 0:
+          break
+        connection.send_data(stream_id, body[:size],
+                             end_stream=size == len(body))
+        body = body[size:]
+      if body:
+        self.bodies[stream_id] = body
+      else:
+        del self.bodies[stream_id]
+
+
+class _Stream(object):
+  """A request sent on an HTTP/2 stream, and its response so far."""
+
+  __slots__ = ['request_id', 'payload', 'status', 'data']
+
+  def __init__(self, request_id, payload):
+    self.request_id = request_id
+    self.payload = payload
+    self.status = None
+    self.data = []
+
+
+class LoadBalancer(object):
+  """Picks the endpoint of each request among several URLs.
+
+  A LoadBalancer is shared by the BalancingSender of every thread, so that
+  the strategy spreads the requests of all threads:
+   * ROUND_ROBIN sends the requests to each endpoint in turn.
+   * WEIGHTED sends each endpoint a share of the requests proportional to
+     its weight, interleaved as evenly as possible (smooth weighted
+     round-robin).
+   * LEAST_OUTSTANDING sends each request to the endpoint with the fewest
+     requests waiting for a response, relative to its weight, so that slower
+     endpoints get fewer requests.
+  """
+
+  def __init__(self, urls, strategy=ROUND_ROBIN, weights=None):
+    """Initializes a load balancer.
+
+    Args:
+      urls: The non-empty list of the URLs of the endpoints.
+      strategy: One of BALANCING_STRATEGIES.
+      weights: The positive weight of each endpoint, or None for equal
+          weights. Ignored by ROUND_ROBIN.
+
+    Raises:
+      ValueError: If the strategy is unknown or the weights are invalid.
+    """
+    if not urls:
+      raise ValueError('At least one URL is required.')
+    if len(urls) > MAX_ENDPOINTS:
+      raise ValueError('At most %d URLs are supported.' % MAX_ENDPOINTS)
+    if strategy not in BALANCING_STRATEGIES:
+      raise ValueError('Unknown balancing strategy %s.' % strategy)
+    if weights is None:
+      weights = [1] * len(urls)
+    if len(weights) != len(urls):
+      raise ValueError('There must be one weight per URL.')
+    if any(weight <= 0 for weight in weights):
+      raise ValueError('Weights must be positive.')
+    self._urls = list(urls)
+    self._strategy = strategy
+    self._weights = [float(weight) for weight in weights]
+    self._lock = threading.Lock()
+    # The number of requests sent to each endpoint whose response was not
+    # received yet.
+    self._outstanding = [0] * len(urls)
+    # The endpoint ROUND_ROBIN picks next, and where LEAST_OUTSTANDING
+    # starts looking, to break ties in turn.
+    self._next = 0
+    # The current weight of each endpoint for WEIGHTED.
+    self._current_weights = [0.0] * len(urls)
+
+  def GetUrls(self):
+    """Returns the URLs of the endpoints, indexed by endpoint."""
+    return list(self._urls)
+
+  def Acquire(self):
+    """Picks the endpoint of a request, counted until it is released.
+
+    Returns:
+      The index of the endpoint in GetUrls().
+    """
+    with self._lock:
+      count = len(self._urls)
+      if self._strategy == WEIGHTED:
+        total = sum(self._weights)
+        for i, weight in enumerate(self._weights):
+          self._current_weights[i] += weight
+        endpoint = max(xrange(count), key=self._current_weights.__getitem__)
+        self._current_weights[endpoint] -= total
+      elif self._strategy == LEAST_OUTSTANDING:
+        order = [(self._next + i) % count for i in xrange(count)]
+        endpoint = min(order, key=lambda i: (self._outstanding[i] + 1) /
+                       self._weights[i])
+        self._next = (endpoint + 1) % count
+      else:
+        endpoint = self._next
+        self._next = (endpoint + 1) % count
+      self._outstanding[endpoint] += 1
+      return endpoint
+
+  def Release(self, endpoint):
+    """Records that the response of a request was received.
+
+    Args:
+      endpoint: The value Acquire returned for the request.
+    """
+    with self._lock:
+      self._outstanding[endpoint] -= 1
+
+
+class BalancingSender(object):
+  """Sends each request to one of several endpoints picked by a LoadBalancer.
+
+  Each BalancingSender keeps a sender, and so a connection, per endpoint,
+  and is used by a single thread like the senders it replaces. It has the
+  interface of HTTPSender, including pipelined requests, whose responses
+  are returned as soon as they arrive from any endpoint.
+  """
+
+  def __init__(self, balancer, pipeline_depth=1, sender_class=HTTPSender):
+    """Initializes a sender for the endpoints of a load balancer.
+
+    Args:
+      balancer: The LoadBalancer picking the endpoints.
+      pipeline_depth: The number of requests that may be outstanding at a
+          time, on all endpoints.
+      sender_class: The class of the sender of each endpoint, HTTPSender or
+          HTTP2Sender.
+
+    Raises:
+      ValueError: If a URL is invalid.
+    """
+    self._balancer = balancer
+    self._urls = balancer.GetUrls()
+    self._pipeline_depth = max(1, pipeline_depth)
+    self._senders = [sender_class(url, self._pipeline_depth)
+                     for url in self._urls]
+    # The endpoint of the last request sent.
+    self._endpoint = None
+    # Maps (endpoint, request ID of its sender) -> request ID, for the
+    # pipelined requests whose responses were not returned yet.
+    self._requests = {}
+    # The number of such requests per endpoint.
+    self._outstanding = [0] * len(self._senders)
+    self._next_request_id = 0
+
+  def __call__(self, *args):
+    """Makes instances of BalancingSender callable, see Send."""
+    return self.Send(*args)
+
+  def Send(self, payload):
+    """Sends the given payload to the next endpoint, see HTTPSender.Send."""
+    endpoint = self._balancer.Acquire()
+    self._endpoint = endpoint
+    try:
+      return self._senders[endpoint].Send(payload)
+    finally:
+      self._balancer.Release(endpoint)
+
+  def GetEndpoint(self):
+    """Returns the URL the last request was sent to."""
+    if self._endpoint is None:
+      return None
+    return self._urls[self._endpoint]
+
+  def GetPipelineDepth(self):
+    """Returns the number of requests that may be outstanding at a time."""
+    return self._pipeline_depth
+
+  def StartRequest(self, payload):
+    """Sends a payload to the next endpoint, see HTTPSender.StartRequest."""
+    endpoint = self._balancer.Acquire()
+    self._endpoint = endpoint
+    request_id = self._next_request_id
+    self._next_request_id += 1
+    try:
+      sender_request_id = self._senders[endpoint].StartRequest(payload)
+    except Exception:
+      self._balancer.Release(endpoint)
+      raise
+    self._requests[(endpoint, sender_request_id)] = request_id
+    self._outstanding[endpoint] += 1
+    return request_id
+
+  def FinishRequest(self):
+    """Waits for the first response of any endpoint.
+
+    The caller must have requests outstanding.
+
+    Returns:
+      A tuple of the form (<request ID>, <http response code>, <http response
+      payload>), see HTTPSender.FinishRequest.
+
+    Raises:
+      httplib.HTTPException: See HTTPSender.FinishRequest.
+    """
+    return self._FinishRequest(self._WaitForEndpoint(None))
+
+  def ResponseReady(self, timeout):
+    """Waits until a response of any endpoint is arriving.
+
+    Args:
+      timeout: The maximum number of seconds to wait.
+
+    Returns:
+      True if FinishRequest can return a response without waiting for the
+      server to start sending it.
+    """
+    return self._WaitForEndpoint(timeout) is not None
+
+  def _WaitForEndpoint(self, timeout):
+    """Waits until a response of any endpoint is arriving.
+
+    The connections of all the endpoints with outstanding requests are
+    waited for at once, so that a response is read as soon as it arrives.
+
+    Args:
+      timeout: The maximum number of seconds to wait, or None to wait until
+          a response arrives.
+
+    Returns:
+      The endpoint whose sender can read a response without waiting for the
+      server to start sending it, or None if there is none after timeout.
+    """
+    deadline = None
+    if timeout is not None:
+      deadline = time.time() + timeout
+    while True:
+      sockets = []
+      for endpoint, outstanding in enumerate(self._outstanding):
+        if outstanding:
+          if self._senders[endpoint].ResponseReady(0):
+            return endpoint
+          sockets.extend(self._senders[endpoint].GetSockets())
+      if not sockets:
+        return None
+      if deadline is not None:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          return None
+      select.select(sockets, [], [], timeout)
+
+  def _FinishRequest(self, endpoint):
+    """Returns the next response of an endpoint, see FinishRequest."""
+    sender_request_id, status, data = self._senders[endpoint].FinishRequest()
+    self._outstanding[endpoint] -= 1
+    self._balancer.Release(endpoint)
+    request_id = self._requests.pop((endpoint, sender_request_id))
+    return (request_id, status, data)
+
+
+class _ResponseReader(object):
+  """Reads consecutive HTTP/1.x responses from a socket.
+
+  Bytes are received into a buffer that is reused for all the responses of
+  the connection, and only grows for responses larger than it.
+  """
+
+  def __init__(self, sock):
+    self._socket = sock
+    self._buffer = bytearray(RECEIVE_SIZE)
+    self._view = memoryview(self._buffer)
+    # The received bytes not read yet are self._buffer[self._start:self._end].
+    self._start = 0
+    self._end = 0
+
+  def HasData(self, timeout):
+    """Returns True if bytes can be read without waiting up to timeout."""
+    if self._start < self._end:
+      return True
+    return bool(select.select([self._socket], [], [], timeout)[0])
+
+  def ReadResponse(self):
+    """Reads the next response, skipping informational ones.
+
+    Returns:
+      A (status, body, keep alive) tuple, keep alive being False if the
+      server will close the connection after the response.
+
+    Raises:
+      httplib.BadStatusLine: If the status line is invalid.
+      ConnectionClosed: If the server closed the connection.
+    """
+    while True:
+      lines = self._ReadHead().split('\r\n')
+      parts = lines[0].split(None, 2)
+      if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise httplib.BadStatusLine(lines[0])
+      try:
+        status = int(parts[1])
+      except ValueError:
+        raise httplib.BadStatusLine(lines[0])
+      if status >= 200:
+        break
+    # Only the headers that delimit the body are parsed.
+    content_length = None
+    chunked = False
+    connection = ''
+    for line in lines[1:]:
+      name, _, value = line.partition(':')
+      name = name.strip().lower()
+      if name == 'content-length':
+        try:
+          content_length = int(value)
+        except ValueError:
+          raise httplib.HTTPException('Invalid Content-Length.')
+      elif name == 'transfer-encoding':
+        chunked = 'chunked' in value.lower()
+      elif name == 'connection':
+        connection = value.lower()
+    keep_alive = 'close' not in connection and (
+        parts[0] == 'HTTP/1.1' or 'keep-alive' in connection)
+    if status in (204, 304):
+      body = ''
+    elif chunked:
+      body = self._ReadChunks()
+    elif content_length is not None:
+      body = self._Read(content_length)
+    else:
+      body = self._ReadUntilClosed()
+      keep_alive = False
+    return status, body, keep_alive
+
+  def _Receive(self):
+    """Receives more bytes at the end of the buffer.
+
+    The unread bytes are first moved to the start of the buffer, which grows
+    if they fill it.
+    """
+    if self._start == self._end:
+      self._start = self._end = 0
+    elif self._end == len(self._buffer):
+      unread = self._end - self._start
+      if self._start:
+        self._buffer[:unread] = self._view[self._start:self._end].tobytes()
+      else:
+        # The memoryview must be released before resizing the buffer.
+        self._view = None
+        self._buffer.extend(bytearray(len(self._buffer)))
+        self._view = memoryview(self._buffer)
+      self._start, self._end = 0, unread
+    try:
+      count = self._socket.recv_into(self._view[self._end:])
+    except socket.error as e:
+      raise ConnectionClosed(str(e))
+    if not count:
+      raise ConnectionClosed('Connection closed by the server.')
+    self._end += count
+
+  def _ReadHead(self):
+    """Returns the status line and headers of the next response."""
+    end = self._buffer.find('\r\n\r\n', self._start, self._end)
+    while end < 0:
+      self._Receive()
+      end = self._buffer.find('\r\n\r\n', self._start, self._end)
+    head = self._view[self._start:end].tobytes()
+    self._start = end + 4
+    return head
+
+  def _ReadLine(self):
+    """Returns the next line, without its line ending."""
+    end = self._buffer.find('\r\n', self._start, self._end)
+    while end < 0:
+      self._Receive()
+      end = self._buffer.find('\r\n', self._start, self._end)
+    line = self._view[self._start:end].tobytes()
+    self._start = end + 2
+    return line
+
+  def _Read(self, size):
+    """Returns the next size bytes."""
+    while self._end - self._start < size:
+      self._Receive()
+    data = self._view[self._start:self._start + size].tobytes()
+    self._start += size
+    return data
+
+  def _ReadChunks(self):
+    """Returns a body sent with the chunked transfer encoding."""
+    chunks = []
+    while True:
+      try:
+        size = int(self._ReadLine().split(';', 1)[0], 16)
+      except ValueError:
+        raise httplib.HTTPException('Invalid chunk size.')
+      if not size:
+        break
+      chunks.append(self._Read(size))
+      self._ReadLine()
+    # Skips the trailers.
+    while self._ReadLine():
+      pass
+    return ''.join(chunks)
+
+  def _ReadUntilClosed(self):
+    """Returns the bytes received until the server closes the connection."""
+    try:
+      while True:
+        self._Receive()
+    except ConnectionClosed:
+      return self._Read(self._end - self._start)
@@ -2,10 +2,219 @@
 # Copyright 2009 Google Inc. All Rights Reserved.
 """Unit tests for requester.py."""
 
+import httplib
+import socket
+import threading
+import time
 import unittest
 
 import sender
 
+try:
+  import hyperframe.frame
+except ImportError:
+  hyperframe = None
+
+
+def ReadRequest(connection_file):
+  """Reads an HTTP request sent by a sender, returning its body."""
+  content_length = 0
+  line = connection_file.readline()
+  if not line:
+    return None
+  while line != '\r\n':
+    name, _, value = line.partition(':')
+    if name.lower() == 'content-length':
+      content_length = int(value)
+    line = connection_file.readline()
+  return connection_file.read(content_length)
+
+
+class PipeliningServer(threading.Thread):
+  """Reads a number of requests on each connection, then answers them."""
+
+  def __init__(self, requests_per_connection, close=False):
+    """Starts listening on a local port.
+
+    Args:
+      requests_per_connection: The number of requests to read on each
+          connection before answering all of them, echoing their bodies.
+      close: Whether to close each connection after answering its first
+          request only.
+    """
+    super(PipeliningServer, self).__init__()
+    self.daemon = True
+    self._listener = socket.socket()
+    self._listener.bind(('127.0.0.1', 0))
+    self._listener.listen(1)
+    self._requests_per_connection = requests_per_connection
+    self._close = close
+    self.connections = 0
+    self.url = 'http://127.0.0.1:%d/bid' % self._listener.getsockname()[1]
+    self.start()
+
+  def run(self):
+    while True:
+      connection, _ = self._listener.accept()
+      self.connections += 1
+      connection_file = connection.makefile('rb')
+      bodies = [ReadRequest(connection_file)
+                for _ in xrange(self._requests_per_connection)]
+      # The client may close the connection before sending all requests.
+      bodies = [body for body in bodies if body is not None]
+      if self._close:
+        bodies = bodies[:1]
+      for body in bodies:
+        connection.sendall('HTTP/1.1 200 OK\r\nContent-Length: %d\r\n%s\r\n%s'
+                           % (len(body), 'Connection: close\r\n' * self._close,
+                              body))
+      connection_file.close()
+      connection.close()
+
+
+class HTTP2Server(threading.Thread):
+  """Answers HTTP/2 requests in batches, the last request first.
+
+  The response to a request is its body, or its length if it is long.
+  Subclasses answer differently by overriding Answer.
+  """
+
+  def __init__(self, batch_size, max_concurrent_streams=None):
+    super(HTTP2Server, self).__init__()
+    self.daemon = True
+    self._listener = socket.socket()
+    self._listener.bind(('127.0.0.1', 0))
+    self._listener.listen(1)
+    self._batch_size = batch_size
+    self._max_concurrent_streams = max_concurrent_streams
+    # The number of connections accepted, the bodies of the requests
+    # answered in order, and the most streams open at once.
+    self.connections = 0
+    self.answered = []
+    self.max_open_streams = 0
+    self.url = 'http://127.0.0.1:%d/bid' % self._listener.getsockname()[1]
+    self.start()
+
+  def run(self):
+    while True:
+      connection, _ = self._listener.accept()
+      self.connections += 1
+      self._Serve(connection)
+      connection.close()
+
+  def _Serve(self, connection):
+    """Answers the requests of a connection until either side closes it."""
+    h2_connection = sender.h2.connection.H2Connection(
+        config=sender.h2.config.H2Configuration(client_side=False,
+                                                header_encoding=None))
+    h2_connection.initiate_connection()
+    if self._max_concurrent_streams is not None:
+      h2_connection.update_settings({
+          sender.h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+              self._max_concurrent_streams})
+    bodies = {}
+    ended = []
+    while ended is not None:
+      connection.sendall(h2_connection.data_to_send())
+      data = connection.recv(65536)
+      if not data:
+        return
+      for event in h2_connection.receive_data(data):
+        if isinstance(event, sender.h2.events.RequestReceived):
+          bodies[event.stream_id] = []
+        elif isinstance(event, sender.h2.events.DataReceived):
+          bodies[event.stream_id].append(event.data)
+          h2_connection.acknowledge_received_data(
+              event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, sender.h2.events.StreamEnded):
+          ended.append(event.stream_id)
+      self.max_open_streams = max(self.max_open_streams,
+                                  h2_connection.open_inbound_streams)
+      ended = self.Answer(connection, h2_connection, ended, bodies)
+    connection.sendall(h2_connection.data_to_send())
+
+  def Answer(self, connection, h2_connection, ended, bodies):
+    """Answers the requests received so far.
+
+    Args:
+      connection: The socket of the connection.
+      h2_connection: Its server H2Connection.
+      ended: The stream IDs of the requests received and not answered, in
+          the order they ended.
+      bodies: The parts of the body of each request by stream ID.
+
+    Returns:
+      The stream IDs of the requests left to answer, or None to close the
+      connection.
+    """
+    if len(ended) < self._batch_size:
+      return ended
+    for stream_id in reversed(ended):
+      self.Respond(h2_connection, stream_id, bodies)
+    return []
+
+  def Respond(self, h2_connection, stream_id, bodies):
+    """Sends the response to a request."""
+    body = ''.join(bodies.pop(stream_id))
+    self.answered.append(body)
+    if len(body) > 100:
+      body = str(len(body))
+    h2_connection.send_headers(
+        stream_id, [(':status', '200'), ('content-length', str(len(body)))])
+    h2_connection.send_data(stream_id, body, end_stream=True)
+
+
+class RefusingHTTP2Server(HTTP2Server):
+  """Refuses the first request, and answers the others one at a time."""
+
+  def __init__(self):
+    self.refused = 0
+    super(RefusingHTTP2Server, self).__init__(1)
+
+  def Answer(self, connection, h2_connection, ended, bodies):
+    if ended and not self.refused:
+      h2_connection.reset_stream(
+          ended[0], error_code=sender.h2.errors.ErrorCodes.REFUSED_STREAM)
+      bodies.pop(ended[0])
+      self.refused += 1
+      ended = ended[1:]
+    return super(RefusingHTTP2Server, self).Answer(
+        connection, h2_connection, ended, bodies)
+
+
+class ClosingHTTP2Server(HTTP2Server):
+  """Closes its first connection once it received two requests.
+
+  Later connections answer each request as it arrives.
+  """
+
+  def __init__(self, answers, goaway):
+    """Starts listening on a local port.
+
+    Args:
+      answers: The number of the two requests to answer before closing.
+      goaway: Whether to send GOAWAY before answering, with the stream ID of
+          the last request answered as the last stream ID.
+    """
+    self._answers = answers
+    self._goaway = goaway
+    super(ClosingHTTP2Server, self).__init__(1)
+
+  def Answer(self, connection, h2_connection, ended, bodies):
+    if self.connections > 1:
+      return super(ClosingHTTP2Server, self).Answer(
+          connection, h2_connection, ended, bodies)
+    if len(ended) < 2:
+      return ended
+    if self._goaway:
+      frame = hyperframe.frame.GoAwayFrame(0)
+      if self._answers:
+        frame.last_stream_id = ended[self._answers - 1]
+      connection.sendall(h2_connection.data_to_send() + frame.serialize())
+    for stream_id in ended[:self._answers]:
+      self.Respond(h2_connection, stream_id, bodies)
+    return None
+
 
 class TestHTTPSender(unittest.TestCase):
   """Tests the HTTPSender class."""
@@ -53,5 +262,273 @@ class TestHTTPSender(unittest.TestCase):
     self.assertEqual('/mypath/hello', self.sender._path)
     self.assertEqual('1234', self.sender._port)
 
+  def testPipelining(self):
+    """Tests that requests are sent before the responses are read."""
+    server = PipeliningServer(3)
+    self.sender = sender.HTTPSender(server.url, 3)
+    self.assertEqual(3, self.sender.GetPipelineDepth())
+    request_ids = [self.sender.StartRequest(payload)
+                   for payload in ['a', 'bb', 'ccc']]
+    self.assertEqual(3, len(set(request_ids)))
+    self.assertTrue(self.sender.ResponseReady(5))
+    self.assertEqual((request_ids[0], 200, 'a'), self.sender.FinishRequest())
+    self.assertEqual((request_ids[1], 200, 'bb'), self.sender.FinishRequest())
+    self.assertEqual((request_ids[2], 200, 'ccc'),
+                     self.sender.FinishRequest())
+    self.assertFalse(self.sender.ResponseReady(0))
+
+  def testPipeliningResendsAfterClose(self):
+    """Tests that unanswered requests are sent again on a new connection."""
+    server = PipeliningServer(1, close=True)
+    self.sender = sender.HTTPSender(server.url, 2)
+    first = self.sender.StartRequest('a')
+    second = self.sender.StartRequest('b')
+    self.assertEqual((first, 200, 'a'), self.sender.FinishRequest())
+    self.assertEqual((second, 200, 'b'), self.sender.FinishRequest())
+    self.assertEqual(2, server.connections)
+
+  def testConnectionRefused(self):
+    """Tests that a request is not sent again after failing to connect."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    self.sender = sender.HTTPSender(
+        'http://127.0.0.1:%d/bid' % listener.getsockname()[1])
+    self.assertRaises(socket.error, self.sender.StartRequest, 'a')
+    listener.listen(1)
+    request_id = self.sender.StartRequest('b')
+    connection, _ = listener.accept()
+    self.assertEqual('b', ReadRequest(connection.makefile('rb')))
+    connection.sendall('HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nb')
+    self.assertEqual((request_id, 200, 'b'), self.sender.FinishRequest())
+    connection.close()
+    listener.close()
+
+
+@unittest.skipIf(sender.h2 is None, 'The h2 library is not installed.')
+class TestHTTP2Sender(unittest.TestCase):
+  """Tests the HTTP2Sender class."""
+
+  def testConcurrentStreams(self):
+    """Tests that responses are returned as their streams complete."""
+    server = HTTP2Server(3)
+    self.sender = sender.HTTP2Sender(server.url, 3)
+    request_ids = [self.sender.StartRequest(payload)
+                   for payload in ['a', 'bb', 'ccc']]
+    self.assertTrue(self.sender.ResponseReady(5))
+    self.assertEqual((request_ids[2], 200, 'ccc'),
+                     self.sender.FinishRequest())
+    self.assertEqual((request_ids[1], 200, 'bb'), self.sender.FinishRequest())
+    self.assertEqual((request_ids[0], 200, 'a'), self.sender.FinishRequest())
+    self.assertFalse(self.sender.ResponseReady(0))
+
+  def testFlowControl(self):
+    """Tests that bodies larger than the flow control window are sent."""
+    server = HTTP2Server(1)
+    self.sender = sender.HTTP2Sender(server.url)
+    self.assertEqual((200, '200000'), self.sender.Send('x' * 200000))
+    self.assertEqual((200, ''), self.sender.Send(''))
+
+  def testRefusedStream(self):
+    """Tests that a stream refused by the server is sent again."""
+    server = RefusingHTTP2Server()
+    self.sender = sender.HTTP2Sender(server.url)
+    self.assertEqual((200, 'a'), self.sender.Send('a'))
+    self.assertEqual(1, server.refused)
+    self.assertEqual(['a'], server.answered)
+    self.assertEqual(1, server.connections)
+
+  def testMaxConcurrentStreams(self):
+    """Tests that streams wait until the server allows more streams."""
+    server = HTTP2Server(1, max_concurrent_streams=1)
+    self.sender = sender.HTTP2Sender(server.url, 2)
+    # The settings of the server arrive before the first response.
+    self.assertEqual((200, 'a'), self.sender.Send('a'))
+    first = self.sender.StartRequest('b')
+    second = self.sender.StartRequest('c')
+    self.assertEqual((first, 200, 'b'), self.sender.FinishRequest())
+    self.assertEqual((second, 200, 'c'), self.sender.FinishRequest())
+    self.assertEqual(1, server.max_open_streams)
+
+  @unittest.skipIf(hyperframe is None, 'The hyperframe library is missing.')
+  def testGoaway(self):
+    """Tests that only the streams GOAWAY refuses are sent again."""
+    server = ClosingHTTP2Server(1, goaway=True)
+    self.sender = sender.HTTP2Sender(server.url, 2)
+    first = self.sender.StartRequest('a')
+    second = self.sender.StartRequest('b')
+    self.assertEqual([(first, 200, 'a'), (second, 200, 'b')],
+                     sorted([self.sender.FinishRequest(),
+                             self.sender.FinishRequest()]))
+    self.assertEqual(['a', 'b'], server.answered)
+    self.assertEqual(2, server.connections)
+    self.assertFalse(self.sender.ResponseReady(0))
+
+  @unittest.skipIf(hyperframe is None, 'The hyperframe library is missing.')
+  def testGoawayWithoutResponse(self):
+    """Tests GOAWAY before any stream completed on a connection."""
+    server = ClosingHTTP2Server(0, goaway=True)
+    self.sender = sender.HTTP2Sender(server.url, 2)
+    self.sender.StartRequest('a')
+    self.sender.StartRequest('b')
+    self.assertRaises(sender.ConnectionClosed, self.sender.FinishRequest)
+    self.assertEqual([], self.sender.GetSockets())
+    # The requests of the closed connection are not sent again.
+    self.assertEqual((200, 'c'), self.sender.Send('c'))
+    self.assertEqual(['c'], server.answered)
+
+  def testConnectionClosed(self):
+    """Tests that unanswered streams are sent again on a new connection."""
+    server = ClosingHTTP2Server(1, goaway=False)
+    self.sender = sender.HTTP2Sender(server.url, 2)
+    first = self.sender.StartRequest('a')
+    second = self.sender.StartRequest('b')
+    self.assertEqual((first, 200, 'a'), self.sender.FinishRequest())
+    self.assertEqual((second, 200, 'b'), self.sender.FinishRequest())
+    self.assertEqual(['a', 'b'], server.answered)
+    self.assertEqual(2, server.connections)
+
+
+class TestLoadBalancer(unittest.TestCase):
+  """Tests the LoadBalancer class."""
+
+  def testRoundRobin(self):
+    """Tests that endpoints are picked in turn."""
+    balancer = sender.LoadBalancer(['http://a/', 'http://b/', 'http://c/'])
+    self.assertEqual([0, 1, 2, 0, 1],
+                     [balancer.Acquire() for _ in xrange(5)])
+
+  def testWeighted(self):
+    """Tests that endpoints are picked in proportion to their weights."""
+    balancer = sender.LoadBalancer(['http://a/', 'http://b/'],
+                                   sender.WEIGHTED, [3, 1])
+    self.assertEqual([0, 0, 1, 0, 0, 0, 1, 0],
+                     [balancer.Acquire() for _ in xrange(8)])
+
+  def testLeastOutstanding(self):
+    """Tests that endpoints with fewer outstanding requests are picked."""
+    balancer = sender.LoadBalancer(['http://a/', 'http://b/'],
+                                   sender.LEAST_OUTSTANDING)
+    self.assertEqual([0, 1], [balancer.Acquire(), balancer.Acquire()])
+    balancer.Release(1)
+    self.assertEqual([1, 0], [balancer.Acquire(), balancer.Acquire()])
+    balancer.Release(0)
+    balancer.Release(0)
+    self.assertEqual(0, balancer.Acquire())
+    # Weights scale the outstanding requests an endpoint is given.
+    balancer = sender.LoadBalancer(['http://a/', 'http://b/'],
+                                   sender.LEAST_OUTSTANDING, [2, 1])
+    self.assertEqual([0, 1, 0, 0, 1],
+                     [balancer.Acquire() for _ in xrange(5)])
+
+  def testInvalid(self):
+    """Tests that invalid strategies and weights are rejected."""
+    self.assertRaises(ValueError, sender.LoadBalancer, [])
+    self.assertRaises(ValueError, sender.LoadBalancer, ['http://a/'],
+                      'random')
+    self.assertRaises(ValueError, sender.LoadBalancer, ['http://a/'],
+                      sender.WEIGHTED, [1, 2])
+    self.assertRaises(ValueError, sender.LoadBalancer, ['http://a/'],
+                      sender.WEIGHTED, [0])
+
+
+class TestBalancingSender(unittest.TestCase):
+  """Tests the BalancingSender class."""
+
+  def testSend(self):
+    """Tests that requests are sent to each endpoint in turn."""
+    servers = [PipeliningServer(1), PipeliningServer(1)]
+    self.sender = sender.BalancingSender(
+        sender.LoadBalancer([server.url for server in servers]))
+    for payload in ['a', 'b', 'c']:
+      self.assertEqual((200, payload), self.sender(payload))
+    self.assertEqual(servers[0].url, self.sender.GetEndpoint())
+    self.assertEqual([2, 1], [server.connections for server in servers])
+
+  def testPipelining(self):
+    """Tests that the responses of all endpoints are returned."""
+    servers = [PipeliningServer(2), PipeliningServer(2)]
+    self.sender = sender.BalancingSender(
+        sender.LoadBalancer([server.url for server in servers]), 4)
+    self.assertEqual(4, self.sender.GetPipelineDepth())
+    sent = {}
+    for payload in ['a', 'b', 'c', 'd']:
+      sent[self.sender.StartRequest(payload)] = payload
+      self.assertEqual(servers[(len(sent) - 1) % 2].url,
+                       self.sender.GetEndpoint())
+    self.assertTrue(self.sender.ResponseReady(5))
+    received = {}
+    for _ in xrange(4):
+      request_id, status, data = self.sender.FinishRequest()
+      self.assertEqual(200, status)
+      received[request_id] = data
+    self.assertEqual(sent, received)
+    self.assertFalse(self.sender.ResponseReady(0))
+
+  def testWaitsForAllEndpoints(self):
+    """Tests that a response is read while another endpoint is silent."""
+    # The first server only answers its second request, which is not sent.
+    servers = [PipeliningServer(2), PipeliningServer(1)]
+    self.sender = sender.BalancingSender(
+        sender.LoadBalancer([server.url for server in servers]), 2)
+    first = self.sender.StartRequest('a')
+    second = self.sender.StartRequest('b')
+    self.assertTrue(self.sender.ResponseReady(5))
+    self.assertEqual((second, 200, 'b'), self.sender.FinishRequest())
+    start = time.time()
+    self.assertFalse(self.sender.ResponseReady(0.05))
+    self.assertTrue(time.time() - start >= 0.05)
+    third = self.sender.StartRequest('c')
+    self.assertEqual([(first, 200, 'a'), (third, 200, 'c')],
+                     sorted([self.sender.FinishRequest(),
+                             self.sender.FinishRequest()]))
+
+
+class TestResponseReader(unittest.TestCase):
+  """Tests reading pipelined responses."""
+
+  def setUp(self):
+    self.server_socket, client_socket = socket.socketpair()
+    self.reader = sender._ResponseReader(client_socket)
+
+  def tearDown(self):
+    self.server_socket.close()
+
+  def testReadResponses(self):
+    """Tests the ways the end of a response can be sent."""
+    self.server_socket.sendall(
+        'HTTP/1.1 100 Continue\r\n\r\n'
+        'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nfirst'
+        'HTTP/1.1 204 No Content\r\n\r\n'
+        'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+        '3;x=y\r\nthi\r\n2\r\nrd\r\n0\r\nTrailer: 1\r\n\r\n'
+        'HTTP/1.0 500 Error\r\nContent-Length: 4\r\n\r\nlast'
+        'HTTP/1.1 200 OK\r\n\r\nuntil closed')
+    self.server_socket.shutdown(socket.SHUT_WR)
+    self.assertEqual((200, 'first', True), self.reader.ReadResponse())
+    self.assertEqual((204, '', True), self.reader.ReadResponse())
+    self.assertEqual((200, 'third', True), self.reader.ReadResponse())
+    self.assertEqual((500, 'last', False), self.reader.ReadResponse())
+    self.assertEqual((200, 'until closed', False), self.reader.ReadResponse())
+    self.assertRaises(sender.ConnectionClosed, self.reader.ReadResponse)
+
+  def testLargeResponses(self):
+    """Tests responses larger than the buffer, split across receives."""
+    body = 'x' * (3 * sender.RECEIVE_SIZE + 1)
+    responses = ''.join('HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s'
+                        % (len(data), data) for data in [body, 'a', body])
+    server_thread = threading.Thread(target=self.server_socket.sendall,
+                                     args=(responses,))
+    server_thread.start()
+    self.assertEqual((200, body, True), self.reader.ReadResponse())
+    self.assertEqual((200, 'a', True), self.reader.ReadResponse())
+    self.assertEqual((200, body, True), self.reader.ReadResponse())
+    server_thread.join()
+
+  def testBadStatusLine(self):
+    """Tests that a response without a valid status line is rejected."""
+    self.server_socket.sendall('200 OK\r\n\r\n')
+    self.assertRaises(httplib.BadStatusLine, self.reader.ReadResponse)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Encodes protocol buffer fields in wire format without message objects.
+
+Used to assemble serialized requests from pre-serialized fragments, see
+generator.DefaultBidGenerator.GenerateSerializedBidRequests. Fields must be
+concatenated in field number order for the result to be byte for byte the
+same as SerializeToString, although any order parses to the same message.
+"""
+
+import struct
+
+# Wire types, see
+# https://developers.google.com/protocol-buffers/docs/encoding
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+_UINT64_MASK = (1 << 64) - 1
+_SMALL_VARINTS = [chr(i) for i in range(128)]
+
+# Encode the values of fixed64 and float fields, without a key.
+PackFixed64 = struct.Struct('<Q').pack
+PackFloat = struct.Struct('<f').pack
+
+
+def Varint(value):
+  """Encodes an integer as a base 128 varint.
+
+  Negative values are encoded as 64 bit two's complement integers, as they
+  are for int32 and int64 fields.
+
+  Args:
+    value: An integer or bool.
+
+  Returns:
+    The encoded bytes.
+  """
+  if 0 <= value < 128:
+    return _SMALL_VARINTS[value]
+  if 0 < value < 16384:
+    return chr(0x80 | (value & 0x7f)) + chr(value >> 7)
+  value &= _UINT64_MASK
+  encoded = []
+  while value > 0x7f:
+    encoded.append(chr(0x80 | (value & 0x7f)))
+    value >>= 7
+  encoded.append(chr(value))
+  return ''.join(encoded)
+
+
+def Tag(field_number, wire_type):
+  """Returns the encoded key that starts every field."""
+  return Varint(field_number << 3 | wire_type)
+
+
+def LengthDelimited(data):
+  """Returns data preceded by its length, the value of a bytes field."""
+  return Varint(len(data)) + data
+
+
+def VarintField(field_number, value):
+  """Encodes an int32, int64, uint32, uint64, bool or enum field."""
+  return Tag(field_number, VARINT) + Varint(value)
+
+
+def BytesField(field_number, data):
+  """Encodes a bytes, string or embedded message field.
+
+  Args:
+    field_number: The number of the field.
+    data: The bytes, a unicode string, or a serialized message.
+
+  Returns:
+    The encoded field.
+  """
+  if isinstance(data, unicode):
+    data = data.encode('utf-8')
+  return Tag(field_number, LENGTH_DELIMITED) + LengthDelimited(data)
+
+
+def Fixed64Field(field_number, value):
+  """Encodes a fixed64 field."""
+  return Tag(field_number, FIXED64) + PackFixed64(value)
+
+
+def FloatField(field_number, value):
+  """Encodes a float field, rounding value to single precision."""
+  return Tag(field_number, FIXED32) + PackFloat(value)
+
+
+def PackedVarintField(field_number, values):
+  """Encodes a packed repeated varint field, or nothing if values is empty."""
+  if not values:
+    return ''
+  return BytesField(field_number, ''.join([Varint(value) for value in values]))
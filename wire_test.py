@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc. All Rights Reserved.
+"""Unit tests for wire.py."""
+
+import unittest
+
+import realtime_bidding_pb2
+import wire
+
+
+class WireTest(unittest.TestCase):
+  """Tests that encoded fields match the protocol buffer library."""
+
+  def testVarint(self):
+    """Tests encoding varints, including negative int32 values."""
+    self.assertEqual('\x00', wire.Varint(0))
+    self.assertEqual('\x01', wire.Varint(True))
+    self.assertEqual('\x7f', wire.Varint(127))
+    self.assertEqual('\xac\x02', wire.Varint(300))
+    self.assertEqual('\xff' * 9 + '\x01', wire.Varint(-1))
+
+  def testFieldsMatchSerializeToString(self):
+    """Tests each kind of field against a serialized message."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.id = '\x00\xff' * 8
+    bid_request.user_agent = 'agent'
+    bid_request.is_test = True
+    bid_request.cookie_age_seconds = 2592000
+    bid_request.publisher_settings_list_id = 93002305
+    bid_request.video.videoad_start_delay = -1
+    vertical = bid_request.detected_vertical.add()
+    vertical.id = 563
+    vertical.weight = 0.3
+    ad_slot = bid_request.adslot.add()
+    ad_slot.id = 7
+    ad_slot.allowed_vendor_type.extend([94, 303, 0])
+
+    vertical_data = (wire.VarintField(1, 563) + wire.FloatField(2, 0.3))
+    ad_slot_data = (wire.VarintField(1, 7) +
+                    wire.PackedVarintField(4, []) +
+                    wire.PackedVarintField(6, [94, 303, 0]))
+    encoded = ''.join([
+        wire.BytesField(2, '\x00\xff' * 8),
+        wire.BytesField(6, u'agent'),
+        wire.BytesField(13, vertical_data),
+        wire.BytesField(14, ad_slot_data),
+        wire.VarintField(15, True),
+        wire.BytesField(29, wire.VarintField(1, -1)),
+        wire.VarintField(31, 2592000),
+        wire.Fixed64Field(42, 93002305),
+    ])
+    self.assertEqual(bid_request.SerializeToString(), encoded)
+
+  def testOutOfOrderFieldsParse(self):
+    """Tests that fields in any order parse to the same message."""
+    bid_request = realtime_bidding_pb2.BidRequest()
+    bid_request.ParseFromString(wire.VarintField(15, True) +
+                                wire.BytesField(2, 'id'))
+    self.assertEqual('id', bid_request.id)
+    self.assertTrue(bid_request.is_test)
+
+
+if __name__ == '__main__':
+  unittest.main()